@@ -2,6 +2,8 @@
 ASGI config for authproxy project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests served through ASGI use authproxy.asgi_urls, which routes the rdf4j data-plane
+to async views, e.g. run with ``uvicorn authproxy.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -9,8 +11,23 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "authproxy.settings")
 
-application = get_asgi_application()
+
+class AuthproxyASGIHandler(ASGIHandler):
+    """ASGI handler that routes requests with the async url configuration"""
+
+    urlconf = "authproxy.asgi_urls"
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = self.urlconf
+        return request, error_response
+
+
+django.setup(set_prefix=False)
+application = AuthproxyASGIHandler()
@@ -0,0 +1,58 @@
+"""
+URL configuration of the authproxy when served through ASGI, see authproxy/asgi.py.
+
+The data-plane routes of rdf4j are served by async views, everything else falls back to authproxy.urls.
+"""
+
+from django.urls import include, path
+
+from rdf4j.views.rdf4j import async_repositories
+
+urlpatterns = [
+    path(
+        "repositories/<str:repository_id>",
+        async_repositories.RepositoryView.as_view(),
+        name="repository",
+    ),
+    path(
+        "repositories/<str:repository_id>/size",
+        async_repositories.repository_size,
+        name="repository_size",
+    ),
+    path(
+        "repositories/<str:repository_id>/contexts",
+        async_repositories.repository_contexts,
+        name="repository_contexts",
+    ),
+    path(
+        "repositories/<str:repository_id>/statements",
+        async_repositories.StatementsView.as_view(),
+        name="statements",
+    ),
+    path(
+        "repositories/<str:repository_id>/namespaces",
+        async_repositories.NamespacesView.as_view(),
+        name="namespaces",
+    ),
+    path(
+        "repositories/<str:repository_id>/namespaces/<str:namespaces_prefix>",
+        async_repositories.NamespacesPrefixView.as_view(),
+        name="namespaces_prefix",
+    ),
+    path(
+        "repositories/<str:repository_id>/rdf-graphs",
+        async_repositories.graphs,
+        name="graphs",
+    ),
+    path(
+        "repositories/<str:repository_id>/rdf-graphs/service",
+        async_repositories.GraphStoreView.as_view(),
+        name="graph_store",
+    ),
+    path(
+        "repositories/<str:repository_id>/rdf-graphs/<str:graph_name>",
+        async_repositories.GraphStoreView.as_view(),
+        name="named_graph",
+    ),
+    path("", include("authproxy.urls")),
+]
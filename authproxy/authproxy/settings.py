@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -86,6 +87,34 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# The shared cache is used for state that all worker processes need to agree on, e.g. generation
+# counters that invalidate in-process caches. It lives in shared memory (/dev/shm) when available.
+SHARED_CACHE = "shared"
+SHARED_CACHE_DIR = os.environ.get(
+    "AUTHPROXY_SHARED_CACHE_DIR",
+    (
+        "/dev/shm/authproxy"
+        if os.path.isdir("/dev/shm")
+        else os.path.join(tempfile.gettempdir(), "authproxy")
+    ),
+)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    SHARED_CACHE: {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": SHARED_CACHE_DIR,
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -136,15 +165,158 @@ RDF4J_URL = (
 RDF4J_REPOSITORY_PATH = "repositories/"
 # Request timeout for requests to the rdf4j backend in s.
 REQUEST_TIMEOUT = int(os.environ.get("RDF4J_TIMEOUT", 5))
+# Separate connect and read timeouts for the rdf4j backend in s.
+# The read timeout falls back to REQUEST_TIMEOUT.
+RDF4J_CONNECT_TIMEOUT = float(os.environ.get("RDF4J_CONNECT_TIMEOUT", 2))
+RDF4J_READ_TIMEOUT = float(os.environ.get("RDF4J_READ_TIMEOUT", REQUEST_TIMEOUT))
+# Number of keep-alive connections each worker process holds to the rdf4j backend.
+# 0 means "one per uwsgi thread" (or 10 when not running under uwsgi).
+RDF4J_POOL_SIZE = int(os.environ.get("RDF4J_POOL_SIZE", 0))
+# How long a request waits for a free pooled connection before failing in s.
+RDF4J_POOL_TIMEOUT = float(os.environ.get("RDF4J_POOL_TIMEOUT", 30))
+# Maximum number of connections the async (ASGI) proxy opens to the rdf4j backend per process.
+RDF4J_ASYNC_POOL_SIZE = int(os.environ.get("RDF4J_ASYNC_POOL_SIZE", 256))
+# Number of RDF4J repositories that are created at the same time by a bulk creation.
+REPOSITORY_PROVISIONING_WORKERS = int(
+    os.environ.get("REPOSITORY_PROVISIONING_WORKERS", 8)
+)
+# Repositories are created and deleted on RDF4J by the run_remote_jobs command, see rdf4j/jobs.py.
+# Failed jobs are retried up to REMOTE_JOB_MAX_ATTEMPTS times, the delay in s doubles every time.
+REMOTE_JOB_MAX_ATTEMPTS = int(os.environ.get("REMOTE_JOB_MAX_ATTEMPTS", 5))
+REMOTE_JOB_RETRY_DELAY = float(os.environ.get("REMOTE_JOB_RETRY_DELAY", 10))
+# Read timeout of the RDF4J requests of a job in s, deleting a large repository takes a while.
+REMOTE_JOB_TIMEOUT = float(os.environ.get("REMOTE_JOB_TIMEOUT", 600))
+# Bulk loads of N-Triples and N-Quads files, see rdf4j/bulk_load.py.
+# Number of statements per batch, every batch is loaded in its own RDF4J transaction.
+BULK_LOAD_BATCH_SIZE = int(os.environ.get("BULK_LOAD_BATCH_SIZE", 100000))
+# Number of batches that are loaded at the same time.
+BULK_LOAD_WORKERS = int(os.environ.get("BULK_LOAD_WORKERS", 4))
+# Read timeout of the RDF4J request of a batch in s.
+BULK_LOAD_TIMEOUT = float(os.environ.get("BULK_LOAD_TIMEOUT", 600))
+# Files uploaded to the bulk load API and their checkpoints are stored here.
+BULK_LOAD_DIR = os.environ.get(
+    "BULK_LOAD_DIR",
+    (
+        "/data/bulk-loads"
+        if os.path.isdir("/data")
+        else os.path.join(tempfile.gettempdir(), "authproxy-bulk-loads")
+    ),
+)
+# RDF4J transactions that are idle for this long in s are rolled back, see rdf4j/transactions.py.
+TRANSACTION_IDLE_TIMEOUT = int(os.environ.get("TRANSACTION_IDLE_TIMEOUT", 300))
 LOGIN_URL = "/admin"
+# Number of rows per page of the query console.
+SPARQL_RESULT_ROW_LIMIT = int(os.environ.get("SPARQL_RESULT_ROW_LIMIT", 1000))
+# Query results are buffered on disk, so that paging does not re-run the query, see rdf4j/cursors.py.
+SPARQL_CURSOR_DIR = os.environ.get(
+    "SPARQL_CURSOR_DIR", os.path.join(tempfile.gettempdir(), "authproxy-cursors")
+)
+# Time in s after which an unused cursor is removed.
+SPARQL_CURSOR_TTL = int(os.environ.get("SPARQL_CURSOR_TTL", 900))
+# Maximum size of the buffered results of one user in bytes.
+SPARQL_CURSOR_MAX_BYTES = int(
+    os.environ.get("SPARQL_CURSOR_MAX_BYTES", 100 * 1024 * 1024)
+)
+# Size of the per-process cache for SPARQL query results in compressed bytes, 0 disables the cache.
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 64 * 1024 * 1024))
+# Results larger than this (uncompressed) are not cached.
+QUERY_CACHE_MAX_ENTRY_SIZE = int(
+    os.environ.get("QUERY_CACHE_MAX_ENTRY_SIZE", 8 * 1024 * 1024)
+)
+# Encodings of the compressed responses of the RDF4J routes in the order of preference,
+# see rdf4j/compression.py. An empty list disables compression, zstd needs the zstandard package.
+COMPRESSION_ENCODINGS = [
+    encoding.strip()
+    for encoding in os.environ.get("COMPRESSION_ENCODINGS", "zstd,gzip").split(",")
+    if encoding.strip()
+]
+# Responses that are known to be smaller than this in bytes are not compressed.
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get("COMPRESSION_ZSTD_LEVEL", 3))
+# Maximum size of a gzip or zstd compressed upload in bytes once it is decompressed, 0 means unlimited.
+# Larger uploads are aborted with 413.
+COMPRESSED_UPLOAD_MAX_SIZE = int(
+    os.environ.get("COMPRESSED_UPLOAD_MAX_SIZE", 100 * 1024 * 1024 * 1024)
+)
+
+# Admission control for requests to RDF4J, see rdf4j/scheduler.py. All limits apply per worker process.
+# Maximum number of requests running on RDF4J at the same time,
+# 0 means the threads of a uwsgi worker or 16 for async workers
+SCHEDULER_GLOBAL_LIMIT = int(os.environ.get("SCHEDULER_GLOBAL_LIMIT", 0))
+# ... of a single user except admins and repository managers, 0 means no limit
+SCHEDULER_USER_LIMIT = int(os.environ.get("SCHEDULER_USER_LIMIT", 0))
+# ... on a single repository, 0 means no limit
+SCHEDULER_REPOSITORY_LIMIT = int(os.environ.get("SCHEDULER_REPOSITORY_LIMIT", 0))
+# Maximum number of waiting requests, further requests are answered with 503
+SCHEDULER_QUEUE_SIZE = int(os.environ.get("SCHEDULER_QUEUE_SIZE", 100))
+# Maximum number of waiting requests of a single user, further requests are answered with 429
+SCHEDULER_USER_QUEUE_SIZE = int(os.environ.get("SCHEDULER_USER_QUEUE_SIZE", 10))
+# Time in s a request waits for admission before it is answered with 503
+SCHEDULER_QUEUE_TIMEOUT = float(os.environ.get("SCHEDULER_QUEUE_TIMEOUT", 30))
+
+# Rate limits shared by all worker processes, see rdf4j/throttling.py.
+# Rates are <number>/<s|min|hour|day>, byte rates also take K, M and G (e.g. 10G/hour).
+# An empty rate disables the limit. The rates of a user can be overridden in the admin.
+THROTTLE_RATES = {
+    "ROLE_ADMIN": None,
+    "ROLE_REPO_MANAGER": os.environ.get("THROTTLE_RATE_REPO_MANAGER", "6000/min"),
+    "ROLE_USER": os.environ.get("THROTTLE_RATE_USER", "1200/min"),
+    "anonymous": os.environ.get("THROTTLE_RATE_ANONYMOUS", "300/min"),
+    # Requests to one repository from all users together
+    "repository": os.environ.get("THROTTLE_RATE_REPOSITORY", "12000/min"),
+}
+# Bytes sent to and received from RDF4J
+THROTTLE_BYTE_RATES = {
+    "ROLE_ADMIN": None,
+    "ROLE_REPO_MANAGER": os.environ.get("THROTTLE_BYTE_RATE_REPO_MANAGER", "50G/hour"),
+    "ROLE_USER": os.environ.get("THROTTLE_BYTE_RATE_USER", "10G/hour"),
+    "anonymous": os.environ.get("THROTTLE_BYTE_RATE_ANONYMOUS", "1G/hour"),
+    "repository": os.environ.get("THROTTLE_BYTE_RATE_REPOSITORY", "100G/hour"),
+}
+# File that holds the buckets, it lives in shared memory when available
+THROTTLE_STORE = os.environ.get(
+    "THROTTLE_STORE",
+    os.path.join(os.path.dirname(SHARED_CACHE_DIR), "authproxy-throttle"),
+)
+# Number of buckets in the file
+THROTTLE_SLOTS = int(os.environ.get("THROTTLE_SLOTS", 65536))
+
+# File that holds the generations, see rdf4j/generations.py. It lives in shared memory when available.
+GENERATION_STORE = os.environ.get(
+    "GENERATION_STORE",
+    os.path.join(os.path.dirname(SHARED_CACHE_DIR), "authproxy-generations"),
+)
+# Number of generations in the file, keys that share a slot are invalidated together
+GENERATION_SLOTS = int(os.environ.get("GENERATION_SLOTS", 1 << 20))
 
 # Set max upload size to 100MB
+# This only applies to buffered request bodies. Statement uploads are streamed to RDF4J
+# chunk by chunk and are not limited by this setting.
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600
 
+# How long successfully verified Basic auth credentials are remembered in s.
+BASIC_AUTH_CACHE_TTL = int(os.environ.get("BASIC_AUTH_CACHE_TTL", 300))
+
+# Lifetime of API tokens in s, 0 means tokens never expire.
+# Expired tokens are replaced with a new one by /api-token-auth/.
+TOKEN_TTL = int(os.environ.get("TOKEN_TTL", 0))
+# Number of API tokens each worker process keeps in memory.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
-        "rest_framework.authentication.BasicAuthentication",
+        "rdf4j.authentication.CachedTokenAuthentication",
+        "rdf4j.authentication.CachedBasicAuthentication",
+    ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "rdf4j.throttling.UserThrottle",
+        "rdf4j.throttling.TokenThrottle",
+        "rdf4j.throttling.RepositoryThrottle",
+        "rdf4j.throttling.ByteThrottle",
     ],
     "DEFAULT_CONTENT_NEGOTIATION_CLASS": "rdf4j.negotiation.IgnoreClientContentNegotiation",
+    # Number of proxies in front of the authproxy, the bundled nginx sets X-Forwarded-For.
+    # Anonymous clients are told apart by the address that the last proxy saw.
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 1)),
 }
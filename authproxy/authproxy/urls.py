@@ -17,11 +17,12 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import include, path
-from rest_framework.authtoken import views
+
+from rdf4j.views import authtoken
 
 urlpatterns = [
     path("", include("rdf4j.urls")),
     path("admin/", admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')), # TODO: Check if this is needed
-    path('api-token-auth/', views.obtain_auth_token)
+    path('api-token-auth/', authtoken.obtain_auth_token)
 ]
@@ -0,0 +1,99 @@
+"""Per-user snapshots of the repository permissions.
+
+Building a snapshot takes a single query, afterwards checking a permission is a set lookup.
+Snapshots are kept per worker process and rebuilt when the generation of the user or the
+global ACL generation changes, see generations.py.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+
+from . import generations
+
+# Number of user snapshots kept per worker process
+MAX_SNAPSHOTS = 10000
+
+# Repository id that stands for every repository, e.g. READ_REPO_*
+WILDCARD = "*"
+
+
+class UserAcl:
+    """Snapshot of the repository permissions of one user"""
+
+    def __init__(self, codenames, generation: tuple[int, ...]) -> None:
+        # Imported here since models imports this module
+        from .models import RepoPermission  # pylint: disable=import-outside-toplevel
+
+        self.generation = generation
+        # Map from repository id -> names of the granted permissions
+        self.repositories: dict[str, set[str]] = {}
+        prefixes = {
+            RepoPermission.build_codename_prefix(name): name
+            for name in RepoPermission.permission_functions()
+        }
+        for codename in codenames:
+            for prefix, name in prefixes.items():
+                if codename.startswith(prefix):
+                    repository_id = codename[len(prefix) :]
+                    self.repositories.setdefault(repository_id, set()).add(name)
+
+    def allows(self, permission_name: str, repository_id: str) -> bool:
+        """Check if the permission is granted on the repository"""
+        for key in (repository_id, WILDCARD):
+            if permission_name in self.repositories.get(key, ()):
+                return True
+        return False
+
+
+class AllowAll(UserAcl):
+    """Snapshot for active superusers, who implicitly have all permissions"""
+
+    def allows(self, permission_name: str, repository_id: str) -> bool:
+        return True
+
+
+_snapshots: OrderedDict[int, UserAcl] = OrderedDict()
+_lock = threading.Lock()
+
+
+def build(user, generation: tuple[int, ...]) -> UserAcl:
+    """Build the snapshot of a user with a single query"""
+    if not user.is_active:
+        return UserAcl([], generation)
+    if user.is_superuser:
+        return AllowAll([], generation)
+    codenames = (
+        Permission.objects.filter(
+            Q(user=user) | Q(group__user=user), content_type__app_label="rdf4j"
+        )
+        .values_list("codename", flat=True)
+        .distinct()
+    )
+    return UserAcl(codenames, generation)
+
+
+def for_user(user) -> UserAcl:
+    """Get the (cached) snapshot of a user"""
+    # Read the generation before building, so changes during the build invalidate the snapshot
+    generation = generations.get_many(generations.ACL, generations.user_key(user.pk))
+    with _lock:
+        acl = _snapshots.get(user.pk)
+        if acl is not None and acl.generation == generation:
+            _snapshots.move_to_end(user.pk)
+            return acl
+
+    acl = build(user, generation)
+    with _lock:
+        _snapshots[user.pk] = acl
+        _snapshots.move_to_end(user.pk)
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return acl
+
+
+def has_repository_permission(user, permission_name: str, repository_id: str) -> bool:
+    """Check if an authenticated user has a permission on a repository"""
+    return for_user(user).allows(permission_name, repository_id)
@@ -1,11 +1,13 @@
 from typing import Any
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Permission
 from django.http import HttpRequest
+from urllib3.exceptions import HTTPError
 
-from .models import RepoPermission, Repository, User
+from . import jobs, reconcile, transactions
+from .models import RemoteJob, RepoPermission, Repository, Transaction, User
 
 from django.utils.safestring import mark_safe
 
@@ -19,6 +21,18 @@ class RepositoryAdmin(admin.ModelAdmin):
         "query",
         "update",
     )
+    actions = ["reconcile"]
+
+    @admin.action(description="Reconcile the selected repositories with RDF4J")
+    def reconcile(self, request, queryset):
+        try:
+            report = reconcile.reconcile(queryset)
+        except Repository.NoRemoteError as e:
+            self.message_user(request, str(e), messages.ERROR)
+            return
+        self.message_user(request, report.summary())
+        for slug, error in report.errors.items():
+            self.message_user(request, f"{slug}: {error}", messages.ERROR)
 
     def query(self, obj: Repository):
         return mark_safe(
@@ -34,6 +48,73 @@ class RepositoryAdmin(admin.ModelAdmin):
 # admin.site.register(Repository)
 
 
+@admin.register(RemoteJob)
+class RemoteJobAdmin(admin.ModelAdmin):
+    """Status of the creations and deletions of repositories on RDF4J"""
+
+    list_display = (
+        "repository_slug",
+        "action",
+        "state",
+        "attempts",
+        "run_after",
+        "updated",
+    )
+    list_filter = ("state", "action")
+    search_fields = ("repository_slug",)
+    readonly_fields = (
+        "action",
+        "repository_slug",
+        "state",
+        "attempts",
+        "run_after",
+        "last_error",
+        "created",
+        "updated",
+    )
+    actions = ["retry"]
+
+    @admin.action(description="Retry the selected failed jobs")
+    def retry(self, request, queryset):
+        count = jobs.retry(queryset)
+        self.message_user(request, f"Queued {count} jobs again.")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Transaction)
+class TransactionAdmin(admin.ModelAdmin):
+    """Open RDF4J transactions"""
+
+    list_display = (
+        "transaction_id",
+        "repository_slug",
+        "owner",
+        "created",
+        "last_used",
+    )
+    search_fields = ("repository_slug", "owner__username")
+    readonly_fields = list_display
+    actions = ["rollback"]
+
+    @admin.action(description="Roll back the selected transactions")
+    def rollback(self, request, queryset):
+        count = 0
+        for transaction in queryset:
+            try:
+                transactions.rollback(transaction)
+            except HTTPError as e:
+                self.message_user(request, f"{transaction}: {e}", messages.ERROR)
+                continue
+            transactions.forget(transaction.transaction_id)
+            count += 1
+        self.message_user(request, f"Rolled back {count} transactions.")
+
+    def has_add_permission(self, request):
+        return False
+
+
 class RepoPermissionAdmin(admin.ModelAdmin):
     """Admin model to only show the name of the permission"""
 
@@ -100,7 +181,16 @@ class CustomUserAdmin(UserAdmin):
                         "ignore_shared_queries",
                     ],
                 },
-            )
+            ),
+            (
+                "Rate limits",
+                {
+                    "fields": [
+                        "throttle_rate",
+                        "throttle_byte_rate",
+                    ],
+                },
+            ),
         ]
 
         return modified_fieldset + rdf4j_fieldset
@@ -0,0 +1,124 @@
+"""Authentication classes for rest_framework"""
+
+import copy
+import hashlib
+import hmac
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from authproxy.settings import (
+    BASIC_AUTH_CACHE_TTL,
+    SHARED_CACHE,
+    TOKEN_CACHE_SIZE,
+    TOKEN_TTL,
+)
+
+from . import generations
+from .models import User
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """BasicAuthentication that remembers successfully verified credentials.
+
+    Verifying a password with Django's password hashers takes a lot of time, which adds up for
+    clients that send many requests with Basic auth. Verified credentials are remembered in the
+    shared cache under a keyed digest for BASIC_AUTH_CACHE_TTL seconds. Entries are only valid
+    as long as the generation of the user doesn't change, i.e. the user is not saved (e.g. after
+    set_password or set_settings) or deleted.
+    """
+
+    def credentials_key(self, userid: str, password: str) -> str:
+        """Cache key for a pair of credentials, the password never ends up in the cache"""
+        digest = hmac.new(
+            settings.SECRET_KEY.encode("utf-8"),
+            f"{userid}\0{password}".encode("utf-8"),
+            hashlib.sha256,
+        ).hexdigest()
+        return f"basic-auth:{digest}"
+
+    def authenticate_credentials(self, userid, password, request=None):
+        cache = caches[SHARED_CACHE]
+        key = self.credentials_key(userid, password)
+
+        cached = cache.get(key)
+        if cached is not None:
+            user_id, generation = cached
+            if generation == generations.get(generations.user_key(user_id)):
+                user = User.objects.filter(pk=user_id, is_active=True).first()
+                if user is not None:
+                    return (user, None)
+            cache.delete(key)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+
+        # Make sure the password didn't change while we were verifying it
+        generation = generations.get(generations.user_key(user.pk))
+        if User.objects.filter(pk=user.pk, password=user.password).exists():
+            cache.set(key, (user.pk, generation), timeout=BASIC_AUTH_CACHE_TTL)
+        return (user, auth)
+
+
+def token_expires(token: Token) -> datetime | None:
+    """Get the point in time when a token expires, None if tokens don't expire"""
+    if not TOKEN_TTL:
+        return None
+    return token.created + timedelta(seconds=TOKEN_TTL)
+
+
+def token_expired(token: Token) -> bool:
+    """Check if a token is expired"""
+    expires = token_expires(token)
+    return expires is not None and expires <= timezone.now()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that resolves tokens from memory.
+
+    Every worker process keeps the most recently used TOKEN_CACHE_SIZE tokens along with their
+    users (including role and app settings). Entries are only valid as long as the generation of
+    the user doesn't change, i.e. the user is not saved or deleted and none of their tokens is
+    deleted. Tokens expire TOKEN_TTL seconds after they were created, unless TOKEN_TTL is 0.
+    """
+
+    _tokens: OrderedDict[str, tuple[Token, int]] = OrderedDict()
+    _lock = threading.Lock()
+
+    def authenticate_credentials(self, key):
+        with self._lock:
+            cached = self._tokens.get(key)
+            if cached is not None:
+                self._tokens.move_to_end(key)
+
+        if cached is not None:
+            token, generation = cached
+            if generation != generations.get(generations.user_key(token.user_id)):
+                with self._lock:
+                    self._tokens.pop(key, None)
+                cached = None
+
+        if cached is None:
+            user_id = (
+                Token.objects.filter(key=key).values_list("user_id", flat=True).first()
+            )
+            if user_id is None:
+                raise exceptions.AuthenticationFailed("Invalid token.")
+            # Read the generation before loading, so changes during the load invalidate the entry
+            generation = generations.get(generations.user_key(user_id))
+            _, token = super().authenticate_credentials(key)
+            with self._lock:
+                self._tokens[key] = (token, generation)
+                while len(self._tokens) > TOKEN_CACHE_SIZE:
+                    self._tokens.popitem(last=False)
+
+        if token_expired(token):
+            raise exceptions.AuthenticationFailed("Token has expired.")
+        # Hand out copies, so requests can't change the cached user
+        return (copy.copy(token.user), token)
@@ -0,0 +1,270 @@
+"""Shared HTTP client for all traffic from the authproxy to the RDF4J server.
+
+Every worker process holds exactly one keep-alive connection pool to RDF4J.
+The pool is sized to the number of threads of the worker, so a request never has to pay
+for a fresh TCP connection once the worker is warmed up.
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, AsyncIterator, Iterator
+
+import httpx
+import urllib3
+from urllib3.connectionpool import (
+    HTTPConnectionPool,
+    HTTPSConnectionPool,
+)
+from urllib3.util import Retry, Timeout, parse_url
+
+from authproxy.settings import (
+    RDF4J_ASYNC_POOL_SIZE,
+    RDF4J_CONNECT_TIMEOUT,
+    RDF4J_POOL_SIZE,
+    RDF4J_POOL_TIMEOUT,
+    RDF4J_READ_TIMEOUT,
+    RDF4J_REPOSITORY_PATH,
+    RDF4J_URL,
+)
+
+# Size of the chunks that are read from streamed RDF4J responses
+CHUNK_SIZE = 64 * 1024
+
+# Bodies that can be re-sent may be retried on a stale keep-alive connection.
+# Streamed bodies are consumed while sending, so only connection errors are retried for them.
+RETRIES = Retry(total=2, redirect=5, raise_on_status=False)
+STREAM_RETRIES = Retry(
+    total=2, connect=2, read=0, other=0, redirect=0, raise_on_status=False
+)
+
+
+class PoolStats:
+    """Thread safe counters for the connection pool"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def increment(self, name: str) -> None:
+        """Increment the counter with the given name"""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> dict[str, int]:
+        """Return a snapshot of all counters"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "waits": self.waits}
+
+
+STATS = PoolStats()
+
+
+class CountingPoolMixin:
+    """Count pool hits (reused connection), misses (new connection) and waits (pool exhausted)"""
+
+    def _get_conn(self, timeout=None):
+        if self.pool is not None and self.pool.empty():
+            STATS.increment("waits")
+        conn = super()._get_conn(timeout)  # type: ignore[misc]
+        # Only connections that are still connected save us the TCP setup
+        STATS.increment("misses" if conn.sock is None else "hits")
+        return conn
+
+
+class CountingHTTPConnectionPool(CountingPoolMixin, HTTPConnectionPool):
+    """HTTP connection pool with statistics"""
+
+
+class CountingHTTPSConnectionPool(CountingPoolMixin, HTTPSConnectionPool):
+    """HTTPS connection pool with statistics"""
+
+
+def worker_threads() -> int | None:
+    """Get the number of threads of the uwsgi worker, None when not running under uwsgi"""
+    try:
+        import uwsgi  # pylint: disable=import-outside-toplevel,import-error
+
+        threads = uwsgi.opt.get("threads", 1)
+        if isinstance(threads, list):
+            threads = threads[-1]
+        return max(int(threads), 1)
+    except ImportError:
+        return None
+
+
+def pool_size() -> int:
+    """Get the number of connections per worker process.
+
+    Unless configured explicitly this is the number of threads of the uwsgi worker.
+    """
+    if RDF4J_POOL_SIZE:
+        return RDF4J_POOL_SIZE
+    return worker_threads() or 10
+
+
+_pool: HTTPConnectionPool | None = None
+_pool_pid: int | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> HTTPConnectionPool:
+    """Get the connection pool of this worker process.
+
+    The pool is created lazily, so that forked workers never share sockets with their parent.
+    """
+    global _pool, _pool_pid  # pylint: disable=global-statement
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = create_pool(pool_size())
+            _pool_pid = pid
+    return _pool
+
+
+def create_pool(maxsize: int) -> HTTPConnectionPool:
+    """Create a pool of at most maxsize connections to RDF4J.
+
+    get_pool() is shared by the request threads of the worker, work that runs next to them
+    uses a pool of its own.
+    """
+    rdf4j_url = parse_url(RDF4J_URL)
+    pool_cls = (
+        CountingHTTPSConnectionPool
+        if rdf4j_url.scheme == "https"
+        else CountingHTTPConnectionPool
+    )
+    return pool_cls(
+        host=rdf4j_url.host,
+        port=rdf4j_url.port,
+        maxsize=maxsize,
+        block=True,
+        timeout=Timeout(connect=RDF4J_CONNECT_TIMEOUT, read=RDF4J_READ_TIMEOUT),
+    )
+
+
+def url(path: str = "") -> str:
+    """Build the absolute RDF4J url for a path relative to the RDF4J server root"""
+    return f"{RDF4J_URL}{path}"
+
+
+def repository_url(repository_id: str, *parts: str) -> str:
+    """Build the absolute RDF4J url of a repository or one of its sub routes"""
+    return url("/".join([f"{RDF4J_REPOSITORY_PATH}{repository_id}", *parts]))
+
+
+def request(
+    method: str,
+    url: str,  # pylint: disable=redefined-outer-name
+    body: Any = None,
+    headers: dict | None = None,
+    stream: bool = False,
+    timeout: float | Timeout | None = None,
+    pool: HTTPConnectionPool | None = None,
+) -> urllib3.BaseHTTPResponse:
+    """Send a request to RDF4J over the pooled connections.
+
+    Args:
+        method (str): The HTTP method
+        url (str): The absolute url, see url() and repository_url()
+        body (Any): bytes, str or an iterable of bytes, which is sent with chunked transfer encoding
+        headers (dict | None): The request headers
+        stream (bool): Do not preload the response body.
+            Use iter_response() to read it, so the connection is returned to the pool.
+        timeout (float | Timeout | None): Override the default connect/read timeouts
+        pool (HTTPConnectionPool | None): Use this pool instead of the one of the worker process
+
+    Raises:
+        urllib3.exceptions.HTTPError: When RDF4J cannot be reached
+
+    Returns:
+        urllib3.BaseHTTPResponse: The response from RDF4J
+    """
+    replayable = body is None or isinstance(body, (bytes, str))
+    return (pool or get_pool()).urlopen(
+        method=method,
+        # The pool is bound to the RDF4J host, so only send the origin-form of the url
+        url=parse_url(url).request_uri,
+        body=body,
+        headers=headers,
+        retries=RETRIES if replayable else STREAM_RETRIES,
+        redirect=replayable,
+        timeout=timeout if timeout is not None else Timeout.DEFAULT_TIMEOUT,
+        pool_timeout=RDF4J_POOL_TIMEOUT,
+        preload_content=not stream,
+        release_conn=not stream,
+    )
+
+
+def iter_response(
+    response: urllib3.BaseHTTPResponse, chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Stream the body of a response and hand the connection back to the pool afterwards"""
+    complete = False
+    try:
+        yield from response.stream(chunk_size)
+        complete = True
+    finally:
+        # A half read connection can't be reused, so close it before releasing it.
+        if not complete:
+            response.close()
+        response.release_conn()
+
+
+_async_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, httpx.AsyncClient
+] = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Get the non-blocking client for the running event loop.
+
+    Used by the ASGI views, the connections are pooled per event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=RDF4J_ASYNC_POOL_SIZE,
+                max_keepalive_connections=RDF4J_ASYNC_POOL_SIZE,
+            ),
+            timeout=httpx.Timeout(
+                connect=RDF4J_CONNECT_TIMEOUT,
+                read=RDF4J_READ_TIMEOUT,
+                write=RDF4J_READ_TIMEOUT,
+                pool=RDF4J_POOL_TIMEOUT,
+            ),
+            follow_redirects=False,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def aiter_response(
+    response: httpx.Response, chunk_size: int = CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """Stream the body of an async response and hand the connection back to the pool afterwards"""
+    try:
+        async for chunk in response.aiter_bytes(chunk_size):
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+def stats() -> dict[str, Any]:
+    """Statistics of the connection pool of this worker process"""
+    pool = _pool if _pool_pid == os.getpid() else None
+    return {
+        "pid": os.getpid(),
+        "size": pool_size(),
+        "available": (
+            pool.pool.qsize() if pool is not None and pool.pool is not None else 0
+        ),
+        **STATS.as_dict(),
+    }
@@ -0,0 +1,433 @@
+"""Parallel loading of large N-Triples and N-Quads files.
+
+A large dump posted to the statements route in one request runs into timeouts and becomes one huge
+RDF4J transaction. The loader splits the file at line boundaries into batches of BULK_LOAD_BATCH_SIZE
+statements instead. Every batch is posted to RDF4J on its own, so it is committed in its own
+transaction, and BULK_LOAD_WORKERS batches are posted at the same time over a connection pool of
+the load.
+
+After every batch the progress is written to a checkpoint file. Batches finish out of order, so the
+checkpoint holds the offset up to which every batch is loaded and the batches after it that are
+loaded as well. An interrupted load continues from its checkpoint.
+
+Blank node labels are scoped to a batch by RDF4J, so a blank node whose statements end up in
+different batches becomes several blank nodes.
+
+Files uploaded to the API are stored in BULK_LOAD_DIR and queued. The run_bulk_loads command runs
+the queued loads, so they don't take threads and connections from the uwsgi workers, see
+run_pending().
+"""
+
+import fcntl
+import glob
+import gzip
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+from authproxy.settings import (
+    BULK_LOAD_BATCH_SIZE,
+    BULK_LOAD_DIR,
+    BULK_LOAD_TIMEOUT,
+    BULK_LOAD_WORKERS,
+)
+
+from . import backend
+from .models import Repository
+
+# Line based RDF formats by file extension
+CONTENT_TYPES = {
+    ".nt": "application/n-triples",
+    ".nq": "application/n-quads",
+}
+
+# States of a load
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Running loads whose checkpoint was not written for this long belong to a worker that died
+STALE_AFTER = 2 * BULK_LOAD_TIMEOUT
+
+_LOAD_ID = re.compile(r"^[0-9a-f]{16}$")
+
+
+class BulkLoadError(Exception):
+    """A batch could not be loaded, the checkpoint holds the progress so far"""
+
+
+def content_type_for(path: str) -> str:
+    """Guess the content type from the file extension, a .gz suffix is ignored
+
+    Raises:
+        ValueError: When the file is neither N-Triples nor N-Quads
+    """
+    name = path[: -len(".gz")] if path.endswith(".gz") else path
+    content_type = CONTENT_TYPES.get(os.path.splitext(name)[1].lower())
+    if content_type is None:
+        raise ValueError(
+            f"Can't tell the format of {path}, expected {' or '.join(CONTENT_TYPES)}"
+        )
+    return content_type
+
+
+class Checkpoint:
+    """Progress of a load, stored as JSON next to the loaded file"""
+
+    def __init__(
+        self,
+        path: str,
+        repository_id: str,
+        data_path: str,
+        content_type: str,
+        batch_size: int,
+    ) -> None:
+        self.path = path
+        self.repository_id = repository_id
+        self.data_path = data_path
+        self.content_type = content_type
+        self.batch_size = batch_size
+        self.state = PENDING
+        self.error = ""
+        # Every batch before this one is loaded, it starts at offset
+        self.batch = 0
+        self.offset = 0
+        # Loaded batches after self.batch -> their end offset
+        self.done: dict[int, int] = {}
+        self.statements = 0
+        self.batches = 0
+        # Statements per second of the current run
+        self.rate = 0.0
+        self.updated = time.time()
+
+    @classmethod
+    def read(cls, path: str) -> "Checkpoint | None":
+        """Read a checkpoint, None if there is none"""
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        checkpoint = cls(
+            path,
+            data["repository"],
+            data["dataPath"],
+            data["contentType"],
+            data["batchSize"],
+        )
+        checkpoint.state = data["state"]
+        checkpoint.error = data["error"]
+        checkpoint.batch = data["batch"]
+        checkpoint.offset = data["offset"]
+        checkpoint.done = {int(number): end for number, end in data["done"].items()}
+        checkpoint.statements = data["statements"]
+        checkpoint.batches = data["batches"]
+        checkpoint.rate = data["statementsPerSecond"]
+        checkpoint.updated = data["updated"]
+        return checkpoint
+
+    def save(self) -> None:
+        """Write the checkpoint, a crash never leaves a partially written file behind"""
+        self.updated = time.time()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file)
+        os.replace(tmp_path, self.path)
+
+    def complete(self, number: int, end: int, statements: int) -> None:
+        """Record a loaded batch"""
+        self.done[number] = end
+        self.statements += statements
+        self.batches += 1
+        while self.batch in self.done:
+            self.offset = self.done.pop(self.batch)
+            self.batch += 1
+
+    @property
+    def running(self) -> bool:
+        """Whether the load is running in some process"""
+        return self.state == RUNNING and time.time() - self.updated < STALE_AFTER
+
+    def to_dict(self) -> dict:
+        """Normalize the checkpoint into a dict, also used for the status route"""
+        return {
+            "repository": self.repository_id,
+            "dataPath": self.data_path,
+            "contentType": self.content_type,
+            "batchSize": self.batch_size,
+            "state": self.state,
+            "error": self.error,
+            "batch": self.batch,
+            "offset": self.offset,
+            "done": self.done,
+            "statements": self.statements,
+            "batches": self.batches,
+            "statementsPerSecond": self.rate,
+            "updated": self.updated,
+        }
+
+
+def open_data(path: str) -> BinaryIO:
+    """Open a file for reading, gzip compressed files are decompressed"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+    return open(path, "rb")
+
+
+def iter_batches(
+    lines: Iterable[bytes], offset: int, number: int, batch_size: int
+) -> Iterator[tuple[int, int, bytes, int]]:
+    """Split lines into batches of batch_size statements
+
+    Args:
+        lines (Iterable[bytes]): The lines of the file, starting at offset
+        offset (int): Offset of the first line in the file
+        number (int): Number of the first batch
+        batch_size (int): Statements per batch, comments and empty lines don't count
+
+    Yields:
+        tuple[int, int, bytes, int]: The number, end offset, body and number of statements of a batch
+    """
+    batch: list[bytes] = []
+    statements = 0
+    for line in lines:
+        offset += len(line)
+        batch.append(line)
+        stripped = line.strip()
+        if stripped and not stripped.startswith(b"#"):
+            statements += 1
+            if statements == batch_size:
+                yield number, offset, b"".join(batch), statements
+                number += 1
+                batch = []
+                statements = 0
+    if batch:
+        yield number, offset, b"".join(batch), statements
+
+
+def load(
+    repository_id: str,
+    data_path: str,
+    content_type: str | None = None,
+    batch_size: int | None = None,
+    workers: int | None = None,
+    checkpoint_path: str | None = None,
+    restart: bool = False,
+    on_progress: Callable[[Checkpoint], None] | None = None,
+) -> Checkpoint:
+    """Load a file into a repository in parallel batches, continuing from its checkpoint
+
+    Args:
+        repository_id (str): The repository
+        data_path (str): N-Triples or N-Quads file, optionally gzip compressed
+        content_type (str | None): Content type of the file, guessed from the extension by default
+        batch_size (int | None): Statements per batch, defaults to BULK_LOAD_BATCH_SIZE.
+            A resumed load keeps the batch size of its checkpoint.
+        workers (int | None): Batches loaded at the same time, defaults to BULK_LOAD_WORKERS
+        checkpoint_path (str | None): Defaults to the data path with a .checkpoint suffix
+        restart (bool): Ignore an existing checkpoint and start from the beginning
+        on_progress (Callable[[Checkpoint], None] | None): Called after every loaded batch
+
+    Raises:
+        ValueError: When the format of the file is unknown
+        BulkLoadError: When a batch could not be loaded. The batches that were already
+            sent finish first, so the checkpoint is up to date.
+
+    Returns:
+        Checkpoint: The finished checkpoint
+    """
+    checkpoint_path = checkpoint_path or f"{data_path}.checkpoint"
+    checkpoint = None if restart else Checkpoint.read(checkpoint_path)
+    if checkpoint is None:
+        checkpoint = Checkpoint(
+            checkpoint_path,
+            repository_id,
+            data_path,
+            content_type or content_type_for(data_path),
+            batch_size or BULK_LOAD_BATCH_SIZE,
+        )
+    if checkpoint.state == DONE:
+        return checkpoint
+    if checkpoint.running:
+        raise BulkLoadError(f"The load of {data_path} is already running")
+    workers = workers or BULK_LOAD_WORKERS
+    checkpoint.state = RUNNING
+    checkpoint.error = ""
+    checkpoint.save()
+
+    url = backend.repository_url(repository_id, "statements")
+    headers = {"Content-Type": checkpoint.content_type}
+    # Every worker gets a connection, without waiting for the connections of other work
+    pool = backend.create_pool(workers)
+    lock = threading.Lock()
+    # Bounds the batches held in memory
+    slots = threading.BoundedSemaphore(2 * workers)
+    errors: list[Exception] = []
+    start = time.monotonic()
+    statements_before = checkpoint.statements
+
+    def post(number: int, end: int, body: bytes, statements: int) -> None:
+        try:
+            response = backend.request(
+                "POST",
+                url,
+                body=body,
+                headers=headers,
+                timeout=BULK_LOAD_TIMEOUT,
+                pool=pool,
+            )
+            if response.status not in (200, 204):
+                message = response.data.decode("utf-8", errors="replace")[:500]
+                raise BulkLoadError(
+                    f"Batch {number} failed with status {response.status}: {message}"
+                )
+            with lock:
+                checkpoint.complete(number, end, statements)
+                elapsed = time.monotonic() - start
+                checkpoint.rate = (
+                    (checkpoint.statements - statements_before) / elapsed
+                    if elapsed
+                    else 0.0
+                )
+                checkpoint.save()
+                if on_progress is not None:
+                    on_progress(checkpoint)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            with lock:
+                errors.append(e)
+        finally:
+            slots.release()
+
+    try:
+        with open_data(data_path) as data, ThreadPoolExecutor(workers) as executor:
+            data.seek(checkpoint.offset)
+            for number, end, body, statements in iter_batches(
+                data, checkpoint.offset, checkpoint.batch, checkpoint.batch_size
+            ):
+                if errors:
+                    break
+                # Loaded before the load was interrupted
+                if number in checkpoint.done:
+                    continue
+                slots.acquire()
+                executor.submit(post, number, end, body, statements)
+    except OSError as e:
+        errors.append(e)
+    finally:
+        pool.close()
+        Repository.mark_written(repository_id)
+
+    if errors:
+        checkpoint.state = FAILED
+        checkpoint.error = str(errors[0])
+        checkpoint.save()
+        raise BulkLoadError(checkpoint.error) from errors[0]
+    checkpoint.state = DONE
+    checkpoint.save()
+    return checkpoint
+
+
+def checkpoint_path_for(load_id: str) -> str | None:
+    """Checkpoint of a load started through the API, None for invalid ids"""
+    if not _LOAD_ID.match(load_id):
+        return None
+    return os.path.join(BULK_LOAD_DIR, f"{load_id}.checkpoint")
+
+
+def spool(repository_id: str, chunks: Iterable[bytes], content_type: str) -> str:
+    """Store an uploaded file for a load and create its checkpoint
+
+    Returns:
+        str: The id of the load
+    """
+    os.makedirs(BULK_LOAD_DIR, exist_ok=True)
+    load_id = secrets.token_hex(8)
+    data_path = os.path.join(BULK_LOAD_DIR, f"{load_id}.data")
+    try:
+        with open(data_path, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+    except BaseException:
+        os.remove(data_path)
+        raise
+    Checkpoint(
+        checkpoint_path_for(load_id),  # type: ignore[arg-type]
+        repository_id,
+        data_path,
+        content_type,
+        BULK_LOAD_BATCH_SIZE,
+    ).save()
+    return load_id
+
+
+def queue(checkpoint: Checkpoint) -> bool:
+    """Queue an interrupted or failed load to be resumed by run_pending()
+
+    Returns:
+        bool: Whether the load was queued, False when it is running or done
+    """
+    if checkpoint.running or checkpoint.state == DONE:
+        return False
+    checkpoint.state = PENDING
+    checkpoint.error = ""
+    checkpoint.save()
+    return True
+
+
+def run_pending() -> int:
+    """Run the queued loads in BULK_LOAD_DIR one after the other, the oldest first
+
+    A load is locked while it runs, so several runners never load the same file.
+
+    Returns:
+        int: The number of loads that were run
+    """
+    checkpoints = [
+        checkpoint
+        for path in glob.glob(os.path.join(BULK_LOAD_DIR, "*.checkpoint"))
+        if (checkpoint := Checkpoint.read(path)) is not None
+        and checkpoint.state == PENDING
+    ]
+    return sum(
+        _run(checkpoint)
+        for checkpoint in sorted(checkpoints, key=lambda checkpoint: checkpoint.updated)
+    )
+
+
+def _run(checkpoint: Checkpoint) -> bool:
+    """Run a queued load, unless another runner has locked it
+
+    Returns:
+        bool: Whether the load was run
+    """
+    try:
+        with open(checkpoint.data_path, "rb") as data:
+            try:
+                fcntl.flock(data, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            # Another runner might have run it in the meantime
+            checkpoint = Checkpoint.read(checkpoint.path) or checkpoint
+            if checkpoint.state != PENDING:
+                return False
+            try:
+                load(
+                    checkpoint.repository_id,
+                    checkpoint.data_path,
+                    checkpoint_path=checkpoint.path,
+                )
+            except BulkLoadError:
+                # The error is stored in the checkpoint
+                return True
+    except FileNotFoundError:
+        # Loaded by another runner, which removed the file
+        return False
+    # The checkpoint is kept for the status route
+    os.remove(checkpoint.data_path)
+    return True
@@ -0,0 +1,366 @@
+"""Compression of the responses that are streamed from RDF4J.
+
+RDF4J runs next to the authproxy, so its responses are requested uncompressed. They are
+compressed on the fly with zstd or gzip, depending on the Accept-Encoding header of the client.
+Every chunk is compressed as it is streamed, so exports of any size only need a bounded amount
+of memory. zstd is only offered when the zstandard package is installed.
+
+The query cache stores the uncompressed bodies, so compression is applied after it.
+
+Statement uploads may be sent with Content-Encoding gzip or zstd. They are decompressed in pieces of
+bounded size while they are streamed to RDF4J, which always receives the uncompressed body.
+The decompressed size of an upload is limited by COMPRESSED_UPLOAD_MAX_SIZE.
+"""
+
+import gzip
+import threading
+import zlib
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from authproxy.settings import (
+    COMPRESSION_ENCODINGS,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_MIN_SIZE,
+    COMPRESSION_ZSTD_LEVEL,
+    COMPRESSED_UPLOAD_MAX_SIZE,
+)
+
+from .backend import CHUNK_SIZE
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# Supported encodings in the order of preference
+ENCODINGS = tuple(
+    encoding
+    for encoding in COMPRESSION_ENCODINGS
+    if encoding == GZIP or (encoding == ZSTD and zstandard is not None)
+)
+
+# Encodings accepted for uploaded request bodies
+DECODINGS = (GZIP, ZSTD) if zstandard is not None else (GZIP,)
+# Compressed bytes fed to zstd at once, an RLE block of 4 bytes decompresses to up to 128KB
+_ZSTD_FEED_SIZE = 1024
+# Truncated gzip bodies raise EOFError
+_DECOMPRESSION_ERRORS = (gzip.BadGzipFile, EOFError, zlib.error) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+# Content types that are worth compressing besides text/*, *+json and *+xml
+_COMPRESSIBLE = {
+    "application/json",
+    "application/xml",
+    "application/n-triples",
+    "application/n-quads",
+    "application/trig",
+    "application/x-trig",
+    "application/x-turtle",
+    "application/sparql-results+json",
+    "application/sparql-results+xml",
+    "application/x-binary-rdf",
+    "application/x-binary-rdf-results-table",
+}
+
+
+def negotiate(request: HttpRequest) -> str | None:
+    """Choose the encoding of the response from the Accept-Encoding header, None means identity"""
+    header = request.headers.get("Accept-Encoding", "")
+    if not header or not ENCODINGS:
+        return None
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    candidates = [
+        (accepted.get(encoding, wildcard), -i, encoding)
+        for i, encoding in enumerate(ENCODINGS)
+    ]
+    quality, _, encoding = max(candidates)
+    return encoding if quality > 0 else None
+
+
+def compressible(response: StreamingHttpResponse) -> bool:
+    """Check if a response should be compressed"""
+    if response.has_header("Content-Encoding") or response.status_code in (204, 304):
+        return False
+    content_length = response.get("Content-Length")
+    if content_length is not None and content_length.isdigit():
+        if int(content_length) < COMPRESSION_MIN_SIZE:
+            return False
+    content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+    return (
+        content_type.startswith("text/")
+        or content_type.endswith(("+json", "+xml"))
+        or content_type in _COMPRESSIBLE
+    )
+
+
+def _compressor(encoding: str):
+    """A compressobj with compress() and flush()"""
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+    # wbits 31 writes the gzip header and trailer
+    return zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def _compress_chunk(compressor, encoding: str, chunk: bytes) -> bytes:
+    """Compress a chunk and flush it, so the client gets it without waiting for the next chunks"""
+    if encoding == ZSTD:
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    else:
+        flush_mode = zlib.Z_SYNC_FLUSH
+    return compressor.compress(chunk) + compressor.flush(flush_mode)
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a stream chunk by chunk"""
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        if chunk:
+            yield _compress_chunk(compressor, encoding, chunk)
+    yield compressor.flush()
+
+
+async def acompress_chunks(
+    chunks: AsyncIterable[bytes], encoding: str
+) -> AsyncIterator[bytes]:
+    """Async version of compress_chunks()"""
+    compressor = _compressor(encoding)
+    async for chunk in chunks:
+        if chunk:
+            yield _compress_chunk(compressor, encoding, chunk)
+    yield compressor.flush()
+
+
+def compress(request: HttpRequest, response: StreamingHttpResponse):
+    """Compress a streamed response if the client accepts it"""
+    patch_vary_headers(response, ("Accept-Encoding",))
+    encoding = negotiate(request)
+    if encoding is None or not compressible(response):
+        return response
+    del response["Content-Length"]
+    response["Content-Encoding"] = encoding
+    if response.is_async:
+        response.streaming_content = acompress_chunks(
+            response.streaming_content, encoding
+        )
+    else:
+        response.streaming_content = compress_chunks(
+            response.streaming_content, encoding
+        )
+    return response
+
+
+class UnsupportedEncoding(Exception):
+    """The request body has a Content-Encoding that can't be decompressed"""
+
+
+class DecompressionError(Exception):
+    """The request body is not valid for its Content-Encoding"""
+
+    status = 400
+
+
+class UploadTooLarge(DecompressionError):
+    """The request body exceeds COMPRESSED_UPLOAD_MAX_SIZE once it is decompressed"""
+
+    status = 413
+
+
+class UploadStats:
+    """Thread safe counters for the compressed uploads"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+
+    def add(self, compressed: int, uncompressed: int) -> None:
+        """Count a finished upload"""
+        with self._lock:
+            self.uploads += 1
+            self.compressed_bytes += compressed
+            self.uncompressed_bytes += uncompressed
+
+    def as_dict(self) -> dict[str, int]:
+        """Return a snapshot of all counters"""
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "compressed_bytes": self.compressed_bytes,
+                "uncompressed_bytes": self.uncompressed_bytes,
+            }
+
+
+UPLOAD_STATS = UploadStats()
+
+
+def request_encoding(request: HttpRequest) -> str | None:
+    """Get the Content-Encoding of the request body, None means identity
+
+    Raises:
+        UnsupportedEncoding: When the body can't be decompressed
+    """
+    encoding = request.headers.get("Content-Encoding", "").strip().lower()
+    if not encoding or encoding == "identity":
+        return None
+    if encoding not in DECODINGS:
+        raise UnsupportedEncoding(
+            f"Unsupported Content-Encoding {encoding!r}, supported are {', '.join(DECODINGS)}"
+        )
+    return encoding
+
+
+class _Source:
+    """The compressed body as a file for the decompressing readers, counts the bytes read"""
+
+    def __init__(self, stream) -> None:
+        self.stream = stream
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+
+class _ZstdReader:
+    """Read a zstd stream of one or more frames like a file, notices a stream that ends inside of a frame.
+
+    zstandard's stream_reader() silently ends at the end of its input, a decompressobj() tells when
+    its frame is complete. The decompressobj() has no limit for its output, so it is fed slices of
+    at most _ZSTD_FEED_SIZE compressed bytes to keep the output of a single call small.
+    """
+
+    def __init__(self, source: _Source) -> None:
+        self._source = source
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._frame = self._decompressor.decompressobj()
+        # Whether the current frame got any data
+        self._started = False
+        self._input = memoryview(b"")
+        self._output = bytearray()
+
+    @property
+    def complete(self) -> bool:
+        """Whether the stream so far consists of complete frames"""
+        return not self._started and not self._input
+
+    def read(self, size: int) -> bytes:
+        """Read the next piece of at most size decompressed bytes, b"" at the end of the stream"""
+        while len(self._output) < size:
+            if not self._input:
+                self._input = memoryview(self._source.read(CHUNK_SIZE))
+                if not self._input:
+                    break
+            data = self._input[:_ZSTD_FEED_SIZE]
+            self._input = self._input[_ZSTD_FEED_SIZE:]
+            self._started = True
+            self._output += self._frame.decompress(data)
+            if self._frame.eof:
+                # The rest belongs to the next frame
+                self._input = memoryview(self._frame.unused_data + bytes(self._input))
+                self._frame = self._decompressor.decompressobj()
+                self._started = False
+        data = bytes(self._output[:size])
+        del self._output[:size]
+        return data
+
+
+class Decompressor:
+    """Decompress a body in pieces of bounded size, concatenated gzip members and zstd frames are supported.
+
+    The compressed body is read from a file-like stream as the decompressed pieces are read,
+    so a highly compressed body never has to be held in memory.
+    """
+
+    def __init__(self, stream, encoding: str, max_size: int | None = None) -> None:
+        """
+        Args:
+            stream: File-like object with the compressed body, e.g. the request
+            encoding (str): gzip or zstd
+            max_size (int | None): Maximum decompressed size in bytes, defaults to
+                COMPRESSED_UPLOAD_MAX_SIZE. 0 means unlimited.
+        """
+        self.encoding = encoding
+        self.max_size = COMPRESSED_UPLOAD_MAX_SIZE if max_size is None else max_size
+        self.uncompressed_bytes = 0
+        self._source = _Source(stream)
+        if encoding == ZSTD:
+            self._reader = _ZstdReader(self._source)
+        else:
+            self._reader = gzip.GzipFile(fileobj=self._source, mode="rb")
+
+    @property
+    def compressed_bytes(self) -> int:
+        """Compressed bytes read so far"""
+        return self._source.bytes
+
+    def read(self, size: int) -> bytes:
+        """Read the next piece of at most size decompressed bytes, b"" at the end of the body
+
+        Raises:
+            DecompressionError: When the body is invalid or truncated
+            UploadTooLarge: When the body is larger than max_size once decompressed
+        """
+        try:
+            data = self._reader.read(size)
+        except _DECOMPRESSION_ERRORS as e:
+            raise DecompressionError(f"Invalid {self.encoding} body: {e}") from e
+        self.uncompressed_bytes += len(data)
+        if self.max_size and self.uncompressed_bytes > self.max_size:
+            raise UploadTooLarge(
+                f"The decompressed body is larger than {self.max_size} bytes"
+            )
+        if not data:
+            self._finish()
+        return data
+
+    def _finish(self) -> None:
+        if isinstance(self._reader, _ZstdReader) and not self._reader.complete:
+            raise DecompressionError(f"Invalid {self.encoding} body: truncated")
+        UPLOAD_STATS.add(self.compressed_bytes, self.uncompressed_bytes)
+
+
+def decompress_chunks(
+    stream, encoding: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Decompress a body from a file-like stream in pieces of at most chunk_size bytes"""
+    decompressor = Decompressor(stream, encoding)
+    while data := decompressor.read(chunk_size):
+        yield data
+
+
+async def adecompress_chunks(
+    stream, encoding: str, chunk_size: int = CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """Async version of decompress_chunks(), the stream is a spooled ASGI request body.
+
+    Reading and decompressing run in a thread, so they don't block the event loop.
+    """
+    read = sync_to_async(Decompressor(stream, encoding).read)
+    while data := await read(chunk_size):
+        yield data
+
+
+def stats() -> dict[str, int]:
+    """Statistics of the compressed uploads of this worker process"""
+    return UPLOAD_STATS.as_dict()
@@ -0,0 +1,295 @@
+"""Server side cursors over the results of SPARQL queries from the query console.
+
+The first execution of a query writes its rows to a file in a directory of the user in SPARQL_CURSOR_DIR,
+one JSON list per line. Later pages are read from that file, so browsing a result only evaluates the
+query once on RDF4J. The files are shared between all worker processes and expire SPARQL_CURSOR_TTL
+seconds after their last use. Expired files are removed by the cleanup_cursors command.
+
+The files of one user never take more than SPARQL_CURSOR_MAX_BYTES. While a result is written, the
+least recently used cursors of the user are removed to make room for it. Once there are none left,
+writing stops and the cursor is truncated. The results of one user are written one at a time.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import re
+import secrets
+import time
+from typing import Iterator
+
+from authproxy.settings import (
+    SPARQL_CURSOR_DIR,
+    SPARQL_CURSOR_MAX_BYTES,
+    SPARQL_CURSOR_TTL,
+    SPARQL_RESULT_ROW_LIMIT,
+)
+
+from .results import QueryResult
+
+ROWS_SUFFIX = ".rows"
+META_SUFFIX = ".json"
+LOCK_NAME = ".lock"
+# Ids from secrets.token_urlsafe, anything else could point outside of SPARQL_CURSOR_DIR
+CURSOR_ID = re.compile(r"[A-Za-z0-9_-]+")
+
+
+class CursorNotFound(LookupError):
+    """The cursor does not exist, has expired or belongs to someone else"""
+
+
+def _user_dir(user_id: int) -> str:
+    return os.path.join(SPARQL_CURSOR_DIR, str(user_id))
+
+
+def _path(user_id: int, cursor_id: str, suffix: str) -> str:
+    return os.path.join(_user_dir(user_id), cursor_id + suffix)
+
+
+@contextlib.contextmanager
+def _locked(user_id: int) -> Iterator[None]:
+    """Hold the lock of the directory of a user, it is shared by all worker processes"""
+    fd = os.open(
+        os.path.join(_user_dir(user_id), LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o600
+    )
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing releases the lock
+        os.close(fd)
+
+
+def _open(path: str):
+    """Open a file for writing that only the authproxy can read"""
+    return open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb")
+
+
+class Cursor:
+    """Rows of a query result that are buffered on disk and read page by page"""
+
+    def __init__(self, cursor_id: str, meta: dict) -> None:
+        self.id = cursor_id
+        self.user_id: int = meta["user_id"]
+        self.repository_id: str = meta["repository_id"]
+        self.query: str = meta["query"]
+        self.vars: list[str] = meta["vars"]
+        self.page_size: int = meta["page_size"]
+        # Byte offset of the first row of every page in the rows file
+        self.offsets: list[int] = meta["offsets"]
+        self.row_count: int = meta["row_count"]
+        self.bytes: int = meta["bytes"]
+        # Set if the result did not fit into the byte budget of the user
+        self.truncated: bool = meta["truncated"]
+
+    @property
+    def pages(self) -> int:
+        """Number of pages, an empty result still has one (empty) page"""
+        return max(len(self.offsets), 1)
+
+    def page(self, number: int) -> Iterator[list[str]]:
+        """Iterate over the rows of a page, the first page is 0"""
+        if not 0 <= number < len(self.offsets):
+            return
+        remaining = min(self.page_size, self.row_count - number * self.page_size)
+        try:
+            with open(_path(self.user_id, self.id, ROWS_SUFFIX), "rb") as rows:
+                rows.seek(self.offsets[number])
+                for _ in range(remaining):
+                    yield json.loads(rows.readline())
+        except FileNotFoundError as e:
+            raise CursorNotFound(self.id) from e
+
+    def as_meta(self) -> dict:
+        """The metadata stored next to the rows"""
+        return {
+            "user_id": self.user_id,
+            "repository_id": self.repository_id,
+            "query": self.query,
+            "vars": self.vars,
+            "page_size": self.page_size,
+            "offsets": self.offsets,
+            "row_count": self.row_count,
+            "bytes": self.bytes,
+            "truncated": self.truncated,
+        }
+
+
+def create(
+    user_id: int,
+    repository_id: str,
+    query: str,
+    result: QueryResult,
+    page_size: int = SPARQL_RESULT_ROW_LIMIT,
+) -> Cursor:
+    """Read the whole result into a new cursor.
+
+    Older cursors of the user are removed while the result does not fit into SPARQL_CURSOR_MAX_BYTES.
+    Reading stops once the cursor would exceed it on its own, the cursor is then truncated.
+    """
+    os.makedirs(SPARQL_CURSOR_DIR, mode=0o700, exist_ok=True)
+    os.makedirs(_user_dir(user_id), mode=0o700, exist_ok=True)
+
+    # Concurrent queries of the user must not each fill the whole budget
+    with _locked(user_id):
+        _remove_incomplete(user_id)
+        # Least recently used first
+        older = sorted(_list(user_id))
+        budget = SPARQL_CURSOR_MAX_BYTES - sum(size for _, _, size in older)
+
+        cursor_id = secrets.token_urlsafe(16)
+        offsets: list[int] = []
+        row_count = 0
+        size = 0
+        truncated = False
+        try:
+            with _open(_path(user_id, cursor_id, ROWS_SUFFIX)) as rows:
+                for row in result.rows:
+                    line = (
+                        json.dumps(row, separators=(",", ":")).encode("utf-8") + b"\n"
+                    )
+                    while size + len(line) > budget and older:
+                        _, old_id, old_size = older.pop(0)
+                        _remove(user_id, old_id)
+                        budget += old_size
+                    if size + len(line) > budget:
+                        truncated = True
+                        break
+                    if row_count % page_size == 0:
+                        offsets.append(size)
+                    rows.write(line)
+                    row_count += 1
+                    size += len(line)
+        except BaseException:
+            _remove(user_id, cursor_id)
+            raise
+        finally:
+            result.close()
+
+        cursor = Cursor(
+            cursor_id,
+            {
+                "user_id": user_id,
+                "repository_id": repository_id,
+                "query": query,
+                "vars": result.vars,
+                "page_size": page_size,
+                "offsets": offsets,
+                "row_count": row_count,
+                "bytes": size,
+                "truncated": truncated,
+            },
+        )
+        # Write the metadata last, it marks the cursor as complete
+        tmp_path = _path(user_id, cursor_id, META_SUFFIX + ".tmp")
+        with _open(tmp_path) as meta:
+            meta.write(json.dumps(cursor.as_meta()).encode("utf-8"))
+        os.replace(tmp_path, _path(user_id, cursor_id, META_SUFFIX))
+    return cursor
+
+
+def get(cursor_id: str, user_id: int, repository_id: str) -> Cursor:
+    """Load a cursor of the user and extend its lifetime
+
+    Raises:
+        CursorNotFound: The cursor does not exist or belongs to another user or repository
+    """
+    if not CURSOR_ID.fullmatch(cursor_id):
+        raise CursorNotFound(cursor_id)
+    meta_path = _path(user_id, cursor_id, META_SUFFIX)
+    try:
+        if os.path.getmtime(meta_path) + SPARQL_CURSOR_TTL < time.time():
+            raise CursorNotFound(cursor_id)
+        with open(meta_path, encoding="utf-8") as meta:
+            cursor = Cursor(cursor_id, json.load(meta))
+        os.utime(meta_path)
+    except (FileNotFoundError, ValueError) as e:
+        raise CursorNotFound(cursor_id) from e
+
+    if cursor.user_id != user_id or cursor.repository_id != repository_id:
+        raise CursorNotFound(cursor_id)
+    return cursor
+
+
+def _remove(user_id: int, cursor_id: str) -> None:
+    for suffix in (META_SUFFIX, ROWS_SUFFIX, META_SUFFIX + ".tmp"):
+        try:
+            os.remove(_path(user_id, cursor_id, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def _list(user_id: int) -> Iterator[tuple[float, str, int]]:
+    """Iterate over the last access times, ids and sizes of the complete cursors of a user"""
+    try:
+        entries = list(os.scandir(_user_dir(user_id)))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.name.endswith(META_SUFFIX):
+            continue
+        cursor_id = entry.name[: -len(META_SUFFIX)]
+        try:
+            accessed = entry.stat().st_mtime
+            size = os.path.getsize(_path(user_id, cursor_id, ROWS_SUFFIX))
+        except FileNotFoundError:
+            continue
+        yield accessed, cursor_id, size
+
+
+def _remove_incomplete(user_id: int) -> None:
+    """Remove the rows files without metadata of a user, call it with the lock of the user held"""
+    try:
+        entries = list(os.scandir(_user_dir(user_id)))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.name.endswith(ROWS_SUFFIX):
+            cursor_id = entry.name[: -len(ROWS_SUFFIX)]
+            if not os.path.exists(_path(user_id, cursor_id, META_SUFFIX)):
+                _remove(user_id, cursor_id)
+
+
+def _users() -> list[int]:
+    try:
+        return [
+            int(entry.name)
+            for entry in os.scandir(SPARQL_CURSOR_DIR)
+            if entry.is_dir() and entry.name.isdigit()
+        ]
+    except FileNotFoundError:
+        return []
+
+
+def cleanup() -> int:
+    """Remove all expired cursors, returns the number of removed cursors.
+
+    Called by the cleanup_cursors command, get() already ignores expired cursors.
+    """
+    removed = 0
+    expired_before = time.time() - SPARQL_CURSOR_TTL
+    for user_id in _users():
+        for accessed, cursor_id, _ in _list(user_id):
+            if accessed < expired_before:
+                _remove(user_id, cursor_id)
+                removed += 1
+        # Rows files without metadata are left over from crashed workers, or are being written
+        try:
+            entries = list(os.scandir(_user_dir(user_id)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not entry.name.endswith(ROWS_SUFFIX):
+                continue
+            cursor_id = entry.name[: -len(ROWS_SUFFIX)]
+            try:
+                orphaned = (
+                    entry.stat().st_mtime < expired_before
+                    and not os.path.exists(_path(user_id, cursor_id, META_SUFFIX))
+                )
+            except FileNotFoundError:
+                continue
+            if orphaned:
+                _remove(user_id, cursor_id)
+    return removed
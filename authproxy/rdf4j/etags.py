@@ -0,0 +1,91 @@
+"""ETags for the read routes of repositories.
+
+The ETag of a response is derived from the write generation of the repository and the request
+(path, query parameters, Accept header and the negotiated compression). While the repository is not written to, a request with
+a matching If-None-Match header is answered with 304 without contacting RDF4J.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from . import compression, generations
+
+
+def etag(request: HttpRequest, generation: int) -> str:
+    """Build the strong ETag of a request at the given write generation of the repository"""
+    fingerprint = json.dumps(
+        [
+            generation,
+            request.path,
+            sorted(request.GET.lists()),
+            request.headers.get("Accept", "").replace(" ", ""),
+            # The compressed and the identity body are different representations
+            compression.negotiate(request),
+        ]
+    )
+    return '"%s"' % hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+
+
+def not_modified(request: HttpRequest, tag: str) -> bool:
+    """Check if the If-None-Match header of the request matches the ETag"""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison
+    tags = [t.removeprefix("W/") for t in parse_etags(header)]
+    return "*" in tags or tag in tags
+
+
+def conditional(func):
+    """Decorate a sync or async read view of a repository with ETag / If-None-Match handling.
+
+    Only wrap views that are already protected by RepoPermission.read, so a 304
+    never tells anything to users without access to the repository.
+    """
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            request = args[-1]
+            repository_id = kwargs["repository_id"]
+            generation = await sync_to_async(generations.get)(
+                generations.repository_key(repository_id)
+            )
+            tag = etag(request, generation)
+            if not_modified(request, tag):
+                return _not_modified(tag)
+            return _tag(await func(*args, **kwargs), tag)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # The request is always the last arg, like in RepoPermission.wrap_view
+        request = args[-1]
+        repository_id = kwargs["repository_id"]
+        generation = generations.get(generations.repository_key(repository_id))
+        tag = etag(request, generation)
+        if not_modified(request, tag):
+            return _not_modified(tag)
+        return _tag(func(*args, **kwargs), tag)
+
+    return wrapper
+
+
+def _not_modified(tag: str) -> HttpResponseNotModified:
+    response = HttpResponseNotModified()
+    response["ETag"] = tag
+    return response
+
+
+def _tag(response, tag: str):
+    """Set the ETag on successful responses"""
+    if response.status_code == 200:
+        response["ETag"] = tag
+    return response
@@ -0,0 +1,112 @@
+"""Generations shared between all worker processes.
+
+A generation changes whenever the data it guards changes. Worker processes keep data derived
+from the database (e.g. ACL snapshots) in memory, tag it with the generation it was built from,
+and rebuild it as soon as the shared generation differs. The generations are bumped from the
+signal handlers in signals/handlers.py.
+
+The generations live in a memory mapped file (GENERATION_STORE, in /dev/shm when available) of
+GENERATION_SLOTS 8 byte slots. A key is found by hashing it, so reading or bumping a generation
+never depends on the number of keys and no generation is ever evicted. Keys that share a slot
+share their generation, bumping one of them only causes extra rebuilds for the others.
+"""
+
+import hashlib
+import mmap
+import os
+import secrets
+import struct
+import threading
+
+from django.db import transaction
+
+from authproxy.settings import GENERATION_SLOTS, GENERATION_STORE
+
+# Generation of all ACLs, bumped when permissions change for more than one user at once.
+ACL = "acl"
+# Generation of the repository registry, bumped when any repository is saved or deleted.
+REPOSITORIES = "repositories"
+
+
+def user_key(user_id) -> str:
+    """Generation of everything that is derived from a single user"""
+    return f"user:{user_id}"
+
+
+def repository_key(repository_id: str) -> str:
+    """Generation of the contents of a repository, bumped on every write"""
+    return f"repository:{repository_id}"
+
+
+class GenerationStore:
+    """Generations in a memory mapped file
+
+    Slots are read and written without locks. A generation is only ever compared for equality,
+    so a bump or initialization that races with a read at worst makes the reader rebuild its data
+    once more.
+    """
+
+    SLOT = struct.Struct("<Q")
+
+    def __init__(self, path: str, slots: int) -> None:
+        self.path = path
+        self.slots = slots
+        self._map: mmap.mmap | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def _mapped(self) -> mmap.mmap:
+        # Forked workers map the file again
+        if self._map is None or self._pid != os.getpid():
+            with self._lock:
+                if self._map is None or self._pid != os.getpid():
+                    size = self.slots * self.SLOT.size
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    try:
+                        # New generations start out random, like bumped ones
+                        for start in range(os.fstat(fd).st_size, size, 1 << 20):
+                            os.pwrite(fd, os.urandom(min(1 << 20, size - start)), start)
+                        self._map = mmap.mmap(fd, size)
+                    finally:
+                        os.close(fd)
+                    self._pid = os.getpid()
+        return self._map  # type: ignore[return-value]
+
+    def _offset(self, key: str) -> int:
+        digest = int.from_bytes(
+            hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+        return (digest % self.slots) * self.SLOT.size
+
+    def get_many(self, keys) -> tuple[int, ...]:
+        """Get the generations of the keys"""
+        mapped = self._mapped()
+        return tuple(
+            self.SLOT.unpack_from(mapped, self._offset(key))[0] for key in keys
+        )
+
+    def bump_many(self, keys) -> None:
+        """Change the generations of the keys"""
+        mapped = self._mapped()
+        for key in keys:
+            # Random instead of incremented, so concurrent bumps from different processes never collide
+            self.SLOT.pack_into(mapped, self._offset(key), secrets.randbits(63))
+
+
+STORE = GenerationStore(GENERATION_STORE, GENERATION_SLOTS)
+
+
+def get(key: str) -> int:
+    """Get the current generation for a key"""
+    return get_many(key)[0]
+
+
+def get_many(*keys: str) -> tuple[int, ...]:
+    """Get the current generations for multiple keys"""
+    return STORE.get_many(keys)
+
+
+def bump(*keys: str) -> None:
+    """Change the generations for the keys once the current transaction is committed"""
+    transaction.on_commit(lambda: STORE.bump_many(keys))
@@ -0,0 +1,128 @@
+"""Queue for the creation and deletion of repositories on the RDF4J server.
+
+Creating and especially deleting a repository can take longer than a request should. The signal
+handlers therefore only queue a RemoteJob, which the run_remote_jobs command runs outside of the
+request. Failed jobs are retried with exponential backoff until REMOTE_JOB_MAX_ATTEMPTS is
+reached. The jobs of a repository run one after the other in the order they were queued, so a
+deletion never overtakes the creation.
+
+Several workers may run at the same time, a job is claimed with a conditional update.
+"""
+
+from datetime import timedelta
+
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from authproxy.settings import (
+    REMOTE_JOB_MAX_ATTEMPTS,
+    REMOTE_JOB_RETRY_DELAY,
+    REMOTE_JOB_TIMEOUT,
+)
+
+from .models import RemoteJob, Repository
+
+# Running jobs that were not updated for this long belong to a worker that died
+STALE_AFTER = timedelta(seconds=2 * REMOTE_JOB_TIMEOUT)
+
+
+def enqueue(action: RemoteJob.Action, repository_slug: str) -> RemoteJob:
+    """Queue a job, call it inside of the transaction that changes the repository"""
+    return RemoteJob.objects.create(action=action, repository_slug=repository_slug)
+
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before the next attempt, doubles with every failed attempt"""
+    return timedelta(seconds=REMOTE_JOB_RETRY_DELAY * 2 ** max(attempts - 1, 0))
+
+
+def reset_stale() -> int:
+    """Queue the jobs of dead workers again, returns the number of jobs"""
+    return RemoteJob.objects.filter(
+        state=RemoteJob.State.RUNNING, updated__lt=timezone.now() - STALE_AFTER
+    ).update(state=RemoteJob.State.PENDING, updated=timezone.now())
+
+
+def due(limit: int = 100) -> list[RemoteJob]:
+    """Pending jobs that can run now, at most one per repository"""
+    candidates = list(
+        RemoteJob.objects.filter(
+            state=RemoteJob.State.PENDING, run_after__lte=timezone.now()
+        ).order_by("pk")[:limit]
+    )
+    # Jobs wait for the unfinished jobs that were queued before them for the same repository
+    first = dict(
+        RemoteJob.objects.filter(
+            state__in=[RemoteJob.State.PENDING, RemoteJob.State.RUNNING],
+            repository_slug__in={job.repository_slug for job in candidates},
+        )
+        .values("repository_slug")
+        .annotate(first=Min("pk"))
+        .values_list("repository_slug", "first")
+    )
+    return [job for job in candidates if first.get(job.repository_slug) == job.pk]
+
+
+def run(job: RemoteJob) -> bool:
+    """Run a pending job unless another worker claimed it first
+
+    Returns:
+        bool: Whether this worker ran the job
+    """
+    claimed = RemoteJob.objects.filter(pk=job.pk, state=RemoteJob.State.PENDING).update(
+        state=RemoteJob.State.RUNNING,
+        attempts=F("attempts") + 1,
+        updated=timezone.now(),
+    )
+    if not claimed:
+        return False
+    job.refresh_from_db()
+    try:
+        if job.action == RemoteJob.Action.CREATE:
+            # Nothing to create when the repository was deleted in the meantime
+            repository = Repository.objects.filter(slug=job.repository_slug).first()
+            if repository is not None:
+                # An earlier attempt may have created it without seeing the response
+                repository.create_remote(timeout=REMOTE_JOB_TIMEOUT, exist_ok=True)
+        else:
+            # A remote that is already gone counts as deleted
+            Repository(slug=job.repository_slug).delete_remote(
+                timeout=REMOTE_JOB_TIMEOUT
+            )
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        job.last_error = f"{e.__class__.__name__}: {e}"
+        if job.attempts >= REMOTE_JOB_MAX_ATTEMPTS:
+            job.state = RemoteJob.State.FAILED
+        else:
+            job.state = RemoteJob.State.PENDING
+            job.run_after = timezone.now() + backoff(job.attempts)
+    else:
+        job.state = RemoteJob.State.DONE
+        job.last_error = ""
+    job.save(update_fields=["state", "run_after", "last_error", "updated"])
+    return True
+
+
+def run_pending(limit: int = 100) -> int:
+    """Run the jobs that are due, returns the number of jobs this worker ran"""
+    reset_stale()
+    return sum(run(job) for job in due(limit))
+
+
+def retry(jobs) -> int:
+    """Queue failed jobs again with a fresh number of attempts"""
+    return jobs.filter(state=RemoteJob.State.FAILED).update(
+        state=RemoteJob.State.PENDING,
+        attempts=0,
+        run_after=timezone.now(),
+        updated=timezone.now(),
+    )
+
+
+def stats() -> dict[str, int]:
+    """Number of jobs per state"""
+    counts = {state.value: 0 for state in RemoteJob.State}
+    counts.update(
+        RemoteJob.objects.values_list("state").annotate(count=Count("pk")).order_by()
+    )
+    return counts
@@ -0,0 +1,123 @@
+"""Benchmark the WSGI (uwsgi) deployment of the authproxy against the ASGI deployment"""
+
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire the same request with a fixed concurrency at the WSGI and the ASGI deployment "
+        "of the authproxy and compare throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--wsgi",
+            default="http://localhost:8000",
+            help="Base url of the uwsgi deployment",
+        )
+        parser.add_argument(
+            "--asgi",
+            default="http://localhost:8001",
+            help="Base url of the ASGI deployment",
+        )
+        parser.add_argument(
+            "--path",
+            required=True,
+            help="Path to request, e.g. '/repositories/test?query=SELECT...'",
+        )
+        parser.add_argument("--method", default="GET")
+        parser.add_argument("--data", default=None, help="Request body")
+        parser.add_argument("--content-type", default=None)
+        parser.add_argument("--accept", default="application/sparql-results+json")
+        parser.add_argument(
+            "--token", default=None, help="API token for authentication"
+        )
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument(
+            "--timeout", type=float, default=300, help="Timeout per request in s"
+        )
+
+    def handle(self, *args, **options):
+        headers = {"Accept": options["accept"]}
+        if options["token"]:
+            headers["Authorization"] = f"Token {options['token']}"
+        if options["content_type"]:
+            headers["Content-Type"] = options["content_type"]
+
+        results = {}
+        for name in ["wsgi", "asgi"]:
+            url = options[name].rstrip("/") + options["path"]
+            self.stdout.write(
+                f"{name}: {options['requests']} x {options['method']} {url} "
+                f"with concurrency {options['concurrency']}"
+            )
+            results[name] = asyncio.run(self.run(url, headers, options))
+            self.report(name, results[name])
+
+        wsgi_rps, asgi_rps = results["wsgi"]["rps"], results["asgi"]["rps"]
+        if wsgi_rps:
+            self.stdout.write(
+                self.style.SUCCESS(f"asgi/wsgi throughput: {asgi_rps / wsgi_rps:.2f}x")
+            )
+
+    async def run(self, url: str, headers: dict, options: dict) -> dict:
+        """Send all requests and collect the latencies"""
+        concurrency = options["concurrency"]
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: list[float] = []
+        statuses: dict[str, int] = {}
+
+        async with httpx.AsyncClient(
+            timeout=options["timeout"],
+            limits=httpx.Limits(max_connections=concurrency),
+        ) as client:
+
+            async def one() -> None:
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        async with client.stream(
+                            options["method"],
+                            url,
+                            headers=headers,
+                            content=options["data"],
+                        ) as response:
+                            async for _ in response.aiter_raw():
+                                pass
+                        status = str(response.status_code)
+                    except httpx.HTTPError as e:
+                        status = e.__class__.__name__
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(options["requests"])))
+            duration = time.perf_counter() - start
+
+        latencies.sort()
+        return {
+            "duration": duration,
+            "rps": len(latencies) / duration if duration else 0,
+            "latencies": latencies,
+            "statuses": statuses,
+        }
+
+    def report(self, name: str, result: dict) -> None:
+        """Print the summary of one benchmark run"""
+        latencies = result["latencies"]
+
+        def percentile(p: float) -> float:
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+        self.stdout.write(
+            f"  {name}: {result['rps']:.1f} req/s in {result['duration']:.2f}s, "
+            f"latency mean {statistics.mean(latencies) * 1000:.1f}ms "
+            f"p50 {percentile(0.5):.1f}ms p95 {percentile(0.95):.1f}ms p99 {percentile(0.99):.1f}ms, "
+            f"status {result['statuses']}"
+        )
@@ -0,0 +1,88 @@
+"""Load a large N-Triples or N-Quads file in parallel batches, see rdf4j/bulk_load.py"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rdf4j import bulk_load
+from rdf4j.models import Repository
+
+
+class Command(BaseCommand):
+    help = (
+        "Load an N-Triples or N-Quads file (optionally gzip compressed) into a repository. "
+        "The file is loaded in batches, every batch in its own RDF4J transaction, and several "
+        "batches are loaded at the same time. An interrupted load continues from its checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("repository", help="Id of the repository")
+        parser.add_argument("file", help=".nt or .nq file, optionally ending in .gz")
+        parser.add_argument(
+            "--content-type",
+            default=None,
+            help="Content type of the file, guessed from the extension by default",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Statements per batch, defaults to BULK_LOAD_BATCH_SIZE",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Batches loaded at the same time, defaults to BULK_LOAD_WORKERS",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="Checkpoint file, defaults to the file name with a .checkpoint suffix",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and load the whole file again",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds between progress reports",
+        )
+
+    def handle(self, *args, **options):
+        if not Repository.objects.filter(slug=options["repository"]).exists():
+            raise CommandError(f"Unknown repository {options['repository']}")
+
+        last_report = time.monotonic()
+
+        def report(checkpoint: bulk_load.Checkpoint) -> None:
+            nonlocal last_report
+            if time.monotonic() - last_report < options["interval"]:
+                return
+            last_report = time.monotonic()
+            self.stdout.write(
+                f"Loaded {checkpoint.statements} statements in {checkpoint.batches} batches, "
+                f"{checkpoint.rate:.0f} statements/s"
+            )
+
+        start = time.perf_counter()
+        try:
+            checkpoint = bulk_load.load(
+                options["repository"],
+                options["file"],
+                content_type=options["content_type"],
+                batch_size=options["batch_size"],
+                workers=options["workers"],
+                checkpoint_path=options["checkpoint"],
+                restart=options["restart"],
+                on_progress=report,
+            )
+        except (ValueError, bulk_load.BulkLoadError) as e:
+            raise CommandError(e) from e
+        self.stdout.write(
+            f"Loaded {checkpoint.statements} statements in {checkpoint.batches} batches "
+            f"in {time.perf_counter() - start:.2f}s, {checkpoint.rate:.0f} statements/s"
+        )
@@ -0,0 +1,34 @@
+"""Remove the expired cursors of the query console, see rdf4j/cursors.py"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from rdf4j import cursors
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove the query console cursors that were not used for SPARQL_CURSOR_TTL "
+        "seconds. Runs until it is stopped, unless --once is passed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Remove the expired cursors and exit"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60,
+            help="Seconds between checks for expired cursors",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = cursors.cleanup()
+            if count:
+                self.stdout.write(f"Removed {count} expired cursors")
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,52 @@
+"""Create repositories in bulk, see rdf4j/provisioning.py"""
+
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rdf4j import provisioning
+
+
+class Command(BaseCommand):
+    help = (
+        "Create repositories from a JSON list in the GraphDB format of /rest/repositories, "
+        'e.g. [{"id": "test", "title": "Test"}]. The RDF4J repositories are created concurrently.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="JSON file, - reads from stdin")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Repositories created at the same time, "
+            "defaults to REPOSITORY_PROVISIONING_WORKERS",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["file"] == "-":
+                specs = json.load(sys.stdin)
+            else:
+                with open(options["file"], "rb") as f:
+                    specs = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(e) from e
+        if not isinstance(specs, list):
+            raise CommandError("Expected a JSON list of repositories")
+
+        start = time.perf_counter()
+        results = provisioning.create_repositories(specs, workers=options["workers"])
+        failed = 0
+        for result in results:
+            if not result["created"]:
+                failed += 1
+                self.stderr.write(f"{result['id']}: {result['message']}")
+        self.stdout.write(
+            f"Created {len(results) - failed} of {len(results)} repositories "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        if failed:
+            raise CommandError(f"{failed} repositories could not be created")
@@ -0,0 +1,22 @@
+"""Export users as NDJSON, see rdf4j/provisioning.py"""
+
+from django.core.management.base import BaseCommand
+
+from rdf4j import provisioning
+
+
+class Command(BaseCommand):
+    help = "Export all users as NDJSON in the GraphDB user format, one user per line."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--password-hashes",
+            action="store_true",
+            help="Include the password hashes, so the users can be imported elsewhere",
+        )
+
+    def handle(self, *args, **options):
+        for line in provisioning.export_users(
+            password_hashes=options["password_hashes"]
+        ):
+            self.stdout.write(line, ending="")
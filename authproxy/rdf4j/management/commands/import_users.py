@@ -0,0 +1,62 @@
+"""Create or update users from NDJSON, see rdf4j/provisioning.py"""
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rdf4j import provisioning
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update users from NDJSON in the GraphDB user format, one user per line. "
+        "All users are validated before any of them is written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="NDJSON file, - reads from stdin")
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only validate the users"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Threads for hashing passwords, defaults to the number of CPUs",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options["file"] == "-":
+            lines = sys.stdin.buffer
+        else:
+            try:
+                lines = open(
+                    options["file"], "rb"
+                )  # pylint: disable=consider-using-with
+            except OSError as e:
+                raise CommandError(e) from e
+        try:
+            records = provisioning.validate(lines)
+        except provisioning.InvalidUsers as e:
+            for line, message in e.errors:
+                self.stderr.write(f"line {line}: {message}")
+            raise CommandError(e) from e
+        finally:
+            if lines is not sys.stdin.buffer:
+                lines.close()
+        self.stdout.write(
+            f"Validated {len(records)} users in {time.perf_counter() - start:.2f}s"
+        )
+        if options["dry_run"]:
+            return
+
+        start = time.perf_counter()
+        result = provisioning.import_users(records, workers=options["workers"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {result['created']} and updated {result['updated']} users "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+        )
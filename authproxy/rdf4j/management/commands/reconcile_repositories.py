@@ -0,0 +1,53 @@
+"""Reconcile the repositories with RDF4J, see rdf4j/reconcile.py"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rdf4j import reconcile
+from rdf4j.models import Repository
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the repositories in the database with the repositories on RDF4J and repair "
+        "the differences: create missing remotes, adopt or delete orphaned remotes and "
+        "create missing permissions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report the differences"
+        )
+        parser.add_argument(
+            "--delete-orphans",
+            action="store_true",
+            help="Delete remotes without a repository instead of adopting them",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Remotes created or deleted at the same time, "
+            "defaults to REPOSITORY_PROVISIONING_WORKERS",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            report = reconcile.reconcile(
+                delete_orphans=options["delete_orphans"],
+                dry_run=options["dry_run"],
+                workers=options["workers"],
+            )
+        except Repository.NoRemoteError as e:
+            raise CommandError(e) from e
+        if options["verbosity"] > 1 or options["dry_run"]:
+            for slug in report.missing_remotes:
+                self.stdout.write(f"{slug}: no remote")
+            for slug in report.orphans:
+                self.stdout.write(f"{slug}: no repository")
+            for slug, names in report.missing_permissions.items():
+                self.stdout.write(f"{slug}: missing permissions {', '.join(names)}")
+        for slug, error in report.errors.items():
+            self.stderr.write(f"{slug}: {error}")
+        self.stdout.write(report.summary())
+        if report.errors:
+            raise CommandError(f"{len(report.errors)} repairs failed")
@@ -0,0 +1,40 @@
+"""Roll back abandoned RDF4J transactions, see rdf4j/transactions.py"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rdf4j import transactions
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll back the RDF4J transactions that were not used for TRANSACTION_IDLE_TIMEOUT "
+        "seconds. Runs until it is stopped, unless --once is passed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Roll back the idle transactions and exit",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds between checks for idle transactions",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count, errors = transactions.rollback_idle()
+            if count:
+                self.stdout.write(f"Rolled back {count} idle transactions")
+            for error in errors:
+                self.stderr.write(error)
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,39 @@
+"""Worker that runs the bulk loads uploaded to the API, see rdf4j/bulk_load.py"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rdf4j import bulk_load
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the queued bulk loads in BULK_LOAD_DIR. "
+        "Runs until it is stopped, unless --once is passed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run the queued loads and exit"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Seconds between checks for new loads",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = bulk_load.run_pending()
+            if count:
+                self.stdout.write(f"Ran {count} bulk loads")
+            # Check again right away, there might be more loads
+            if count:
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
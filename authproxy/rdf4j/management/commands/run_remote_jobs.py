@@ -0,0 +1,39 @@
+"""Worker that creates and deletes repositories on RDF4J, see rdf4j/jobs.py"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rdf4j import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the queued creations and deletions of repositories on the RDF4J server. "
+        "Runs until it is stopped, unless --once is passed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run the due jobs and exit"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Seconds between checks for new jobs",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = jobs.run_pending()
+            if count:
+                self.stdout.write(f"Ran {count} jobs")
+            # Check again right away, there might be more jobs
+            if count:
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rdf4j", "0004_alter_repository_turtle_template"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="repository",
+            name="slug",
+            field=models.CharField(default=None, max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.4 on 2026-10-17
+
+import rdf4j.throttling
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rdf4j", "0005_repository_slug_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="throttle_byte_rate",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Bytes exchanged with RDF4J per period, e.g. 10G/hour. Leave empty to use the limit of the role, none disables the limit.",
+                max_length=32,
+                validators=[rdf4j.throttling.validate_rate],
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="throttle_rate",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Requests per period, e.g. 100/min. Leave empty to use the limit of the role, none disables the limit.",
+                max_length=32,
+                validators=[rdf4j.throttling.validate_rate],
+            ),
+        ),
+    ]
@@ -1,18 +1,28 @@
 from __future__ import annotations
 import functools
 import inspect
+import threading
 from enum import Enum
 from string import Template
 
-import requests
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AbstractUser, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.cache import caches
+from django.db import connection, models, transaction
+from django.db.models import Q
 from django.db.utils import IntegrityError
 from django.http import HttpResponseNotFound
-from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from urllib3.exceptions import HTTPError
 
-from authproxy.settings import RDF4J_REPOSITORY_PATH, RDF4J_URL, REQUEST_TIMEOUT
+from authproxy.settings import SHARED_CACHE
+
+from . import acl, backend, generations, registry, throttling
+from .results import QueryResult
+
+# Rows per query of bulk operations
+BULK_BATCH_SIZE = 500
 
 
 def permission(func):
@@ -27,9 +37,14 @@ class User(AbstractUser):
     class UnknownAuthorityError(IndexError):
         """Custom error when some keys are not expected in a user's grantedAuthorities."""
 
-        def __init__(self, allowed_permissions: list) -> None:
+        def __init__(
+            self, allowed_permissions: list, authority: str | None = None
+        ) -> None:
+            unknown = (
+                f"Unknown authority {authority}" if authority else "Unknown authority"
+            )
             super().__init__(
-                f"Unknown authority. One of {', '.join(allowed_permissions)} is required."
+                f"{unknown}. One of {', '.join(allowed_permissions)} is required."
             )
 
     class SettingsError(IndexError):
@@ -53,6 +68,15 @@ class User(AbstractUser):
 
     role = models.CharField(max_length=17, choices=Role.choices, default=Role.USER)
 
+    # Settings from GraphDB
+    SETTINGS = [
+        "username",
+        "password",
+        "grantedAuthorities",
+        "appSettings",
+        "dateCreated",
+    ]
+
     # AppSettings from GraphDB
     APP_SETTINGS = [
         "DEFAULT_INFERENCE",
@@ -68,6 +92,24 @@ class User(AbstractUser):
     execute_count = models.BooleanField(default=True)
     ignore_shared_queries = models.BooleanField(default=False)
 
+    # Overrides of the rate limits of the role, see THROTTLE_RATES and THROTTLE_BYTE_RATES
+    throttle_rate = models.CharField(
+        max_length=32,
+        blank=True,
+        default="",
+        validators=[throttling.validate_rate],
+        help_text="Requests per period, e.g. 100/min. "
+        "Leave empty to use the limit of the role, none disables the limit.",
+    )
+    throttle_byte_rate = models.CharField(
+        max_length=32,
+        blank=True,
+        default="",
+        validators=[throttling.validate_rate],
+        help_text="Bytes exchanged with RDF4J per period, e.g. 10G/hour. "
+        "Leave empty to use the limit of the role, none disables the limit.",
+    )
+
     def set_settings(self, settings: dict) -> None:
         """Set the user settings from dict.
 
@@ -81,6 +123,9 @@ class User(AbstractUser):
             username,
             dateCreated, GraphDB allows changing this via API but we don't
 
+        The repository permissions in grantedAuthorities replace the current ones of the user.
+        Everything is validated before the user is changed.
+
         Args:
             settings (dict): contains the settings
             Example:
@@ -107,59 +152,120 @@ class User(AbstractUser):
             User.AppSettingsError: When there are unknown keys in the settings dict.
         """
 
-        repo_permissions = RepoPermission.all()
+        # Validate everything before anything is changed
+        for key in settings:
+            # Throw UserSettingsError if there's a key in there that we don't know
+            # username and dateCreated are accepted but ignored
+            if key not in User.SETTINGS:
+                raise User.SettingsError(f"Unknown settings key {key}")
+        app_settings = settings.get("appSettings", {})
+        for key in app_settings:
+            if key not in User.APP_SETTINGS:
+                raise User.AppSettingsError(f"Unknown appSettings key {key}")
+        permission_ids = None
+        if "grantedAuthorities" in settings:
+            authorities = settings["grantedAuthorities"]
+            role, permission_ids = User.resolve_authorities(
+                authorities, RepoPermission.ids(authorities)
+            )
+            if role is not None:
+                self.role = role
+
+        if "password" in settings:
+            self.set_password(settings["password"])
+        for key, value in app_settings.items():
+            setattr(self, key.lower(), value)
+        with transaction.atomic():
+            # Saving also invalidates the cached ACL of the user, see signals/handlers.py
+            self.save()
+            if permission_ids is not None:
+                User.replace_repository_permissions({self.pk: permission_ids})
+
+    @classmethod
+    def resolve_authorities(
+        cls, authorities: list[str], permission_ids: dict[str, int]
+    ) -> tuple[str | None, set[int]]:
+        """Resolve grantedAuthorities into the role and the ids of the repository permissions
 
-        # Build a map from codename -> permission
-        permission_map = {}
-        for repo_permission in repo_permissions:
-            permission_map[repo_permission.codename] = repo_permission
+        Admins and repository managers have no repository permissions.
 
-        for key, value in settings.items():
-            # Do nothing with username or dateCreated
-            if key in ["username", "dateCreated"]:
-                pass
-            elif key == "password":
-                self.set_password(value)
-            elif key == "appSettings":
-                self.set_app_settings(value)
-            elif key == "grantedAuthorities":
-                for authority in value:
-                    # Filter out the role and set it
-                    if authority in [role.value for role in User.Role]:
-                        # TODO: maybe see if we take the highest/lowest priority role instead of skipping
-                        self.role = authority
-                        # If the user is Admin or RepoManager remove all the individual repo permissions
-                        if self.role in [User.Role.ADMIN, User.Role.REPO_MANAGER]:
-                            self.user_permissions.remove(  # pylint: disable=no-member
-                                *repo_permissions
-                            )
-                            # Skip the rest of the permissions.
-                            break
-                    # Check if the permission exists
-                    elif authority in permission_map:
-                        self.user_permissions.add(  # pylint: disable=no-member
-                            permission_map[authority]
-                        )
-                    # In case there's nonsense in the permissions throw an error
-                    else:
-                        role_permissions = [role.value for role in User.Role]
-
-                        # Get all permission names for generic repo xxx
-                        def build_generic_codename(permission_name: str) -> str:
-                            return RepoPermission.build_codename(permission_name, "xxx")
-
-                        generic_permissions = [
-                            build_generic_codename(key)
-                            for key in RepoPermission.permission_functions()
-                        ]
-
-                        allowed_permissions = role_permissions + generic_permissions
-                        raise User.UnknownAuthorityError(allowed_permissions)
+        Args:
+            authorities (list[str]): The grantedAuthorities
+            permission_ids (dict[str, int]): Map from the codenames to the ids of the repository
+                permissions, see RepoPermission.ids()
+
+        Returns:
+            tuple[str | None, set[int]]: The role (None if there is no role among the authorities)
+                and the permission ids
+
+        Raises:
+            User.UnknownAuthorityError: In case there are undefined permissions
+        """
+        roles = [role.value for role in User.Role]
+        role = None
+        ids = set()
+        for authority in authorities:
+            # Filter out the role and set it
+            if authority in roles:
+                # TODO: maybe see if we take the highest/lowest priority role instead of skipping
+                role = authority
+                # If the user is Admin or RepoManager remove all the individual repo permissions
+                if role in [User.Role.ADMIN, User.Role.REPO_MANAGER]:
+                    # Skip the rest of the permissions.
+                    return role, set()
+            # Check if the permission exists
+            elif authority in permission_ids:
+                ids.add(permission_ids[authority])
+            # In case there's nonsense in the permissions throw an error
             else:
-                # Throw UserSettingsError if there's a key in there that we don't know
-                raise User.SettingsError(f"Unknown settings key {key}")
+                # Get all permission names for generic repo xxx
+                generic_permissions = [
+                    RepoPermission.build_codename(key, "xxx")
+                    for key in RepoPermission.permission_functions()
+                ]
+                raise User.UnknownAuthorityError(roles + generic_permissions, authority)
+        return role, ids
 
-        self.save()
+    @classmethod
+    def replace_repository_permissions(
+        cls, permission_ids: dict[int, set[int]]
+    ) -> None:
+        """Replace the repository permissions of users with bulk queries on the through table.
+
+        Only the difference to the current permissions is written, so the cost depends on the
+        number of changes and not on the number of repositories. Bulk queries send no signals,
+        call this inside of a transaction that bumps the generations of the users.
+
+        Args:
+            permission_ids (dict[int, set[int]]): Map from user ids to the ids of their
+                repository permissions
+        """
+        through = cls.user_permissions.through  # pylint: disable=no-member
+        user_ids = list(permission_ids)
+        current = set()
+        stale = []
+        for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+            for pk, user_id, permission_id in through.objects.filter(
+                RepoPermission.codename_filter("permission__"),
+                user_id__in=user_ids[start : start + BULK_BATCH_SIZE],
+            ).values_list("pk", "user_id", "permission_id"):
+                if permission_id in permission_ids[user_id]:
+                    current.add((user_id, permission_id))
+                else:
+                    stale.append(pk)
+        for start in range(0, len(stale), BULK_BATCH_SIZE):
+            through.objects.filter(
+                pk__in=stale[start : start + BULK_BATCH_SIZE]
+            ).delete()
+        through.objects.bulk_create(
+            [
+                through(user_id=user_id, permission_id=permission_id)
+                for user_id, ids in permission_ids.items()
+                for permission_id in ids
+                if (user_id, permission_id) not in current
+            ],
+            batch_size=BULK_BATCH_SIZE,
+        )
 
     def set_app_settings(self, settings: dict) -> None:
         """Set the user's app settings
@@ -177,37 +283,32 @@ class User(AbstractUser):
                 raise User.AppSettingsError(f"Unknown appSettings key {key}")
         self.save()
 
-    def normalize(self):
-        """Normalize this user into a GraphDB dict format"""
+    def normalize(self, granted_authorities: list[str] | None = None):
+        """Normalize this user into a GraphDB dict format
+
+        Args:
+            granted_authorities (list[str] | None): The repository permission codenames of the user.
+                Pass them when normalizing many users, otherwise they are queried for this user.
+        """
         data = {}
         data["username"] = self.username
         data["password"] = ""
 
         # Include the role in the permissions
-        granted_authorities = [self.role]
+        authorities = [self.role]
         # Only include per-repo permissions when the user has the USER role
         # GraphDB actually allows setting additional read/write permissions for singular
         # repos on admin and repo manager roles, which is strange
         if self.role == self.Role.USER:
-            # Get the available permission prefixes from the RepoPermission class
-            permission_prefixes = tuple(
-                map(
-                    RepoPermission.build_codename_prefix,
-                    RepoPermission.permission_functions().keys(),
+            if granted_authorities is None:
+                granted_authorities = list(
+                    self.user_permissions.filter(  # pylint: disable=no-member
+                        RepoPermission.codename_filter()
+                    ).values_list("codename", flat=True)
                 )
-            )
-            for (
-                permission_model
-            ) in self.user_permissions.all():  # pylint: disable=no-member
-                # Skip non-repo permissions
-                if permission_model.content_type.model_class() != Repository:
-                    continue
-                codename = permission_model.codename
-                # Check if the permission codename starts with one of the prefixes
-                if codename.startswith(permission_prefixes):
-                    granted_authorities.append(permission_model.codename)
-
-        data["grantedAuthorities"] = granted_authorities
+            authorities.extend(granted_authorities)
+
+        data["grantedAuthorities"] = authorities
         data["appSettings"] = {
             "DEFAULT_INFERENCE": self.default_inference,
             "DEFAULT_SAMEAS": self.default_sameas,
@@ -242,6 +343,72 @@ class RepoPermission(Permission):
 
         return repo_permissions
 
+    @classmethod
+    def ids(cls, codenames: list[str] | None = None) -> dict[str, int]:
+        """Map the codenames of repository permissions, including the wildcard permissions,
+        to their ids with a single query
+
+        Args:
+            codenames (list[str] | None): Only resolve these codenames, None resolves all
+        """
+        queryset = Permission.objects.filter(cls.codename_filter())
+        if codenames is not None:
+            queryset = queryset.filter(codename__in=codenames)
+        return dict(queryset.values_list("codename", "pk"))
+
+    @classmethod
+    def create_for(cls, repositories: list[Repository], names=None) -> None:
+        """Create the permissions of saved repositories with bulk queries
+
+        bulk_create() does not support multi-table inheritance, so the Permission rows are
+        inserted first and the RepoPermission rows that link them to the repositories second.
+        No signals are sent.
+
+        Args:
+            repositories (list[Repository]): The repositories
+            names: Names of the permissions to create, defaults to all
+        """
+        names = list(names or cls.permission_functions())
+        content_type = ContentType.objects.get_for_model(Repository)
+        repository_ids = {}
+        permissions = []
+        for repository in repositories:
+            for name in names:
+                codename = cls.build_codename(name, repository.slug)
+                repository_ids[codename] = repository.pk
+                permissions.append(
+                    Permission(
+                        codename=codename,
+                        name=cls.build_name(name, repository.slug),
+                        content_type=content_type,
+                    )
+                )
+        codenames = list(repository_ids)
+        with transaction.atomic():
+            # Permissions without their RepoPermission row are left over from a partial creation
+            Permission.objects.bulk_create(
+                permissions, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True
+            )
+            rows = []
+            # Fetch the ids, bulk_create does not set the primary keys on every database
+            for start in range(0, len(codenames), BULK_BATCH_SIZE):
+                rows.extend(
+                    (pk, repository_ids[codename])
+                    for codename, pk in Permission.objects.filter(
+                        content_type=content_type,
+                        codename__in=codenames[start : start + BULK_BATCH_SIZE],
+                    ).values_list("codename", "pk")
+                )
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {quote(cls._meta.db_table)} "  # pylint: disable=no-member
+                    f"({quote(cls._meta.pk.column)}, "  # pylint: disable=no-member
+                    f"{quote(cls._meta.get_field('repository').column)}) "  # pylint: disable=no-member
+                    "VALUES (%s, %s)",
+                    rows,
+                )
+
     @classmethod
     def permission_functions(cls) -> dict:
         """Return all functions that are decorated with @permission"""
@@ -252,6 +419,28 @@ class RepoPermission(Permission):
                 permissions[element.__name__] = element.__func__
         return permissions
 
+    @classmethod
+    def codename_prefixes(cls) -> tuple[str, ...]:
+        """The codename prefixes of all repository permissions"""
+        return tuple(map(cls.build_codename_prefix, cls.permission_functions().keys()))
+
+    @classmethod
+    def codename_filter(cls, prefix: str = "") -> Q:
+        """Filter for the repository permissions among all Permissions
+
+        Args:
+            prefix (str): Lookup path from the filtered model to the Permission, e.g. "permission__"
+        """
+        query = Q()
+        for codename_prefix in cls.codename_prefixes():
+            query |= Q(**{f"{prefix}codename__startswith": codename_prefix})
+        return query & Q(
+            **{
+                f"{prefix}content_type__app_label": Repository._meta.app_label,
+                f"{prefix}content_type__model": Repository._meta.model_name,
+            }
+        )
+
     @classmethod
     def build_codename_prefix(cls, permission_name: str) -> str:
         """Build the codename prefix for the permission"""
@@ -279,33 +468,77 @@ class RepoPermission(Permission):
         return f"{repository_id} | {permission_name}"
 
     @classmethod
-    @permission
-    def write(cls, func):
-        """Return a decorator that checks for write permission on the repo"""
-        # Get the current function name with inspection.
-        permission_name = inspect.stack()[0][3]
+    def has_permission(cls, user, repository_id: str, permission_name: str) -> bool:
+        """Check whether a user has a permission on a repository.
+
+        Raises:
+            Http404: When there's no repository with the given id.
+        """
+        repository = registry.get_or_404(repository_id)
+
+        # Figure out the permissions from the user's permissions and the global repo permissions.
+        if getattr(repository, f"public_{permission_name}"):
+            return True
+        if user.is_anonymous:
+            return False
+        if user.role in [User.Role.ADMIN, User.Role.REPO_MANAGER]:
+            return True
+        return acl.has_repository_permission(user, permission_name, repository_id)
+
+    @classmethod
+    def wrap_view(cls, func, permission_name: str, after=None):
+        """Wrap a sync or async view so it only gets called when the user has the permission
+
+        Args:
+            func: The view
+            permission_name (str): Name of the permission that is required
+            after: Called with the repository id after the view was called
+        """
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                request = args[-1]
+                repository_id = kwargs["repository_id"]
+                allowed = await sync_to_async(cls.has_permission)(
+                    request.user, repository_id, permission_name
+                )
+                if not allowed:
+                    return HttpResponseNotFound()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    if after is not None:
+                        await sync_to_async(after)(repository_id)
+
+            return async_wrapper
 
         @functools.wraps(func)
-        def write_wrapper(*args, **kwargs):
+        def wrapper(*args, **kwargs):
             # Seems like the request is always the last arg
             request = args[-1]
             repository_id = kwargs["repository_id"]
-            repository = get_object_or_404(Repository, slug=repository_id)
-
-            # Figure out the permissions from the user's permissions and the global repo permissions.
-            codename = cls.build_full_codename(permission_name, repository_id)
-            if (
-                repository.public_write
-                or not request.user.is_anonymous
-                and (
-                    request.user.role in [User.Role.ADMIN, User.Role.REPO_MANAGER]
-                    or request.user.has_perm(codename)
-                )
-            ):
+            if not cls.has_permission(request.user, repository_id, permission_name):
+                return HttpResponseNotFound()
+            try:
                 return func(*args, **kwargs)
-            return HttpResponseNotFound()
+            finally:
+                if after is not None:
+                    after(repository_id)
 
-        return write_wrapper
+        return wrapper
+
+    @classmethod
+    @permission
+    def write(cls, func):
+        """Return a decorator that checks for write permission on the repo
+
+        Every request that passes the check marks the repository as written,
+        which invalidates everything that is cached about its contents.
+        """
+        # Get the current function name with inspection.
+        permission_name = inspect.stack()[0][3]
+        return cls.wrap_view(func, permission_name, after=Repository.mark_written)
 
     @classmethod
     @permission
@@ -313,26 +546,7 @@ class RepoPermission(Permission):
         """Return a decorator that checks for read permission on the repo"""
         # Get the current function name with inspection.
         permission_name = inspect.stack()[0][3]
-
-        @functools.wraps(func)
-        def read_wrapper(*args, **kwargs):
-            # Seems like the request is always the last arg
-            request = args[-1]
-            repository_id = kwargs["repository_id"]
-            repository = get_object_or_404(Repository, slug=repository_id)
-
-            # Figure out the permissions from the user's permissions and the global repo permissions.
-            codename = cls.build_full_codename(permission_name, repository_id)
-            if (
-                repository.public_read
-                or hasattr(request.user, "role")
-                and request.user.role in [User.Role.ADMIN, User.Role.REPO_MANAGER]
-                or request.user.has_perm(codename)
-            ):
-                return func(*args, **kwargs)
-            return HttpResponseNotFound()
-
-        return read_wrapper
+        return cls.wrap_view(func, permission_name)
 
 
 class Query(models.Model):
@@ -348,10 +562,10 @@ class Repository(models.Model):
         """Error when there's no remote for a repo"""
 
         def __init__(
-                self,
-                repository_id: str,
-                status_code: int | None = None,
-                detail: str = "",
+            self,
+            repository_id: str,
+            status_code: int | None = None,
+            detail: str = "",
         ) -> None:
             parts = [f"RDF4J size request failed for repository {repository_id!r}"]
             if status_code is not None:
@@ -400,7 +614,7 @@ Available variables:
             ("WRITE_REPO_*", "Write to every repository"),
         ]
 
-    slug = models.CharField(max_length=255, blank=False, default=None)
+    slug = models.CharField(max_length=255, blank=False, default=None, unique=True)
     description = models.TextField(null=True, default="")
     public_read = models.BooleanField(default=False)
     public_write = models.BooleanField(default=False)
@@ -441,18 +655,7 @@ Available variables:
         if not permissions:
             permissions = RepoPermission.permission_functions()
 
-        repo_content_type = ContentType.objects.get(
-            app_label="rdf4j", model="repository"
-        )
-
-        for name in permissions:
-            perm = RepoPermission.objects.create(
-                codename=RepoPermission.build_codename(name, self.slug),
-                name=RepoPermission.build_name(name, self.slug),
-                content_type=repo_content_type,
-                repository=self,
-            )
-            perm.save()
+        RepoPermission.create_for([self], permissions)
 
     def to_turtle(self) -> str:
         """Normalize the repository settings into turtle format"""
@@ -477,72 +680,207 @@ Available variables:
                 kwargs[object_key] = value
         return cls.objects.create(**kwargs)
 
-    def size(self) -> int:
+    @staticmethod
+    def mark_written(repository_id: str) -> None:
+        """Mark the contents of a repository as changed"""
+        generations.bump(generations.repository_key(repository_id))
+
+    @staticmethod
+    def reset_contents(*repository_ids: str) -> None:
+        """Forget everything that is cached about the contents of created or deleted repositories.
+
+        A repository that is created with the slug of a deleted one must not inherit its triple
+        count, cached query results or ETags. Call it inside of the transaction that creates or
+        deletes the repositories.
+        """
+        generations.bump(*(generations.repository_key(slug) for slug in repository_ids))
+        transaction.on_commit(
+            lambda: caches[SHARED_CACHE].delete_many(
+                [Repository.size_cache_key(slug) for slug in repository_ids]
+            )
+        )
+
+    def size(self, stale_ok: bool = False) -> int:
         """Get the number of triples in this repository.
 
+        Counting the triples is expensive for RDF4J, so the count is cached until the next write
+        to the repository (see RepoPermission.write).
+
+        Args:
+            stale_ok (bool): Return the cached count even if the repository was written to since.
+                The count is then refreshed in the background.
+
+        Raises:
+            Repository.NoRemoteError: When the RDF4J request fails or the body is not an integer.
+
+        Returns:
+            int: The number of triples in this repo.
+        """
+        generation = generations.get(generations.repository_key(self.slug))
+        cached = caches[SHARED_CACHE].get(self.size_cache_key(self.slug))
+        if cached is not None:
+            cached_generation, size = cached
+            if cached_generation == generation:
+                return size
+            if stale_ok:
+                Repository.refresh_size_in_background(self.slug)
+                return size
+        return self.refresh_size(generation)
+
+    @staticmethod
+    def size_cache_key(repository_id: str) -> str:
+        """Key of the cached triple count of a repository"""
+        return f"size:{repository_id}"
+
+    def refresh_size(self, generation: int | None = None) -> int:
+        """Count the triples in RDF4J and cache the count
+
+        Args:
+            generation (int | None): Generation of the repository before counting
+        """
+        if generation is None:
+            generation = generations.get(generations.repository_key(self.slug))
+        size = self.count()
+        caches[SHARED_CACHE].set(self.size_cache_key(self.slug), (generation, size))
+        return size
+
+    # Repositories whose size is currently refreshed in the background by this process
+    _refreshing: set[str] = set()
+    _refreshing_lock = threading.Lock()
+
+    @classmethod
+    def refresh_size_in_background(cls, repository_id: str) -> None:
+        """Refresh the cached count in a background thread, unless that's already happening"""
+        with cls._refreshing_lock:
+            if repository_id in cls._refreshing:
+                return
+            cls._refreshing.add(repository_id)
+
+        def refresh() -> None:
+            try:
+                cls(slug=repository_id).refresh_size()
+            except Repository.NoRemoteError:
+                pass
+            finally:
+                with cls._refreshing_lock:
+                    cls._refreshing.discard(repository_id)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def count(self) -> int:
+        """Let RDF4J count the triples in this repository.
+
         Raises:
             Repository.NoRemoteError: When the RDF4J request fails or the body is not an integer.
 
         Returns:
             int: The number of triples in this repo.
         """
-        url = f"{RDF4J_URL}{RDF4J_REPOSITORY_PATH}{self.slug}/size"
         try:
-            response = requests.get(url=url, timeout=REQUEST_TIMEOUT)
-        except requests.RequestException as e:
+            response = backend.request("GET", backend.repository_url(self.slug, "size"))
+        except HTTPError as e:
             raise Repository.NoRemoteError(self.slug, None, str(e)) from e
-            body = (response.text or "")[:500]
-        if response.status_code != 200:
-            raise Repository.NoRemoteError(self.slug, response.status_code, body)
+        text = response.data.decode("utf-8", errors="replace")
+        if response.status != 200:
+            raise Repository.NoRemoteError(self.slug, response.status, text[:500])
         try:
-            return int(response.text.strip())
+            return int(text.strip())
         except ValueError as e:
             raise Repository.NoRemoteError(
                 self.slug,
-                response.status_code,
-                f"invalid size payload: {(response.text or '')[:200]!r}",
+                response.status,
+                f"invalid size payload: {text[:200]!r}",
             ) from e
 
-    def create_remote(self) -> None:
-        """Create the corresponding repository on the RDF4J server"""
-        url = f"{RDF4J_URL}{RDF4J_REPOSITORY_PATH}{self.slug}"
+    def create_remote(
+        self, timeout: float | None = None, exist_ok: bool = False
+    ) -> None:
+        """Create the corresponding repository on the RDF4J server
+
+        Args:
+            timeout (float | None): Override the read timeout of RDF4J requests
+            exist_ok (bool): Succeed if the remote exists already, e.g. when an earlier
+                attempt created it but its response timed out
+        """
         headers = {"Content-Type": "text/turtle"}
 
-        response = requests.put(
-            url=url, data=self.to_turtle(), headers=headers, timeout=REQUEST_TIMEOUT
+        response = backend.request(
+            "PUT",
+            backend.repository_url(self.slug),
+            body=self.to_turtle().encode("utf-8"),
+            headers=headers,
+            timeout=timeout,
         )
 
         # TODO: Better error handling here... See if there are different codes
         # and messages that are returned by rdf4j and handle them accordingly
-        if response.status_code != 204:
+        if response.status != 204 and not (
+            exist_ok and (response.status == 409 or self.remote_exists(timeout))
+        ):
             raise IntegrityError(f"The {self.slug} repository already has a remote!")
         self.has_remote = True
 
-    def delete_remote(self) -> None:
-        """Delete the corresponding repository from from the RDF4J server"""
-        url = f"{RDF4J_URL}{RDF4J_REPOSITORY_PATH}{self.slug}"
-        response = requests.delete(url=url, timeout=REQUEST_TIMEOUT)
+    def remote_exists(self, timeout: float | None = None) -> bool:
+        """Check if the corresponding repository exists on the RDF4J server"""
+        response = backend.request(
+            "GET",
+            backend.repository_url(self.slug, "namespaces"),
+            headers={"Accept": "application/sparql-results+json"},
+            timeout=timeout,
+        )
+        return response.status == 200
+
+    def delete_remote(self, timeout: float | None = None) -> None:
+        """Delete the corresponding repository from from the RDF4J server
 
-        if response.status_code != 204:
+        Args:
+            timeout (float | None): Override the read timeout of RDF4J requests,
+                deleting a large repository takes a while
+        """
+        response = backend.request(
+            "DELETE", backend.repository_url(self.slug), timeout=timeout
+        )
+
+        # 404: The remote is already gone
+        if response.status not in (204, 404):
             raise IntegrityError(
                 f"Something went wrong while deleting the {self.slug} repo from the RDF4J server"
             )
         self.has_remote = False
 
-    def sparql(self, sparql: str, query_type: Query.Type) -> str | dict:
-        """Send a SPARQL update to the RDF4J write endpoint"""
+    def sparql(
+        self,
+        sparql: str,
+        query_type: Query.Type,
+        count: bool = True,
+        limit: int | None = None,
+    ) -> dict | QueryResult:
+        """Send a SPARQL query or update to the RDF4J endpoint
+
+        Args:
+            sparql (str): The query or update
+            query_type (Query.Type): The type of the query
+            count (bool): Report the number of affected triples of an update.
+                This needs (cached) triple counts before and after the update.
+            limit (int | None): Maximum number of rows read from the result of a query.
+
+        Returns:
+            dict | QueryResult: A dict with a message for updates and errors.
+                The result of a query, whose rows are read from RDF4J while iterating them.
+        """
         if query_type not in Query.Type:
             raise TypeError(f"Unknown sparql query type: {query_type}")
 
         if query_type == Query.Type.UPDATE:
-            url = f"{RDF4J_URL}{RDF4J_REPOSITORY_PATH}{self.slug}/statements"
+            url = backend.repository_url(self.slug, "statements")
             content_type = "application/sparql-update"
-            try:
-                size_before = self.size()
-            except Exception as e:
-                raise NotImplementedError("Do error handling here") from e
+            if count:
+                try:
+                    size_before = self.size()
+                except Exception as e:
+                    raise NotImplementedError("Do error handling here") from e
         elif query_type == Query.Type.QUERY:
-            url = f"{RDF4J_URL}{RDF4J_REPOSITORY_PATH}{self.slug}"
+            url = backend.repository_url(self.slug)
             content_type = "application/sparql-query"
 
         headers = {
@@ -550,24 +888,96 @@ Available variables:
             "Accept": "application/sparql-results+json",
         }
 
-        response = requests.post(
-            url=url, data=sparql, headers=headers, timeout=REQUEST_TIMEOUT
+        response = backend.request(
+            "POST",
+            url,
+            body=sparql.encode("utf-8"),
+            headers=headers,
+            stream=query_type == Query.Type.QUERY,
         )
 
-        if response.status_code != 200:
-            return {"message": response.text}
+        if response.status not in (200, 204):
+            message = response.data.decode("utf-8", errors="replace")
+            response.release_conn()
+            return {"message": message}
 
         if query_type == Query.Type.UPDATE:
+            Repository.mark_written(self.slug)
+            if not count:
+                return {"message": "Update executed"}
             size_after = self.size()
             return {"message": f"Affected triples: {size_after - size_before}"}
         if query_type == Query.Type.QUERY:
+            return QueryResult(backend.iter_response(response), limit=limit)
 
-            def preprocess_data(data):
-                headers = data["head"]["vars"]
-                for binding in data["results"]["bindings"]:
-                    binding["row"] = [
-                        binding.get(header, {}).get("value", "") for header in headers
-                    ]
-                return data
 
-            return preprocess_data(response.json())
+class RemoteJob(models.Model):
+    """Creation or deletion of a repository on the RDF4J server.
+
+    The jobs are queued by the signal handlers and run by the run_remote_jobs command,
+    so requests don't wait for RDF4J. See jobs.py.
+    """
+
+    class Action(models.TextChoices):  # pylint: disable=too-many-ancestors
+        """What to do on the RDF4J server"""
+
+        CREATE = "create", "Create"
+        DELETE = "delete", "Delete"
+
+    class State(models.TextChoices):  # pylint: disable=too-many-ancestors
+        """Lifecycle of a job"""
+
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    action = models.CharField(max_length=6, choices=Action.choices)
+    # The slug and not a foreign key, the repository is already gone when it is deleted remotely
+    repository_slug = models.CharField(max_length=255, db_index=True)
+    state = models.CharField(max_length=7, choices=State.choices, default=State.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Pending jobs are not run before this time, used for the backoff of retries
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "run_after"])]
+
+    def __str__(self) -> str:
+        return f"{self.action} {self.repository_slug} ({self.state})"
+
+    def to_dict(self) -> dict:
+        """Normalize the job into a dict for the status route"""
+        return {
+            "id": self.pk,
+            "action": self.action,
+            "repository": self.repository_slug,
+            "state": self.state,
+            "attempts": self.attempts,
+            "runAfter": self.run_after.isoformat(),
+            "lastError": self.last_error,
+            "created": self.created.isoformat(),
+            "updated": self.updated.isoformat(),
+        }
+
+
+class Transaction(models.Model):
+    """An open RDF4J transaction, only its owner may use it.
+
+    Transactions that are idle for longer than TRANSACTION_IDLE_TIMEOUT are rolled back by the
+    rollback_idle_transactions command. See transactions.py.
+    """
+
+    # The id that RDF4J assigned to the transaction
+    transaction_id = models.CharField(max_length=64, unique=True)
+    # The slug and not a foreign key, like RemoteJob
+    repository_slug = models.CharField(max_length=255, db_index=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.transaction_id} on {self.repository_slug}"
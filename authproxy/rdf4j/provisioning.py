@@ -0,0 +1,453 @@
+"""Bulk provisioning of users and repositories.
+
+Users are imported and exported as NDJSON, one user per line in the GraphDB format of
+/rest/security/users/<username>, e.g.
+{"username": "test", "password": "secret", "grantedAuthorities": ["ROLE_USER", "READ_REPO_test"]}
+
+An import is validated completely before anything is written, then all users and their
+repository permissions are written in one transaction with bulk queries. Like in
+User.set_settings(), the grantedAuthorities of an imported user replace their repository
+permissions. Passwords are hashed in parallel before the transaction starts, already hashed
+passwords can be passed as "passwordHash" instead of "password".
+
+Repositories are created from a list of GraphDB repository dicts. Their RDF4J remotes are
+created concurrently and the repositories and their permissions are inserted with bulk queries.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.db import DatabaseError, transaction
+
+from authproxy.settings import REPOSITORY_PROVISIONING_WORKERS
+
+from . import generations
+from .models import BULK_BATCH_SIZE, Repository, RepoPermission, User
+
+# Keys of an imported user, besides the keys of the GraphDB format only passwordHash is added
+USER_KEYS = {*User.SETTINGS, "passwordHash"}
+
+
+class InvalidUsers(ValueError):
+    """The import contains invalid users, nothing was written"""
+
+    def __init__(self, errors: list[tuple[int, str]]) -> None:
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid line(s), nothing was imported")
+
+    def as_dict(self) -> dict:
+        """Error response body"""
+        return {
+            "message": str(self),
+            "errors": [
+                {"line": line, "message": message} for line, message in self.errors
+            ],
+        }
+
+
+class UserRecord:
+    """A validated user of an import"""
+
+    def __init__(self, line: int, username: str) -> None:
+        self.line = line
+        self.username = username
+        self.password: str | None = None
+        self.password_hash: str | None = None
+        # None keeps the role of existing users, new users get ROLE_USER
+        self.role: str | None = None
+        # None keeps the repository permissions of existing users
+        self.permission_ids: set[int] | None = None
+        self.app_settings: dict[str, bool] = {}
+
+
+def read_lines(lines: Iterable[bytes | str]) -> Iterator[tuple[int, dict | str]]:
+    """Parse NDJSON, yields (line number, user dict) or (line number, error message)"""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(data, dict):
+            yield number, "Expected a JSON object"
+            continue
+        yield number, data
+
+
+def validate(lines: Iterable[bytes | str]) -> list[UserRecord]:
+    """Validate all users of an import
+
+    Raises:
+        InvalidUsers: With the errors of all invalid lines
+    """
+    permission_ids = RepoPermission.ids()
+    records = []
+    errors = []
+    lines_by_username: dict[str, int] = {}
+    for number, data in read_lines(lines):
+        if isinstance(data, str):
+            errors.append((number, data))
+            continue
+        try:
+            record = _validate_user(number, data, permission_ids)
+        except ValueError as e:
+            errors.append((number, str(e)))
+            continue
+        if record.username in lines_by_username:
+            errors.append(
+                (
+                    number,
+                    f"Duplicate username {record.username}, "
+                    f"already on line {lines_by_username[record.username]}",
+                )
+            )
+            continue
+        lines_by_username[record.username] = number
+        records.append(record)
+    if errors:
+        raise InvalidUsers(errors)
+    return records
+
+
+def _validate_user(
+    number: int, data: dict, permission_ids: dict[str, int]
+) -> UserRecord:
+    if unknown := set(data) - USER_KEYS:
+        raise ValueError(f"Unknown settings key {', '.join(sorted(unknown))}")
+    username = data.get("username")
+    if not isinstance(username, str) or not username:
+        raise ValueError("username is required")
+    max_length = User._meta.get_field(
+        "username"
+    ).max_length  # pylint: disable=protected-access
+    if len(username) > max_length:
+        raise ValueError(f"username is longer than {max_length} characters")
+    record = UserRecord(number, username)
+
+    password = data.get("password")
+    if password is not None and not isinstance(password, str):
+        raise ValueError("password must be a string")
+    if password and "passwordHash" in data:
+        raise ValueError("Pass either password or passwordHash")
+    # The GraphDB format exports an empty password, which keeps the current one
+    record.password = password or None
+    if (password_hash := data.get("passwordHash")) is not None:
+        try:
+            identify_hasher(password_hash)
+        except (TypeError, ValueError) as e:
+            raise ValueError("passwordHash uses an unknown hasher") from e
+        record.password_hash = password_hash
+
+    app_settings = data.get("appSettings", {})
+    if not isinstance(app_settings, dict):
+        raise ValueError("appSettings must be an object")
+    for key, value in app_settings.items():
+        if key not in User.APP_SETTINGS:
+            raise ValueError(f"Unknown appSettings key {key}")
+        if not isinstance(value, bool):
+            raise ValueError(f"appSettings {key} must be a boolean")
+        record.app_settings[key.lower()] = value
+
+    if "grantedAuthorities" in data:
+        authorities = data["grantedAuthorities"]
+        if not isinstance(authorities, list):
+            raise ValueError("grantedAuthorities must be a list")
+        try:
+            record.role, record.permission_ids = User.resolve_authorities(
+                authorities, permission_ids
+            )
+        except User.UnknownAuthorityError as e:
+            raise ValueError(str(e)) from e
+    return record
+
+
+def hash_passwords(records: list[UserRecord], workers: int | None = None) -> None:
+    """Hash the plain text passwords in parallel, the hashers release the GIL"""
+    pending = [record for record in records if record.password is not None]
+    if not pending:
+        return
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        hashes = executor.map(make_password, [record.password for record in pending])
+        for record, password_hash in zip(pending, hashes):
+            record.password_hash = password_hash
+            record.password = None
+
+
+def import_users(
+    records: list[UserRecord], workers: int | None = None
+) -> dict[str, int]:
+    """Create and update the validated users in one transaction
+
+    Args:
+        workers (int | None): Threads for hashing passwords, defaults to the number of CPUs
+
+    Returns:
+        dict[str, int]: Number of created and updated users
+    """
+    hash_passwords(records, workers)
+    with transaction.atomic():
+        user_ids = _user_ids([record.username for record in records])
+        created = []
+        for record in records:
+            if record.username in user_ids:
+                continue
+            user = User(username=record.username, role=record.role or User.Role.USER)
+            if record.password_hash is None:
+                user.set_unusable_password()
+            else:
+                user.password = record.password_hash
+            for field, value in record.app_settings.items():
+                setattr(user, field, value)
+            created.append(user)
+        User.objects.bulk_create(created, batch_size=BULK_BATCH_SIZE)
+        _update_users(
+            [record for record in records if record.username in user_ids], user_ids
+        )
+
+        # bulk_create does not set the primary keys on every database
+        user_ids.update(_user_ids([user.username for user in created]))
+        User.replace_repository_permissions(
+            {
+                user_ids[record.username]: record.permission_ids
+                for record in records
+                if record.permission_ids is not None
+            }
+        )
+
+        # Bulk queries send no signals, so the cached ACLs and credentials are invalidated here
+        generations.bump(*(generations.user_key(pk) for pk in user_ids.values()))
+    return {"created": len(created), "updated": len(records) - len(created)}
+
+
+def _user_ids(usernames: list[str]) -> dict[str, int]:
+    """Map the usernames of existing users to their ids"""
+    user_ids = {}
+    for start in range(0, len(usernames), BULK_BATCH_SIZE):
+        user_ids.update(
+            User.objects.filter(
+                username__in=usernames[start : start + BULK_BATCH_SIZE]
+            ).values_list("username", "pk")
+        )
+    return user_ids
+
+
+def _update_users(records: list[UserRecord], user_ids: dict[str, int]) -> None:
+    """Update existing users with one query per distinct combination of changes
+
+    Imports usually set the same role and app settings for many users, so grouping them is a lot
+    cheaper than the CASE expressions of bulk_update(). Only the password hashes differ per user.
+    """
+    groups: dict[tuple, list[int]] = {}
+    passwords = []
+    for record in records:
+        changes = dict(record.app_settings)
+        if record.role is not None:
+            changes["role"] = record.role
+        if changes:
+            groups.setdefault(tuple(sorted(changes.items())), []).append(
+                user_ids[record.username]
+            )
+        if record.password_hash is not None:
+            passwords.append(
+                User(pk=user_ids[record.username], password=record.password_hash)
+            )
+    for changes, pks in groups.items():
+        for start in range(0, len(pks), BULK_BATCH_SIZE):
+            User.objects.filter(pk__in=pks[start : start + BULK_BATCH_SIZE]).update(
+                **dict(changes)
+            )
+    User.objects.bulk_update(passwords, ["password"], batch_size=BULK_BATCH_SIZE)
+
+
+def iter_users(users, permissions) -> Iterator[tuple[User, list[str]]]:
+    """Merge the users with their repository permission codenames
+
+    Args:
+        users: Users ordered by pk
+        permissions: (user_id, codename) pairs ordered by user_id
+    """
+    permissions = iter(permissions)
+    pending = next(permissions, None)
+    for user in users:
+        # Skip permissions of users that are not part of the listing
+        while pending is not None and pending[0] < user.pk:
+            pending = next(permissions, None)
+        codenames = []
+        while pending is not None and pending[0] == user.pk:
+            codenames.append(pending[1])
+            pending = next(permissions, None)
+        yield user, codenames
+
+
+def repository_grants(**user_lookups):
+    """(user_id, codename) pairs of the repository permissions of users with the USER role
+
+    Args:
+        user_lookups: Filters on the users, e.g. username__icontains="test"
+    """
+    # Only users with the USER role list their repository permissions, see User.normalize()
+    return (
+        User.user_permissions.through.objects.filter(  # pylint: disable=no-member
+            RepoPermission.codename_filter("permission__"),
+            user__role=User.Role.USER,
+        )
+        .filter(**{f"user__{key}": value for key, value in user_lookups.items()})
+        .order_by("user_id", "permission__codename")
+        .values_list("user_id", "permission__codename")
+    )
+
+
+def export_users(password_hashes: bool = False, **user_lookups) -> Iterator[str]:
+    """Export users as NDJSON lines with two queries
+
+    Args:
+        password_hashes (bool): Include the password hashes as passwordHash, so the users can
+            be imported elsewhere with their passwords
+        user_lookups: Filters on the users, e.g. username__icontains="test"
+    """
+    users = User.objects.filter(**user_lookups).order_by("pk").iterator()
+    for user, codenames in iter_users(
+        users, repository_grants(**user_lookups).iterator()
+    ):
+        data = user.normalize(codenames)
+        if password_hashes and user.has_usable_password():
+            data["passwordHash"] = user.password
+        yield json.dumps(data) + "\n"
+
+
+def _validate_repository(spec, existing: set[str], seen: set[str]) -> dict:
+    """Turn a GraphDB repository dict into Repository kwargs"""
+    if not isinstance(spec, dict):
+        raise ValueError("Expected a JSON object")
+    if unknown := set(spec) - set(Repository.ATTRIBUTE_MAP):
+        raise ValueError(f"Unknown key {', '.join(sorted(unknown))}")
+    slug = spec.get("id")
+    if not isinstance(slug, str) or not slug:
+        raise ValueError("id is required")
+    max_length = Repository._meta.get_field(  # pylint: disable=protected-access
+        "slug"
+    ).max_length
+    if len(slug) > max_length or "/" in slug:
+        raise ValueError(f"Invalid id {slug}")
+    if slug in existing:
+        raise ValueError(f"The repository {slug} already exists")
+    if slug in seen:
+        raise ValueError(f"Duplicate id {slug}")
+    kwargs = {}
+    for dict_key, object_key in Repository.ATTRIBUTE_MAP.items():
+        if value := spec.get(dict_key):
+            kwargs[object_key] = value
+    return kwargs
+
+
+def create_repositories(specs: list, workers: int | None = None) -> list[dict]:
+    """Create repositories, their RDF4J remotes and their permissions
+
+    The remotes are created concurrently, then all repositories that got a remote are saved
+    with their permissions in one transaction. If that fails, their remotes are deleted again.
+    Repositories that fail do not affect the others.
+
+    Args:
+        specs (list): Repositories in the GraphDB format of /rest/repositories, e.g.
+            {"id": "test", "title": "Test", "publicRead": false}
+        workers (int | None): Remotes created at the same time, defaults to
+            REPOSITORY_PROVISIONING_WORKERS. The requests also wait for free connections to RDF4J.
+
+    Returns:
+        list[dict]: {"id": ..., "created": bool, "message": ...} for every spec, in order
+    """
+    slugs = [
+        spec["id"]
+        for spec in specs
+        if isinstance(spec, dict) and isinstance(spec.get("id"), str)
+    ]
+    existing = set()
+    for start in range(0, len(slugs), BULK_BATCH_SIZE):
+        existing.update(
+            Repository.objects.filter(
+                slug__in=slugs[start : start + BULK_BATCH_SIZE]
+            ).values_list("slug", flat=True)
+        )
+
+    results = []
+    pending = []
+    seen = set()
+    for spec in specs:
+        result = {"id": spec.get("id") if isinstance(spec, dict) else None}
+        results.append(result)
+        try:
+            kwargs = _validate_repository(spec, existing, seen)
+        except ValueError as e:
+            result.update(created=False, message=str(e))
+            continue
+        seen.add(kwargs["slug"])
+        pending.append((result, Repository(**kwargs)))
+
+    def create_remote(repository: Repository) -> Exception | None:
+        try:
+            repository.create_remote()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return e
+        return None
+
+    with ThreadPoolExecutor(
+        max_workers=workers or REPOSITORY_PROVISIONING_WORKERS
+    ) as executor:
+        errors = list(
+            executor.map(create_remote, [repository for _, repository in pending])
+        )
+    created = []
+    for (result, repository), error in zip(pending, errors):
+        if error is None:
+            created.append((result, repository))
+        else:
+            result.update(created=False, message=str(error))
+
+    repositories = [repository for _, repository in created]
+    if not repositories:
+        return results
+    try:
+        with transaction.atomic():
+            Repository.objects.bulk_create(repositories, batch_size=BULK_BATCH_SIZE)
+            # Fetch the ids, bulk_create does not set the primary keys on every database
+            slugs = [repository.slug for repository in repositories]
+            ids = {}
+            for start in range(0, len(slugs), BULK_BATCH_SIZE):
+                ids.update(
+                    Repository.objects.filter(
+                        slug__in=slugs[start : start + BULK_BATCH_SIZE]
+                    ).values_list("slug", "pk")
+                )
+            for repository in repositories:
+                repository.pk = ids[repository.slug]
+            RepoPermission.create_for(repositories)
+            # Bulk queries send no signals, see signals/handlers.py
+            generations.bump(generations.REPOSITORIES, generations.ACL)
+            Repository.reset_contents(*slugs)
+    except DatabaseError as e:
+        # Roll back the remotes, so RDF4J and the database stay consistent
+        with ThreadPoolExecutor(
+            max_workers=workers or REPOSITORY_PROVISIONING_WORKERS
+        ) as executor:
+            executor.map(_delete_remote, repositories)
+        for result, _ in created:
+            result.update(created=False, message=str(e))
+        return results
+
+    for result, _ in created:
+        result.update(created=True, message="")
+    return results
+
+
+def _delete_remote(repository: Repository) -> None:
+    try:
+        repository.delete_remote()
+    except Exception:  # pylint: disable=broad-exception-caught
+        pass
@@ -0,0 +1,261 @@
+"""Per-process cache for the results of SPARQL queries.
+
+Results are cached under the repository, the normalized query text, the Accept header and all other
+query parameters (e.g. infer). Every entry is tagged with the write generation of its repository,
+which every route guarded by RepoPermission.write bumps, see Repository.mark_written().
+An entry is only served while the generation is unchanged.
+
+The bodies are stored zlib compressed. The least recently used entries are evicted once the cache
+holds more than QUERY_CACHE_SIZE compressed bytes.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import AsyncIterator, Iterable, Iterator
+
+from django.http import HttpRequest, QueryDict, StreamingHttpResponse
+
+from authproxy.settings import QUERY_CACHE_MAX_ENTRY_SIZE, QUERY_CACHE_SIZE
+
+from . import generations
+
+# String literals and IRIs, whitespace inside of them is significant
+_LITERAL = re.compile(
+    r"(\"\"\"(?:[^\"\\]|\\.|\"(?!\"\"))*\"\"\""
+    r"|'''(?:[^'\\]|\\.|'(?!''))*'''"
+    r"|\"(?:[^\"\\\n]|\\.)*\""
+    r"|'(?:[^'\\\n]|\\.)*'"
+    r"|<[^<>\s]*>)"
+)
+_WHITESPACE = re.compile(r"\s+")
+
+# Headers of the RDF4J response that are not stored
+_SKIPPED_HEADERS = {"Transfer-Encoding", "Content-Encoding", "Connection", "Keep-Alive"}
+
+
+def normalize_query(query: str) -> str:
+    """Collapse all whitespace outside of literals and IRIs, so formatting does not matter"""
+    parts = _LITERAL.split(query)
+    # Every odd part is a literal or IRI
+    for i in range(0, len(parts), 2):
+        parts[i] = _WHITESPACE.sub(" ", parts[i])
+    return "".join(parts).strip()
+
+
+class Entry:
+    """A cached response"""
+
+    def __init__(
+        self,
+        generation: int,
+        status: int,
+        headers: list[tuple[str, str]],
+        chunks: list[bytes],
+    ) -> None:
+        self.generation = generation
+        self.status = status
+        self.headers = headers
+        self.chunks = chunks
+        self.size = sum(len(chunk) for chunk in chunks)
+
+    def iter_body(self) -> Iterator[bytes]:
+        """Decompress the body chunk by chunk"""
+        decompressor = zlib.decompressobj()
+        for chunk in self.chunks:
+            if data := decompressor.decompress(chunk):
+                yield data
+        if data := decompressor.flush():
+            yield data
+
+    async def aiter_body(self) -> AsyncIterator[bytes]:
+        """Async version of iter_body() for the ASGI views"""
+        for data in self.iter_body():
+            yield data
+
+
+class QueryCache:
+    """Size bounded LRU cache of query results"""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[str, Entry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def get(self, key: str, generation: int) -> Entry | None:
+        """Get the entry if it was cached at the given generation"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.generation != generation:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, entry: Entry) -> None:
+        """Store an entry and evict the least recently used ones if the cache is full"""
+        if entry.size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._size += entry.size
+            self.stores += 1
+            while self._size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        self._size -= self._entries.pop(key).size
+
+    def stats(self) -> dict[str, int]:
+        """Snapshot of the counters"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_size,
+            }
+
+
+CACHE = QueryCache(QUERY_CACHE_SIZE)
+
+
+def cache_key(request: HttpRequest, repository_id: str) -> str | None:
+    """Build the cache key of a query request, None if the request cannot be cached"""
+    # Unwrap the rest_framework request, the body is read as it is
+    http_request = getattr(request, "_request", request)
+    if not QUERY_CACHE_SIZE or http_request.method not in ("GET", "POST"):
+        return None
+    if "no-cache" in http_request.headers.get("Cache-Control", ""):
+        return None
+
+    params = http_request.GET.copy()
+    if http_request.method == "POST":
+        content_type = http_request.content_type
+        encoding = http_request.encoding or "utf-8"
+        if content_type == "application/x-www-form-urlencoded":
+            params.update(QueryDict(http_request.body, encoding=encoding))
+        elif content_type == "application/sparql-query":
+            params["query"] = http_request.body.decode(encoding)
+        else:
+            return None
+    query = params.pop("query", None)
+    if not query:
+        return None
+
+    fingerprint = json.dumps(
+        [
+            repository_id,
+            normalize_query(query[-1]),
+            http_request.headers.get("Accept", "").replace(" ", ""),
+            sorted(params.lists()),
+        ]
+    )
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+
+def current_generation(repository_id: str) -> int:
+    """The write generation the entries of a repository are tagged with"""
+    return generations.get(generations.repository_key(repository_id))
+
+
+def cached_response(
+    key: str, generation: int, asynchronous: bool = False
+) -> StreamingHttpResponse | None:
+    """Build the response from the cache if it was cached at the current generation"""
+    entry = CACHE.get(key, generation)
+    if entry is None:
+        return None
+    response = StreamingHttpResponse(
+        streaming_content=entry.aiter_body() if asynchronous else entry.iter_body(),
+        status=entry.status,
+    )
+    for header, value in entry.headers:
+        response[header] = value
+    return response
+
+
+class _Recorder:
+    """Compress a streamed response and store it once it is complete"""
+
+    def __init__(self, key: str, generation: int, status: int, headers) -> None:
+        self.key = key
+        self.generation = generation
+        self.status = status
+        self.headers = [
+            (header, headers[header])
+            for header in headers
+            if header.title() not in _SKIPPED_HEADERS
+        ]
+        self.compressor = zlib.compressobj()
+        self.chunks: list[bytes] | None = [] if status == 200 else None
+        self.read = 0
+
+    def feed(self, chunk: bytes) -> None:
+        if self.chunks is None:
+            return
+        self.read += len(chunk)
+        if self.read > QUERY_CACHE_MAX_ENTRY_SIZE:
+            # Too large to be cached, stop recording
+            self.chunks = None
+            return
+        if data := self.compressor.compress(chunk):
+            self.chunks.append(data)
+
+    def finish(self) -> None:
+        if self.chunks is None:
+            return
+        self.chunks.append(self.compressor.flush())
+        CACHE.set(
+            self.key, Entry(self.generation, self.status, self.headers, self.chunks)
+        )
+
+
+def tee(
+    key: str, generation: int, status: int, headers, chunks: Iterable[bytes]
+) -> Iterator[bytes]:
+    """Pass the body through and store it in the cache once it was read completely.
+
+    Args:
+        generation (int): The generation of the repository before the query was sent to RDF4J.
+            A write that happens while the query runs then invalidates the entry.
+    """
+    recorder = _Recorder(key, generation, status, headers)
+    for chunk in chunks:
+        recorder.feed(chunk)
+        yield chunk
+    recorder.finish()
+
+
+async def atee(
+    key: str, generation: int, status: int, headers, chunks: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    """Async version of tee()"""
+    recorder = _Recorder(key, generation, status, headers)
+    async for chunk in chunks:
+        recorder.feed(chunk)
+        yield chunk
+    recorder.finish()
+
+
+def stats() -> dict[str, int]:
+    """Statistics of the cache of this worker process"""
+    return CACHE.stats()
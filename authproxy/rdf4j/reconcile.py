@@ -0,0 +1,213 @@
+"""Reconciliation of the repositories in the database with the repositories on RDF4J.
+
+The repositories of RDF4J are fetched with a single request and compared with the database:
+- Repositories without a remote get one.
+- Remotes without a repository (orphans) are adopted as repositories, or deleted.
+- Repositories without all of their RepoPermissions get the missing ones.
+
+Remotes are created and deleted concurrently, the database is changed with bulk queries.
+Repositories with unfinished jobs (see jobs.py) are left to the job worker.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+
+from authproxy.settings import REPOSITORY_PROVISIONING_WORKERS, RDF4J_REPOSITORY_PATH
+
+from . import backend, generations
+from .models import BULK_BATCH_SIZE, RemoteJob, Repository, RepoPermission
+
+# Internal repository of RDF4J that is never adopted or deleted
+SYSTEM_REPOSITORY = "SYSTEM"
+
+
+class Report:
+    """What a reconciliation found and did"""
+
+    def __init__(self, dry_run: bool) -> None:
+        self.dry_run = dry_run
+        self.missing_remotes: list[str] = []
+        self.orphans: list[str] = []
+        self.missing_permissions: dict[str, list[str]] = {}
+        # Repository -> error of the repair
+        self.errors: dict[str, str] = {}
+        # Phase -> duration in s
+        self.timings: dict[str, float] = {}
+
+    def summary(self) -> str:
+        """Human readable summary"""
+        prefix = "Found" if self.dry_run else "Repaired"
+        lines = [
+            f"{prefix} {len(self.missing_remotes)} repositories without a remote",
+            f"{prefix} {len(self.orphans)} remotes without a repository",
+            f"{prefix} {len(self.missing_permissions)} repositories with missing permissions",
+        ]
+        if self.errors:
+            lines.append(f"{len(self.errors)} repairs failed")
+        lines.append(
+            ", ".join(
+                f"{phase} {duration:.2f}s" for phase, duration in self.timings.items()
+            )
+        )
+        return "\n".join(lines)
+
+
+class _Timer:
+    def __init__(self, report: Report, phase: str) -> None:
+        self.report = report
+        self.phase = phase
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self.report.timings[self.phase] = time.perf_counter() - self.start
+
+
+def remote_repositories() -> dict[str, str]:
+    """Fetch the ids and titles of all repositories on RDF4J
+
+    Raises:
+        Repository.NoRemoteError: When RDF4J can't be reached or the response is invalid
+    """
+    try:
+        response = backend.request(
+            "GET",
+            backend.url(RDF4J_REPOSITORY_PATH.rstrip("/")),
+            headers={"Accept": "application/sparql-results+json"},
+        )
+        if response.status != 200:
+            raise Repository.NoRemoteError("*", response.status)
+        bindings = json.loads(response.data)["results"]["bindings"]
+        return {
+            binding["id"]["value"]: binding.get("title", {}).get("value", "")
+            for binding in bindings
+        }
+    except (OSError, ValueError, KeyError) as e:
+        raise Repository.NoRemoteError("*", detail=str(e)) from e
+
+
+def reconcile(
+    repositories=None,
+    delete_orphans: bool = False,
+    dry_run: bool = False,
+    workers: int | None = None,
+) -> Report:
+    """Compare the repositories with RDF4J and repair the differences
+
+    Args:
+        repositories: Only reconcile these repositories (a queryset), orphans are only handled
+            when all repositories are reconciled
+        delete_orphans (bool): Delete remotes without a repository instead of adopting them
+        dry_run (bool): Only report the differences
+        workers (int | None): Remotes created or deleted at the same time,
+            defaults to REPOSITORY_PROVISIONING_WORKERS
+    """
+    report = Report(dry_run)
+    workers = workers or REPOSITORY_PROVISIONING_WORKERS
+    find_orphans = repositories is None
+    if repositories is None:
+        repositories = Repository.objects.all()
+
+    with _Timer(report, "fetch"):
+        remotes = remote_repositories()
+        local = {repository.slug: repository for repository in repositories}
+        busy = set(
+            RemoteJob.objects.filter(
+                state__in=[RemoteJob.State.PENDING, RemoteJob.State.RUNNING]
+            ).values_list("repository_slug", flat=True)
+        )
+        report.missing_remotes = sorted(set(local) - set(remotes) - busy)
+        if find_orphans:
+            report.orphans = sorted(
+                set(remotes) - set(local) - busy - {SYSTEM_REPOSITORY}
+            )
+        report.missing_permissions = _missing_permissions(repositories)
+
+    if dry_run:
+        return report
+
+    with _Timer(report, "remotes"):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            errors = executor.map(
+                _call,
+                [local[slug].create_remote for slug in report.missing_remotes],
+            )
+            for slug, error in zip(report.missing_remotes, list(errors)):
+                if error:
+                    report.errors[slug] = error
+            if delete_orphans:
+                errors = executor.map(
+                    _call,
+                    [Repository(slug=slug).delete_remote for slug in report.orphans],
+                )
+                for slug, error in zip(report.orphans, list(errors)):
+                    if error:
+                        report.errors[slug] = error
+
+    with _Timer(report, "database"):
+        with transaction.atomic():
+            if not delete_orphans and report.orphans:
+                adopted = [
+                    Repository(slug=slug, description=remotes[slug])
+                    for slug in report.orphans
+                ]
+                Repository.objects.bulk_create(adopted, batch_size=BULK_BATCH_SIZE)
+                Repository.reset_contents(*report.orphans)
+                _create_permissions(
+                    {
+                        slug: list(RepoPermission.permission_functions())
+                        for slug in report.orphans
+                    }
+                )
+            _create_permissions(report.missing_permissions)
+            # Bulk queries send no signals, see signals/handlers.py
+            generations.bump(generations.REPOSITORIES, generations.ACL)
+    return report
+
+
+def _call(func) -> str | None:
+    try:
+        func()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return f"{e.__class__.__name__}: {e}"
+    return None
+
+
+def _missing_permissions(repositories) -> dict[str, list[str]]:
+    """Names of the missing RepoPermissions of the repositories, with one query"""
+    names = list(RepoPermission.permission_functions())
+    saved = set(
+        RepoPermission.objects.filter(repository__in=repositories).values_list(
+            "codename", flat=True
+        )
+    )
+    missing = {}
+    for slug in repositories.values_list("slug", flat=True):
+        if absent := [
+            name
+            for name in names
+            if RepoPermission.build_codename(name, slug) not in saved
+        ]:
+            missing[slug] = absent
+    return missing
+
+
+def _create_permissions(missing: dict[str, list[str]]) -> None:
+    """Create the missing permissions, grouped by the missing names"""
+    groups: dict[tuple[str, ...], list[str]] = {}
+    for slug, names in missing.items():
+        groups.setdefault(tuple(names), []).append(slug)
+    for names, slugs in groups.items():
+        repositories = []
+        for start in range(0, len(slugs), BULK_BATCH_SIZE):
+            repositories.extend(
+                Repository.objects.filter(
+                    slug__in=slugs[start : start + BULK_BATCH_SIZE]
+                )
+            )
+        RepoPermission.create_for(repositories, names)
@@ -0,0 +1,83 @@
+"""Registry of all repositories that is shared between the worker processes.
+
+The registry is built from the database once per change of the repositories, stored in the
+shared cache and kept in memory by every worker process. Looking up a repository by its slug
+is a dictionary lookup and does not need a database query.
+"""
+
+import threading
+from typing import NamedTuple
+
+from django.core.cache import caches
+from django.http import Http404
+
+from authproxy.settings import SHARED_CACHE
+
+from . import generations
+
+CACHE_KEY = "registry:repositories"
+
+
+class RepositoryEntry(NamedTuple):
+    """The parts of a repository that are needed on every proxied request"""
+
+    slug: str
+    public_read: bool
+    public_write: bool
+
+
+_generation: int | None = None
+_entries: dict[str, RepositoryEntry] = {}
+_lock = threading.Lock()
+
+
+def build() -> dict[str, RepositoryEntry]:
+    """Build the registry from the database"""
+    # Imported here since models depends on this module
+    from .models import Repository  # pylint: disable=import-outside-toplevel
+
+    return {
+        slug: RepositoryEntry(slug, public_read, public_write)
+        for slug, public_read, public_write in Repository.objects.values_list(
+            "slug", "public_read", "public_write"
+        )
+    }
+
+
+def entries() -> dict[str, RepositoryEntry]:
+    """Get all entries of the registry, refreshing them if another process changed them"""
+    global _generation, _entries  # pylint: disable=global-statement
+    generation = generations.get(generations.REPOSITORIES)
+    if generation == _generation:
+        return _entries
+
+    with _lock:
+        if generation != _generation:
+            cache = caches[SHARED_CACHE]
+            shared = cache.get(CACHE_KEY)
+            if shared is not None and shared[0] == generation:
+                repositories = shared[1]
+            else:
+                # Nobody built the registry for this generation yet
+                repositories = build()
+                cache.set(CACHE_KEY, (generation, repositories))
+            _entries = repositories
+            _generation = generation
+    return _entries
+
+
+def get(slug: str) -> RepositoryEntry | None:
+    """Look up a repository by its slug"""
+    return entries().get(slug)
+
+
+def get_or_404(slug: str) -> RepositoryEntry:
+    """Look up a repository by its slug
+
+    Raises:
+        Http404: When there's no repository with the given slug.
+    """
+    entry = get(slug)
+    if entry is None:
+        raise Http404(f"No repository {slug!r}")
+    return entry
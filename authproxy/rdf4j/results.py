@@ -0,0 +1,175 @@
+"""Streaming reader for SPARQL query results in the application/sparql-results+json format.
+
+The bindings are parsed one by one while the response is read, so the memory needed to read a
+result does not depend on its size.
+"""
+
+import codecs
+import json
+from typing import Iterator
+
+
+class SparqlResultsReader:
+    """Incremental parser for application/sparql-results+json
+
+    Example:
+        {"head": {"vars": ["s"]}, "results": {"bindings": [{"s": {"type": "uri", "value": "..."}}]}}
+    """
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._decoder_json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+
+        self.vars: list[str] = []
+        self.boolean: bool | None = None
+        # Set once the parser reached the bindings array
+        self._in_bindings = False
+
+        self._read_until_bindings()
+
+    def _fill(self) -> bool:
+        """Read the next chunk into the buffer, dropping everything that was already parsed"""
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if not text:
+                continue
+            self._buffer = self._buffer[self._pos :] + text
+            self._pos = 0
+            return True
+        return False
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of SPARQL results")
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise ValueError(
+                f"Invalid SPARQL results: expected {char!r}, got {found!r}"
+            )
+        self._pos += 1
+
+    def _value(self):
+        """Parse the next complete JSON value"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder_json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The value is not complete yet
+                if not self._fill():
+                    raise
+                continue
+            self._pos = end
+            return value
+
+    def _keys(self) -> Iterator[str]:
+        """Iterate over the keys of the object that starts at the current position.
+
+        The caller has to consume the value of each key before asking for the next one.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            yield key
+            if self._peek() == ",":
+                self._pos += 1
+                continue
+            self._expect("}")
+            return
+
+    def _read_until_bindings(self) -> None:
+        """Parse everything up to the first binding"""
+        for key in self._keys():
+            if key == "head":
+                self.vars = self._value().get("vars", [])
+            elif key == "boolean":
+                self.boolean = self._value()
+            elif key == "results":
+                for results_key in self._keys():
+                    if results_key == "bindings":
+                        self._expect("[")
+                        self._in_bindings = True
+                        return
+                    self._value()
+            else:
+                self._value()
+
+    def bindings(self) -> Iterator[dict]:
+        """Iterate over the bindings"""
+        if not self._in_bindings:
+            return
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._peek() == ",":
+                self._pos += 1
+                continue
+            self._expect("]")
+            return
+
+
+class QueryResult:
+    """Result of a SPARQL query whose rows are read lazily from RDF4J"""
+
+    message = None
+
+    def __init__(self, chunks: Iterator[bytes], limit: int | None = None) -> None:
+        """
+        Args:
+            chunks (Iterator[bytes]): The body of the RDF4J response
+            limit (int | None): Maximum number of rows, None for no limit
+        """
+        self._chunks = chunks
+        try:
+            self._reader = SparqlResultsReader(chunks)
+        except ValueError:
+            self.close()
+            raise
+        self.limit = limit
+        self.vars = self._reader.vars
+        self.boolean = self._reader.boolean
+        # Only known after the rows have been read
+        self.truncated = False
+        self.row_count = 0
+        if self.boolean is not None:
+            self.message = f"Result: {str(self.boolean).lower()}"
+            self.close()
+
+    @property
+    def rows(self) -> Iterator[list[str]]:
+        """The values of every binding in the order of vars.
+
+        Can only be iterated once, the connection to RDF4J is closed afterwards.
+        """
+        try:
+            for binding in self._reader.bindings():
+                if self.limit is not None and self.row_count >= self.limit:
+                    self.truncated = True
+                    break
+                self.row_count += 1
+                yield [binding.get(name, {}).get("value", "") for name in self.vars]
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop reading the result"""
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,497 @@
+"""Admission control for the requests that the data-plane views send to RDF4J.
+
+RDF4J only has a few GB of heap, so the number of requests running on it at the same time is limited
+globally, and optionally per user and per repository. Admins and repository managers are not bound by
+the limit per user. Requests over a limit wait in a bounded queue and are admitted
+in order of priority: admins and repository managers first, then interactive traffic (the query console
+and other pages of users that logged in with a session), then everything else. Within one priority the
+oldest request goes first, but a request never blocks others that are only waiting for a different
+user or repository.
+
+A request that does not fit into the queue of its user is answered with 429, a request that does not fit
+into the global queue or waits longer than SCHEDULER_QUEUE_TIMEOUT is answered with 503. Both carry a
+Retry-After header.
+
+The limits apply to each worker process. A uwsgi worker can't run more requests than it has threads,
+so there the global limit defaults to the number of threads.
+"""
+
+import asyncio
+import functools
+import heapq
+import inspect
+import itertools
+import threading
+import time
+
+from django.contrib.auth import SESSION_KEY
+from django.http import HttpResponse, StreamingHttpResponse
+
+from authproxy.settings import (
+    SCHEDULER_GLOBAL_LIMIT,
+    SCHEDULER_QUEUE_SIZE,
+    SCHEDULER_QUEUE_TIMEOUT,
+    SCHEDULER_REPOSITORY_LIMIT,
+    SCHEDULER_USER_LIMIT,
+    SCHEDULER_USER_QUEUE_SIZE,
+)
+
+from . import backend, throttling
+
+# Priorities, lower values are admitted first
+PRIORITY_PRIVILEGED = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BATCH = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_PRIVILEGED: "privileged",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BATCH: "batch",
+}
+
+
+class Rejected(Exception):
+    """The request was not admitted"""
+
+    def __init__(self, status: int, retry_after: int) -> None:
+        super().__init__(status, retry_after)
+        self.status = status
+        self.retry_after = retry_after
+
+    def response(self) -> HttpResponse:
+        """The response that tells the client to try again later"""
+        detail = (
+            "Too many concurrent requests"
+            if self.status == 429
+            else "The triplestore is busy"
+        )
+        return HttpResponse(
+            detail, status=self.status, headers={"Retry-After": str(self.retry_after)}
+        )
+
+
+class Waiter:
+    """A request waiting for admission"""
+
+    def __init__(self, user: str, repository: str, priority: int) -> None:
+        self.user = user
+        self.repository = repository
+        self.priority = priority
+        self.granted = False
+        # Set when the waiter gave up, it is then skipped and dropped from the queue
+        self.cancelled = False
+        self.enqueued = time.monotonic()
+        # Either a thread waits on the event or a coroutine on the future
+        self.event: threading.Event | None = None
+        self.future: asyncio.Future | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def notify(self) -> None:
+        """Wake up the waiting thread or coroutine"""
+        if self.event is not None:
+            self.event.set()
+        elif self.future is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Grant:
+    """Permission to run one request on RDF4J, release it once the response is complete"""
+
+    def __init__(self, scheduler: "Scheduler", user: str, repository: str) -> None:
+        self._scheduler = scheduler
+        self.user = user
+        self.repository = repository
+        self._released = False
+
+    def release(self) -> None:
+        """Hand the slot to the next waiting request, can be called more than once"""
+        if not self._released:
+            self._released = True
+            self._scheduler.release(self)
+
+
+class Scheduler:
+    """Concurrency limits with prioritized, bounded wait queues"""
+
+    def __init__(
+        self,
+        global_limit: int,
+        user_limit: int,
+        repository_limit: int,
+        queue_size: int,
+        user_queue_size: int,
+        queue_timeout: float,
+    ) -> None:
+        self.global_limit = global_limit
+        self.user_limit = user_limit
+        self.repository_limit = repository_limit
+        self.queue_size = queue_size
+        self.user_queue_size = user_queue_size
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        # Heap of (priority, sequence number, waiter)
+        self._queue: list[tuple[int, int, Waiter]] = []
+        self._waiting = 0
+        self._waiting_users: dict[str, int] = {}
+        self._active = 0
+        self._active_users: dict[str, int] = {}
+        self._active_repositories: dict[str, int] = {}
+
+        # Metrics
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {429: 0, 503: 0}
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _fits(self, user: str, repository: str, priority: int) -> bool:
+        # Limits of 0 are off, privileged users are not limited per user
+        return (
+            self._active < self.global_limit
+            and (
+                not self.user_limit
+                or priority == PRIORITY_PRIVILEGED
+                or self._active_users.get(user, 0) < self.user_limit
+            )
+            and (
+                not self.repository_limit
+                or self._active_repositories.get(repository, 0) < self.repository_limit
+            )
+        )
+
+    def _occupy(self, user: str, repository: str) -> None:
+        self._active += 1
+        _increment(self._active_users, user)
+        _increment(self._active_repositories, repository)
+        self.admitted += 1
+
+    def _can_skip_queue(self, user: str, repository: str, priority: int) -> bool:
+        """A new request may only overtake waiting requests that could not run anyway"""
+        if not self._fits(user, repository, priority):
+            return False
+        return not any(
+            not waiter.cancelled
+            and waiter_priority <= priority
+            and self._fits(waiter.user, waiter.repository, waiter_priority)
+            for waiter_priority, _, waiter in self._queue
+        )
+
+    def _enqueue(self, user: str, repository: str, priority: int) -> Waiter:
+        """Put the request into the queue
+
+        Raises:
+            Rejected: When the queue is full
+        """
+        if self._waiting >= self.queue_size:
+            self.rejected[503] += 1
+            raise Rejected(503, self._retry_after())
+        if self._waiting_users.get(user, 0) >= self.user_queue_size:
+            self.rejected[429] += 1
+            raise Rejected(429, self._retry_after())
+        waiter = Waiter(user, repository, priority)
+        heapq.heappush(self._queue, (priority, next(self._counter), waiter))
+        self._waiting += 1
+        _increment(self._waiting_users, user)
+        self.queued += 1
+        return waiter
+
+    def _leave_queue(self, waiter: Waiter) -> None:
+        self._waiting -= 1
+        _decrement(self._waiting_users, waiter.user)
+
+    def _wake(self) -> None:
+        """Admit waiting requests in priority order while slots are free"""
+        blocked = []
+        while self._queue and self._active < self.global_limit:
+            item = heapq.heappop(self._queue)
+            waiter = item[2]
+            if waiter.cancelled:
+                continue
+            if not self._fits(waiter.user, waiter.repository, waiter.priority):
+                # Only waiting for its user or repository, let others go first
+                blocked.append(item)
+                continue
+            self._leave_queue(waiter)
+            self._occupy(waiter.user, waiter.repository)
+            waiter.granted = True
+            waiter.notify()
+        for item in blocked:
+            heapq.heappush(self._queue, item)
+
+    def _finish_wait(self, waiter: Waiter) -> Grant:
+        """Called with the lock held once the waiter was woken up or timed out
+
+        Raises:
+            Rejected: When the waiter timed out
+        """
+        waited = time.monotonic() - waiter.enqueued
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+        if waiter.granted:
+            return Grant(self, waiter.user, waiter.repository)
+        self._cancel(waiter)
+        self.rejected[503] += 1
+        raise Rejected(503, self._retry_after())
+
+    def _cancel(self, waiter: Waiter) -> None:
+        waiter.cancelled = True
+        self._leave_queue(waiter)
+
+    def _retry_after(self) -> int:
+        return max(1, int(self.queue_timeout / 2))
+
+    def acquire(self, user: str, repository: str, priority: int) -> Grant:
+        """Wait for a slot
+
+        Raises:
+            Rejected: When the queue is full or the request waited too long
+        """
+        with self._lock:
+            if self._can_skip_queue(user, repository, priority):
+                self._occupy(user, repository)
+                return Grant(self, user, repository)
+            waiter = self._enqueue(user, repository, priority)
+            waiter.event = threading.Event()
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            return self._finish_wait(waiter)
+
+    async def aacquire(self, user: str, repository: str, priority: int) -> Grant:
+        """Async version of acquire(), waits without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._can_skip_queue(user, repository, priority):
+                self._occupy(user, repository)
+                return Grant(self, user, repository)
+            waiter = self._enqueue(user, repository, priority)
+            waiter.loop = loop
+            waiter.future = loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The client went away, give the slot back if it was granted already
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._cancel(waiter)
+            if granted:
+                Grant(self, waiter.user, waiter.repository).release()
+            raise
+        with self._lock:
+            return self._finish_wait(waiter)
+
+    def release(self, grant: Grant) -> None:
+        """Give a slot back, see Grant.release()"""
+        with self._lock:
+            self._active -= 1
+            _decrement(self._active_users, grant.user)
+            _decrement(self._active_repositories, grant.repository)
+            self._wake()
+
+    def stats(self) -> dict:
+        """Snapshot of the metrics"""
+        with self._lock:
+            waiting = [waiter for _, _, waiter in self._queue if not waiter.cancelled]
+            now = time.monotonic()
+            return {
+                "active": self._active,
+                "queue_depth": len(waiting),
+                "queue_depth_by_priority": {
+                    name: sum(1 for waiter in waiting if waiter.priority == priority)
+                    for priority, name in PRIORITY_NAMES.items()
+                },
+                "oldest_wait": max(
+                    (now - waiter.enqueued for waiter in waiting), default=0.0
+                ),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": dict(self.rejected),
+                "average_wait": self.wait_time / self.queued if self.queued else 0.0,
+                "max_wait": self.max_wait_time,
+                "limits": {
+                    "global": self.global_limit,
+                    "user": self.user_limit,
+                    "repository": self.repository_limit,
+                    "queue": self.queue_size,
+                    "user_queue": self.user_queue_size,
+                },
+            }
+
+
+def _increment(counts: dict[str, int], key: str) -> None:
+    counts[key] = counts.get(key, 0) + 1
+
+
+def _decrement(counts: dict[str, int], key: str) -> None:
+    counts[key] -= 1
+    if not counts[key]:
+        del counts[key]
+
+
+def default_global_limit(threads: int | None) -> int:
+    """The global limit when SCHEDULER_GLOBAL_LIMIT is 0
+
+    Args:
+        threads (int | None): Threads of the worker process, None for async workers
+    """
+    return threads or 16
+
+
+def create_scheduler(threads: int | None) -> Scheduler:
+    """Create a scheduler from the settings"""
+    return Scheduler(
+        global_limit=SCHEDULER_GLOBAL_LIMIT or default_global_limit(threads),
+        user_limit=SCHEDULER_USER_LIMIT,
+        repository_limit=SCHEDULER_REPOSITORY_LIMIT,
+        queue_size=SCHEDULER_QUEUE_SIZE,
+        user_queue_size=SCHEDULER_USER_QUEUE_SIZE,
+        queue_timeout=SCHEDULER_QUEUE_TIMEOUT,
+    )
+
+
+SCHEDULER = create_scheduler(backend.worker_threads())
+
+
+def has_session(request, user) -> bool:
+    """Check if the user logged in with a session of the browser, e.g. for the query console"""
+    session = getattr(request, "session", None)
+    return session is not None and session.get(SESSION_KEY) == str(user.pk)
+
+
+def classify(request) -> tuple[str, int]:
+    """Get the key of the user and the priority of a request"""
+    # Imported here since models imports the views indirectly
+    from .models import User  # pylint: disable=import-outside-toplevel
+
+    user = request.user
+    if user.is_anonymous:
+        # Behind nginx REMOTE_ADDR is the same for everybody
+        key = f"anonymous:{throttling.client_ident(request)}"
+    else:
+        key = f"user:{user.pk}"
+    if user.is_authenticated and (
+        user.is_superuser or user.role in (User.Role.ADMIN, User.Role.REPO_MANAGER)
+    ):
+        return key, PRIORITY_PRIVILEGED
+    # Leaving out the Authorization header does not make a script interactive
+    if user.is_authenticated and has_session(request, user):
+        return key, PRIORITY_INTERACTIVE
+    return key, PRIORITY_BATCH
+
+
+class _ReleasingIterator:
+    """Release the grant once the body was sent or the response is closed"""
+
+    def __init__(self, chunks, grant: Grant) -> None:
+        self._chunks = chunks
+        self._grant = grant
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self._grant.release()
+            raise
+
+    def close(self) -> None:
+        self._grant.release()
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class _AsyncReleasingIterator:
+    """Async version of _ReleasingIterator"""
+
+    def __init__(self, chunks, grant: Grant) -> None:
+        self._chunks = chunks
+        self._grant = grant
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await anext(self._chunks)
+        except BaseException:
+            self._grant.release()
+            raise
+
+    def close(self) -> None:
+        # Called by Django when the response is closed, the body might not have been sent completely
+        self._grant.release()
+
+
+def _hold(response, grant: Grant):
+    """Keep the slot until a streamed response is complete"""
+    if not isinstance(response, StreamingHttpResponse):
+        grant.release()
+    elif response.is_async:
+        response.streaming_content = _AsyncReleasingIterator(
+            response.streaming_content, grant
+        )
+    else:
+        response.streaming_content = _ReleasingIterator(
+            response.streaming_content, grant
+        )
+    return response
+
+
+def admit(func):
+    """Decorate a sync or async view that sends requests to RDF4J with admission control.
+
+    Use it below the RepoPermission decorators, so only permitted requests take a slot.
+    """
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            request = args[-1]
+            user, priority = classify(request)
+            try:
+                grant = await SCHEDULER.aacquire(
+                    user, kwargs["repository_id"], priority
+                )
+            except Rejected as e:
+                return e.response()
+            try:
+                return _hold(await func(*args, **kwargs), grant)
+            except BaseException:
+                grant.release()
+                raise
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # The request is always the last arg, like in RepoPermission.wrap_view
+        request = args[-1]
+        user, priority = classify(request)
+        try:
+            grant = SCHEDULER.acquire(user, kwargs["repository_id"], priority)
+        except Rejected as e:
+            return e.response()
+        try:
+            return _hold(func(*args, **kwargs), grant)
+        except BaseException:
+            grant.release()
+            raise
+
+    return wrapper
+
+
+def stats() -> dict:
+    """Statistics of the scheduler of this worker process"""
+    return SCHEDULER.stats()
@@ -1,34 +1,83 @@
 """Signal handlers"""
 
-from django.db.models.signals import post_save, pre_delete
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
 
-from ..models import Repository
+from .. import generations, jobs
+from ..models import RemoteJob, Repository, RepoPermission, User
 
 
 @receiver(post_save, sender=Repository)
 def post_repo_save(instance: Repository, created=False, **kwargs) -> None:
     """Routine after repo creation.
 
-    Creates the repo on the RDF4J remote
+    Queues the creation of the repo on the RDF4J remote, see jobs.py
     Creates repo specific permissions.
     """
+    generations.bump(generations.REPOSITORIES)
 
     if instance and created:
-        try:
-            instance.create_remote()
-        except Exception:
-            # In case something goes wrong delete it again to avoid inconsistency
-            instance.delete()
-
-        # Create the necessary permissions after the remote is successfully created
+        Repository.reset_contents(instance.slug)
+        jobs.enqueue(RemoteJob.Action.CREATE, instance.slug)
         instance.update_permissions()
 
 
 @receiver(pre_delete, sender=Repository)
 def delete_rdf4j_repo(instance: Repository, **kwargs) -> None:
-    """Delete the repo on the RDF4J server before deleting it in the database"""
-    try:
-        instance.delete_remote()
-    except Exception:
-        pass
+    """Queue the deletion of the repo on the RDF4J server, see jobs.py"""
+    generations.bump(generations.REPOSITORIES)
+    Repository.reset_contents(instance.slug)
+    jobs.enqueue(RemoteJob.Action.DELETE, instance.slug)
+
+
+# -----------------------
+# -- ACL invalidation --
+# -----------------------
+
+
+@receiver(post_save, sender=Repository)
+@receiver(post_delete, sender=Repository)
+@receiver(post_delete, sender=Permission)
+@receiver(post_delete, sender=RepoPermission)
+def invalidate_acls(**kwargs) -> None:
+    """Repositories and their permissions changed, this affects every user"""
+    generations.bump(generations.ACL)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(instance: User, **kwargs) -> None:
+    """The user (e.g. their role) changed"""
+    generations.bump(generations.user_key(instance.pk))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance: Token, **kwargs) -> None:
+    """A token of the user was deleted"""
+    generations.bump(generations.user_key(instance.user_id))
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_relations(
+    instance, action: str, reverse: bool, pk_set, **kwargs
+) -> None:
+    """The permissions or groups of one or more users changed"""
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        generations.bump(generations.user_key(instance.pk))
+    elif pk_set:
+        generations.bump(*(generations.user_key(pk) for pk in pk_set))
+    else:
+        # The relation was cleared from the permission/group side, we don't know the users
+        generations.bump(generations.ACL)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(action: str, **kwargs) -> None:
+    """The permissions of a group changed, this affects all of its members"""
+    if action.startswith("post_"):
+        generations.bump(generations.ACL)
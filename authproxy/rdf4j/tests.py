@@ -1,3 +1,628 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock
 
-# Create your tests here.
+import urllib3
+import zstandard
+from django.contrib.auth.models import AnonymousUser, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authproxy.settings import SHARED_CACHE
+
+from . import (
+    authentication,
+    backend,
+    bulk_load,
+    compression,
+    cursors,
+    generations,
+    jobs,
+    query_cache,
+    scheduler,
+    throttling,
+)
+from .models import RemoteJob, Repository, RepoPermission, User
+
+# The shared cache of the tests lives in the test process, clearing it never touches
+# the shared cache of an authproxy that runs on the same host
+TEST_CACHES = {
+    **settings.CACHES,
+    SHARED_CACHE: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tests-shared",
+    },
+}
+
+
+def use_private_generations(test: TestCase) -> None:
+    """Keep the generations of a test in a new temporary file"""
+    store_dir = tempfile.TemporaryDirectory()
+    test.addCleanup(store_dir.cleanup)
+    patcher = mock.patch.object(
+        generations,
+        "STORE",
+        generations.GenerationStore(os.path.join(store_dir.name, "generations"), 1024),
+    )
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UserListingTest(TestCase):
+    """Tests for the /rest/security/users listing"""
+
+    def setUp(self):
+        # Remembered credentials live in the shared cache
+        caches[SHARED_CACHE].clear()
+        use_private_generations(self)
+        self.admin = User.objects.create_superuser(
+            "admin", password="admin", role=User.Role.ADMIN
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        repository_type = ContentType.objects.get_for_model(Repository)
+        # The permissions are created without repositories, so RDF4J is not needed
+        self.permissions = [
+            Permission.objects.create(
+                codename=RepoPermission.build_codename(name, f"repo{i}"),
+                name=RepoPermission.build_name(name, f"repo{i}"),
+                content_type=repository_type,
+            )
+            for i in range(3)
+            for name in ("read", "write")
+        ]
+        self.other_permission = Permission.objects.get(codename="view_user")
+
+    def create_users(self, start: int, count: int) -> None:
+        for i in range(start, start + count):
+            user = User.objects.create_user(f"user{i}", password="user")
+            user.user_permissions.add(
+                self.permissions[i % len(self.permissions)], self.other_permission
+            )
+
+    def get_listing(self, query: str = "") -> tuple[dict, int]:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/rest/security/users{query}")
+            content = b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(content), len(queries)
+
+    def test_query_count_is_constant(self):
+        self.create_users(0, 2)
+        listing, small_count = self.get_listing()
+        self.assertEqual(len(listing), 3)
+
+        self.create_users(2, 40)
+        listing, large_count = self.get_listing()
+        self.assertEqual(len(listing), 43)
+        self.assertEqual(small_count, large_count)
+
+        _, small_count = self.get_listing("?offset=1&limit=2")
+        _, large_count = self.get_listing("?offset=1&limit=20")
+        self.assertEqual(small_count, large_count)
+
+    def test_granted_authorities(self):
+        self.create_users(0, 8)
+        listing, _ = self.get_listing()
+        users = {user["username"]: user for user in listing.values()}
+        self.assertEqual(list(listing), [str(i) for i in range(9)])
+        self.assertEqual(users["admin"]["grantedAuthorities"], [User.Role.ADMIN])
+        for i in range(8):
+            user = User.objects.get(username=f"user{i}")
+            self.assertEqual(users[user.username], user.normalize())
+            self.assertEqual(
+                users[user.username]["grantedAuthorities"],
+                [User.Role.USER, self.permissions[i % len(self.permissions)].codename],
+            )
+
+    def test_pagination_and_filters(self):
+        self.create_users(0, 8)
+        listing, _ = self.get_listing("?offset=2&limit=3")
+        self.assertEqual(list(listing), ["2", "3", "4"])
+        self.assertEqual(
+            [user["username"] for user in listing.values()], ["user1", "user2", "user3"]
+        )
+
+        listing, _ = self.get_listing("?offset=20")
+        self.assertEqual(listing, {})
+
+        listing, _ = self.get_listing(f"?username=user&role={User.Role.USER}&limit=2")
+        self.assertEqual(
+            [user["username"] for user in listing.values()], ["user0", "user1"]
+        )
+
+        response = self.client.get("/rest/security/users?limit=ten")
+        self.assertEqual(response.status_code, 400)
+
+
+def rdf4j_response(status: int = 200, body: bytes = b"", headers=None):
+    """A streamed response like the ones of backend.request()"""
+    return urllib3.HTTPResponse(
+        body=io.BytesIO(body),
+        status=status,
+        headers=headers or {},
+        preload_content=False,
+    )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ProxyTestCase(TestCase):
+    """Base class for tests of the RDF4J routes, RDF4J itself is mocked"""
+
+    def setUp(self):
+        caches[SHARED_CACHE].clear()
+        use_private_generations(self)
+        # The rate limit buckets of the tests live in a temporary file
+        store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(store_dir.cleanup)
+        patcher = mock.patch.object(
+            throttling,
+            "STORE",
+            throttling.BucketStore(os.path.join(store_dir.name, "throttle"), 1024),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.admin = User.objects.create_superuser(
+            "admin", password="admin", role=User.Role.ADMIN
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.repository = Repository.objects.create(slug="test")
+
+
+class CompressedUploadTest(ProxyTestCase):
+    """Tests for gzip and zstd compressed statement uploads"""
+
+    def upload(self, body: bytes, encoding: str) -> tuple[int, list[int]]:
+        """Upload a body, returns the status and the sizes of the pieces sent to RDF4J"""
+        pieces = []
+
+        def request(method, url, body=None, headers=None, stream=False):
+            for piece in body:
+                pieces.append(len(piece))
+            return rdf4j_response(204)
+
+        with mock.patch.object(backend, "request", side_effect=request):
+            response = self.client.post(
+                "/repositories/test/statements",
+                data=body,
+                content_type="application/n-triples",
+                HTTP_CONTENT_ENCODING=encoding,
+            )
+        return response.status_code, pieces
+
+    def test_pieces_are_bounded(self):
+        size = 256 * 1024 * 1024
+        bodies = {
+            "zstd": zstandard.ZstdCompressor().compress(b"\0" * size),
+            "gzip": gzip.compress(b"\0" * size),
+        }
+        for encoding, body in bodies.items():
+            with self.subTest(encoding=encoding):
+                # The body is highly compressible
+                self.assertLess(len(body), size // 500)
+                status, pieces = self.upload(body, encoding)
+                self.assertEqual(status, 204)
+                self.assertEqual(sum(pieces), size)
+                self.assertLessEqual(max(pieces), backend.CHUNK_SIZE)
+
+    def test_decompressed_size_limit(self):
+        body = zstandard.ZstdCompressor().compress(b"\0" * 1024 * 1024)
+        with mock.patch.object(compression, "COMPRESSED_UPLOAD_MAX_SIZE", 1000):
+            status, pieces = self.upload(body, "zstd")
+        self.assertEqual(status, 413)
+        self.assertLessEqual(sum(pieces), 1000)
+
+    def test_truncated_body(self):
+        body = zstandard.ZstdCompressor().compress(b"<a> <b> <c> .\n" * 10000)
+        status, _ = self.upload(body[:-10], "zstd")
+        self.assertEqual(status, 400)
+
+    def test_concatenated_frames(self):
+        frame = zstandard.ZstdCompressor().compress(b"<a> <b> <c> .\n" * 10000)
+        status, pieces = self.upload(frame * 3, "zstd")
+        self.assertEqual(status, 204)
+        self.assertEqual(sum(pieces), 3 * 140000)
+        status, _ = self.upload(frame * 2 + frame[:-10], "zstd")
+        self.assertEqual(status, 400)
+
+
+class RecreatedRepositoryTest(ProxyTestCase):
+    """A repository created with the slug of a deleted one starts with nothing cached"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            query_cache, "CACHE", query_cache.QueryCache(1024 * 1024)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recreate(self) -> None:
+        # The generations are bumped once the transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.repository.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.repository = Repository.objects.create(slug="test")
+
+    def query(self, **headers) -> tuple[int, int, str]:
+        """Run a query, returns the status, the number of requests to RDF4J and the ETag"""
+        with mock.patch.object(
+            backend,
+            "request",
+            side_effect=lambda *args, **kwargs: rdf4j_response(
+                200,
+                b'{"boolean": true}',
+                {"Content-Type": "application/sparql-results+json"},
+            ),
+        ) as request:
+            response = self.client.get(
+                "/repositories/test",
+                {"query": "ASK { ?s ?p ?o }"},
+                HTTP_ACCEPT="application/sparql-results+json",
+                **headers,
+            )
+            if response.status_code == 200:
+                b"".join(response.streaming_content)
+        return response.status_code, request.call_count, response.headers.get("ETag")
+
+    def test_query_cache_miss(self):
+        self.assertEqual(self.query()[1], 1)
+        self.assertEqual(self.query()[1], 0)
+        self.recreate()
+        self.assertEqual(self.query()[1], 1)
+
+    def test_etag_changes(self):
+        _, _, tag = self.query()
+        self.assertEqual(self.query(HTTP_IF_NONE_MATCH=tag)[0], 304)
+        self.recreate()
+        status, requests, new_tag = self.query(HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(status, 200)
+        self.assertEqual(requests, 1)
+        self.assertNotEqual(new_tag, tag)
+
+
+class SchedulerTest(TestCase):
+    """Tests for the limits and priorities of the admission control"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("user", password="user")
+
+    def request(self, user, session: bool = False, **headers):
+        request = RequestFactory().get("/repositories/test", **headers)
+        request.user = user
+        request.session = {SESSION_KEY: str(user.pk)} if session else {}
+        return request
+
+    def make_scheduler(self, **limits) -> scheduler.Scheduler:
+        return scheduler.Scheduler(
+            **{
+                "global_limit": 2,
+                "user_limit": 0,
+                "repository_limit": 0,
+                "queue_size": 100,
+                "user_queue_size": 10,
+                "queue_timeout": 0.01,
+                **limits,
+            }
+        )
+
+    def test_defaults(self):
+        # A uwsgi worker with 2 threads can run two requests of the same user
+        instance = scheduler.create_scheduler(2)
+        self.assertEqual(instance.global_limit, 2)
+        first = instance.acquire("user:1", "test", scheduler.PRIORITY_BATCH)
+        second = instance.acquire("user:1", "test", scheduler.PRIORITY_BATCH)
+        first.release()
+        second.release()
+        self.assertEqual(scheduler.create_scheduler(None).global_limit, 16)
+
+    def test_user_limit(self):
+        instance = self.make_scheduler(user_limit=1)
+        grant = instance.acquire("user:1", "test", scheduler.PRIORITY_BATCH)
+        with self.assertRaises(scheduler.Rejected):
+            instance.acquire("user:1", "other", scheduler.PRIORITY_BATCH)
+        instance.acquire("user:2", "other", scheduler.PRIORITY_BATCH).release()
+        grant.release()
+
+    def test_privileged_users_bypass_user_limit(self):
+        instance = self.make_scheduler(user_limit=1)
+        first = instance.acquire("user:1", "test", scheduler.PRIORITY_PRIVILEGED)
+        second = instance.acquire("user:1", "test", scheduler.PRIORITY_PRIVILEGED)
+        # The global limit still applies
+        with self.assertRaises(scheduler.Rejected):
+            instance.acquire("user:1", "test", scheduler.PRIORITY_PRIVILEGED)
+        first.release()
+        second.release()
+
+    def test_anonymous_clients_behind_proxy(self):
+        keys = {
+            scheduler.classify(
+                self.request(AnonymousUser(), HTTP_X_FORWARDED_FOR=address)
+            )[0]
+            for address in ("203.0.113.1", "203.0.113.2")
+        }
+        self.assertEqual(len(keys), 2)
+
+    def test_classify(self):
+        anonymous = AnonymousUser()
+        cases = [
+            (self.request(anonymous), scheduler.PRIORITY_BATCH),
+            (self.request(self.user), scheduler.PRIORITY_BATCH),
+            (
+                self.request(self.user, HTTP_AUTHORIZATION="Token x"),
+                scheduler.PRIORITY_BATCH,
+            ),
+            (self.request(self.user, session=True), scheduler.PRIORITY_INTERACTIVE),
+        ]
+        for request, priority in cases:
+            with self.subTest(user=request.user, session=request.session):
+                self.assertEqual(scheduler.classify(request)[1], priority)
+        admin = User.objects.create_user("admin", role=User.Role.ADMIN)
+        self.assertEqual(
+            scheduler.classify(self.request(admin))[1], scheduler.PRIORITY_PRIVILEGED
+        )
+
+
+class CursorQuotaTest(TestCase):
+    """The cursors of a user never take more than SPARQL_CURSOR_MAX_BYTES on disk"""
+
+    def setUp(self):
+        cursor_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cursor_dir.cleanup)
+        for name, value in (
+            ("SPARQL_CURSOR_DIR", cursor_dir.name),
+            ("SPARQL_CURSOR_MAX_BYTES", 1000),
+        ):
+            patcher = mock.patch.object(cursors, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create(self, rows: int) -> cursors.Cursor:
+        """Create a cursor over rows of 11 bytes each"""
+        result = mock.Mock(vars=["s"], rows=iter([["abcdef"]] * rows))
+        cursor = cursors.create(1, "test", "SELECT * {}", result)
+        self.assertLessEqual(self.used(), cursors.SPARQL_CURSOR_MAX_BYTES)
+        return cursor
+
+    def used(self) -> int:
+        """Bytes of all rows files of the user, complete or not"""
+        user_dir = os.path.join(cursors.SPARQL_CURSOR_DIR, "1")
+        return sum(
+            entry.stat().st_size
+            for entry in os.scandir(user_dir)
+            if entry.name.endswith(cursors.ROWS_SUFFIX)
+        )
+
+    def test_writing_stops_at_quota(self):
+        result = mock.Mock(vars=["s"])
+        result.rows = iter([["abcdef"]] * 1000)
+        cursor = cursors.create(1, "test", "SELECT * {}", result)
+        self.assertTrue(cursor.truncated)
+        self.assertEqual(cursor.row_count, 1000 // 11)
+        # Reading stopped at the quota, the rest of the result was never read
+        self.assertEqual(len(list(result.rows)), 1000 - 1000 // 11 - 1)
+
+    def test_older_cursors_make_room(self):
+        first = self.create(60)
+        second = self.create(30)
+        third = self.create(60)
+        self.assertFalse(third.truncated)
+        with self.assertRaises(cursors.CursorNotFound):
+            cursors.get(first.id, 1, "test")
+        self.assertEqual(cursors.get(second.id, 1, "test").row_count, 30)
+
+    def test_concurrent_queries_share_the_quota(self):
+        threads = []
+
+        def rows(count: int, start_other: bool):
+            for i in range(count):
+                if start_other and i == 30:
+                    # A second query of the user starts while the first is written
+                    thread = threading.Thread(target=self.create, args=(60,))
+                    thread.start()
+                    threads.append(thread)
+                    time.sleep(0.1)
+                yield ["abcdef"]
+
+        result = mock.Mock(vars=["s"], rows=rows(60, True))
+        cursors.create(1, "test", "SELECT * {}", result)
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(self.used(), cursors.SPARQL_CURSOR_MAX_BYTES)
+
+
+class GenerationStoreTest(TestCase):
+    """Tests for the generations shared between the worker processes"""
+
+    def setUp(self):
+        use_private_generations(self)
+
+    def test_bump(self):
+        before = generations.get_many("a", "b")
+        self.assertEqual(generations.get_many("a", "b"), before)
+        with self.captureOnCommitCallbacks(execute=True):
+            generations.bump("a")
+        after = generations.get_many("a", "b")
+        self.assertNotEqual(after[0], before[0])
+        # Different slots of the 1024
+        self.assertEqual(after[1], before[1])
+
+    def test_new_store_starts_random(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            path = os.path.join(store_dir, "generations")
+            first = generations.GenerationStore(path, 1024).get_many(["a"])
+            os.remove(path)
+            second = generations.GenerationStore(path, 1024).get_many(["a"])
+        self.assertNotEqual(first, second)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    """Tests for the in-process token cache"""
+
+    def setUp(self):
+        use_private_generations(self)
+        self.user = User.objects.create_user("user", password="user")
+        self.token = Token.objects.create(user=self.user)
+        authentication.CachedTokenAuthentication._tokens.clear()
+        self.addCleanup(authentication.CachedTokenAuthentication._tokens.clear)
+
+    def test_change_during_load(self):
+        load = TokenAuthentication.authenticate_credentials
+
+        def load_then_change(auth, key):
+            loaded = load(auth, key)
+            # The user is changed by another request while the token is loaded
+            with self.captureOnCommitCallbacks(execute=True):
+                generations.bump(generations.user_key(self.user.pk))
+            return loaded
+
+        with mock.patch.object(
+            TokenAuthentication,
+            "authenticate_credentials",
+            autospec=True,
+            side_effect=load_then_change,
+        ) as loads:
+            auth = authentication.CachedTokenAuthentication()
+            auth.authenticate_credentials(self.token.key)
+            auth.authenticate_credentials(self.token.key)
+        # The entry of the first load was already outdated
+        self.assertEqual(loads.call_count, 2)
+
+
+class AnonymousThrottleTest(ProxyTestCase):
+    """Anonymous clients behind the proxy get a bucket each"""
+
+    def request(self, address: str):
+        request = RequestFactory().get(
+            "/repositories", REMOTE_ADDR="172.18.0.2", HTTP_X_FORWARDED_FOR=address
+        )
+        request.user = AnonymousUser()
+        return request
+
+    def test_separate_buckets(self):
+        first = self.request("203.0.113.1")
+        second = self.request("203.0.113.2")
+        self.assertNotEqual(
+            throttling.user_buckets(first), throttling.user_buckets(second)
+        )
+        with mock.patch.dict(
+            throttling.THROTTLE_RATES, {throttling.ANONYMOUS: "1/min"}
+        ):
+            self.assertTrue(throttling.UserThrottle().allow_request(first, None))
+            self.assertFalse(throttling.UserThrottle().allow_request(first, None))
+            self.assertTrue(throttling.UserThrottle().allow_request(second, None))
+
+
+class RemoteJobTest(ProxyTestCase):
+    """Tests for the jobs that create and delete the repositories on RDF4J"""
+
+    def test_jobs_route_permission(self):
+        user = User.objects.create_user("user", password="user")
+        client = APIClient()
+        self.assertEqual(client.get("/rest/repositories/test/jobs").status_code, 401)
+        client.force_authenticate(user)
+        self.assertEqual(client.get("/rest/repositories/test/jobs").status_code, 403)
+        self.assertEqual(
+            self.client.get("/rest/repositories/test/jobs").status_code, 200
+        )
+
+    def run_job(self, action, status: int) -> RemoteJob:
+        job = jobs.enqueue(action, "test")
+        with mock.patch.object(
+            backend,
+            "request",
+            side_effect=lambda *args, **kwargs: rdf4j_response(status),
+        ):
+            jobs.run(job)
+        job.refresh_from_db()
+        return job
+
+    def test_remote_exists_already(self):
+        job = self.run_job(RemoteJob.Action.CREATE, 409)
+        self.assertEqual(job.state, RemoteJob.State.DONE)
+
+    def test_remote_is_gone_already(self):
+        job = self.run_job(RemoteJob.Action.DELETE, 404)
+        self.assertEqual(job.state, RemoteJob.State.DONE)
+
+
+class BulkLoadTest(ProxyTestCase):
+    """Tests for the bulk loads uploaded to the API"""
+
+    def setUp(self):
+        super().setUp()
+        load_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(load_dir.cleanup)
+        patcher = mock.patch.object(bulk_load, "BULK_LOAD_DIR", load_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_loads_run_outside_of_the_worker(self):
+        body = b"".join(b"<a> <b> <%d> .\n" % i for i in range(10))
+        pools = []
+
+        def request(method, url, body=None, headers=None, timeout=None, pool=None):
+            pools.append(pool)
+            return rdf4j_response(204)
+
+        with mock.patch.object(
+            backend, "request", side_effect=request
+        ), mock.patch.object(
+            backend, "create_pool", wraps=backend.create_pool
+        ) as create_pool, mock.patch.object(
+            bulk_load, "BULK_LOAD_BATCH_SIZE", 3
+        ):
+            response = self.client.post(
+                "/rest/repositories/test/bulk-load",
+                data=body,
+                content_type="application/n-triples",
+            )
+            self.assertEqual(response.status_code, 202)
+            # The upload is only queued
+            self.assertEqual(pools, [])
+            status = self.client.get(response["Location"]).json()
+            self.assertEqual(status["state"], "pending")
+            self.assertEqual(bulk_load.run_pending(), 1)
+        status = self.client.get(response["Location"]).json()
+        self.assertEqual(status["state"], "done")
+        self.assertEqual(status["statements"], 10)
+        self.assertEqual(status["batches"], 4)
+        # The batches don't use the connections of the request threads
+        create_pool.assert_called_once_with(bulk_load.BULK_LOAD_WORKERS)
+        self.assertEqual(len(pools), 4)
+        self.assertIsNotNone(pools[0])
+        self.assertEqual(set(pools), {pools[0]})
+        self.assertEqual(bulk_load.run_pending(), 0)
+
+
+class CompressedResponseTest(TestCase):
+    """Compressed responses are streamed chunk by chunk"""
+
+    def test_every_chunk_is_flushed(self):
+        chunks = [b"<a> <b> <c> .\n" * 100, b"<d> <e> <f> .\n" * 100]
+        decompressors = {
+            "gzip": zlib.decompressobj(31),
+            "zstd": zstandard.ZstdDecompressor().decompressobj(),
+        }
+        for encoding, decompressor in decompressors.items():
+            with self.subTest(encoding=encoding):
+                compressed = compression.compress_chunks(iter(chunks), encoding)
+                # Each chunk can be decompressed as soon as it was sent
+                for chunk in chunks:
+                    self.assertEqual(decompressor.decompress(next(compressed)), chunk)
@@ -0,0 +1,343 @@
+"""Token bucket rate limiting shared between all worker processes.
+
+Every bucket has a capacity and refills continuously, e.g. "1200/min" holds up to 1200 tokens and gains
+20 tokens per second. There are request buckets (one token per request) and byte buckets (one token per
+byte sent to or received from RDF4J) for every user, every API token and every repository.
+
+The buckets live in a memory mapped file (THROTTLE_STORE, in /dev/shm when available) that is divided
+into fixed-size slots. A bucket is found by hashing its key, a slot is locked with a byte range lock
+while it is updated. Checking a bucket therefore only costs a few system calls. When two buckets
+share a slot, the newer one replaces the older one, which then starts over with a full bucket.
+"""
+
+import fcntl
+import functools
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from rest_framework.authtoken.models import Token
+from rest_framework.throttling import BaseThrottle
+
+from authproxy.settings import (
+    THROTTLE_BYTE_RATES,
+    THROTTLE_RATES,
+    THROTTLE_SLOTS,
+    THROTTLE_STORE,
+)
+
+# Key used in the rate settings for users that are not logged in
+ANONYMOUS = "anonymous"
+# Key used in the rate settings for the limits of a repository
+REPOSITORY = "repository"
+# Value of a per-user override that disables the limit
+UNLIMITED = "none"
+
+_PERIODS = {
+    "s": 1,
+    "sec": 1,
+    "m": 60,
+    "min": 60,
+    "h": 3600,
+    "hour": 3600,
+    "d": 86400,
+    "day": 86400,
+}
+_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+_RATE = re.compile(r"^\s*(\d+)\s*([kmg]?)b?\s*/\s*([a-z]+)\s*$", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_rate(rate: str) -> tuple[float, float]:
+    """Parse a rate like "1200/min" or "10G/day" into (capacity, tokens per second)
+
+    Raises:
+        ValueError: When the rate is invalid
+    """
+    match = _RATE.match(rate)
+    if not match or match.group(3).lower() not in _PERIODS:
+        raise ValueError(f"Invalid rate {rate!r}, expected e.g. 100/min or 10G/day")
+    capacity = int(match.group(1)) * _UNITS[match.group(2).lower()]
+    return capacity, capacity / _PERIODS[match.group(3).lower()]
+
+
+def validate_rate(value: str) -> None:
+    """Validator for the per-user rate overrides"""
+    if not value or value.lower() == UNLIMITED:
+        return
+    try:
+        parse_rate(value)
+    except ValueError as e:
+        raise ValidationError(str(e)) from e
+
+
+class BucketStore:
+    """Token buckets in a memory mapped file"""
+
+    # key hash, tokens, time of the last update
+    SLOT = struct.Struct("<Qdd")
+
+    def __init__(self, path: str, slots: int) -> None:
+        self.path = path
+        self.slots = slots
+        self._map: mmap.mmap | None = None
+        self._fd: int | None = None
+        self._pid: int | None = None
+        # Byte range locks only exclude other processes, threads are excluded by this lock
+        self._lock = threading.Lock()
+
+    def _open(self) -> None:
+        size = self.slots * self.SLOT.size
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._map = mmap.mmap(fd, size)
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def take(
+        self,
+        key: str,
+        capacity: float,
+        refill: float,
+        amount: float = 1,
+        allow_debt: bool = False,
+    ) -> float:
+        """Take tokens from a bucket
+
+        Args:
+            key (str): The bucket
+            capacity (float): Maximum number of tokens
+            refill (float): Tokens added per second
+            amount (float): Tokens to take
+            allow_debt (bool): Always take the tokens, even if the bucket goes negative.
+                Used for byte counts that are only known after the request.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds until enough tokens are available
+        """
+        digest = int.from_bytes(
+            hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+        offset = (digest % self.slots) * self.SLOT.size
+        with self._lock:
+            if self._map is None or self._pid != os.getpid():
+                self._open()
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT.size, offset)
+            try:
+                stored, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+                now = time.time()
+                if stored != digest:
+                    tokens = capacity
+                else:
+                    tokens = min(capacity, tokens + max(now - updated, 0) * refill)
+                wait = 0.0
+                if allow_debt or tokens >= amount:
+                    tokens -= amount
+                else:
+                    wait = (amount - tokens) / refill if refill else float("inf")
+                self.SLOT.pack_into(self._map, offset, digest, tokens, now)
+                return wait
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT.size, offset)
+
+
+STORE = BucketStore(THROTTLE_STORE, THROTTLE_SLOTS)
+
+
+def user_rates(user) -> tuple[str | None, str | None]:
+    """Get the request and byte rate of a user, None means unlimited"""
+    if user.is_anonymous:
+        role = ANONYMOUS
+    elif user.is_superuser:
+        return None, None
+    else:
+        role = user.role
+    request_rate = user.throttle_rate if user.is_authenticated else ""
+    byte_rate = user.throttle_byte_rate if user.is_authenticated else ""
+    request_rate = request_rate or THROTTLE_RATES.get(role)
+    byte_rate = byte_rate or THROTTLE_BYTE_RATES.get(role)
+    return (
+        None if not request_rate or request_rate.lower() == UNLIMITED else request_rate,
+        None if not byte_rate or byte_rate.lower() == UNLIMITED else byte_rate,
+    )
+
+
+def client_ident(request) -> str:
+    """The address of the client, taken from X-Forwarded-For behind NUM_PROXIES proxies"""
+    return BaseThrottle().get_ident(request)
+
+
+def _user_key(request) -> str:
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"{ANONYMOUS}:{client_ident(request)}"
+
+
+def _token_key(request) -> str | None:
+    auth = getattr(request, "auth", None)
+    if isinstance(auth, Token):
+        return f"token:{auth.key}"
+    return None
+
+
+def user_buckets(request, byte_rate: bool = False) -> list[tuple[str, str]]:
+    """The (bucket key, rate) pairs of the user and API token of a request"""
+    request_rate, user_byte_rate = user_rates(request.user)
+    rate = user_byte_rate if byte_rate else request_rate
+    if rate is None:
+        return []
+    prefix = "bytes:" if byte_rate else "requests:"
+    buckets = [(prefix + _user_key(request), rate)]
+    if token_key := _token_key(request):
+        buckets.append((prefix + token_key, rate))
+    return buckets
+
+
+def repository_buckets(
+    repository_id: str | None, byte_rate: bool = False
+) -> list[tuple[str, str]]:
+    """The (bucket key, rate) pairs of a repository"""
+    rate = (THROTTLE_BYTE_RATES if byte_rate else THROTTLE_RATES).get(REPOSITORY)
+    if not rate or repository_id is None:
+        return []
+    prefix = "bytes:" if byte_rate else "requests:"
+    return [(f"{prefix}{REPOSITORY}:{repository_id}", rate)]
+
+
+def debit_bytes(request, repository_id: str | None, amount: int) -> None:
+    """Take the bytes of a finished request from the byte buckets of the user, token and repository.
+
+    The buckets may go negative, further requests are then throttled until they are refilled.
+    """
+    if not amount:
+        return
+    buckets = user_buckets(request, byte_rate=True) + repository_buckets(
+        repository_id, byte_rate=True
+    )
+    for key, rate in buckets:
+        capacity, refill = parse_rate(rate)
+        STORE.take(key, capacity, refill, amount=amount, allow_debt=True)
+
+
+class Meter:
+    """Count the bytes exchanged with RDF4J for a request and debit them from the byte buckets"""
+
+    def __init__(self, request) -> None:
+        self.request = request
+        resolver_match = getattr(request, "resolver_match", None)
+        self.repository_id = (
+            resolver_match.kwargs.get("repository_id") if resolver_match else None
+        )
+        self.bytes = 0
+
+    def count(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass the chunks through and count them"""
+        for chunk in chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+    async def acount(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """Async version of count()"""
+        async for chunk in chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def debit(self) -> None:
+        """Debit the bytes counted so far"""
+        debit_bytes(self.request, self.repository_id, self.bytes)
+        self.bytes = 0
+
+    async def adebit(self) -> None:
+        """Async version of debit(), the buckets are locked with fcntl"""
+        await sync_to_async(self.debit)()
+
+    def count_response(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Count a response body and debit it once it was sent"""
+        try:
+            yield from self.count(chunks)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            self.debit()
+
+    async def acount_response(
+        self, chunks: AsyncIterable[bytes]
+    ) -> AsyncIterator[bytes]:
+        """Async version of count_response()"""
+        try:
+            async for chunk in self.acount(chunks):
+                yield chunk
+        finally:
+            await self.adebit()
+
+
+class BucketThrottle(BaseThrottle):
+    """Base class of the throttles, takes one token from each bucket of the request"""
+
+    # Byte buckets are debited after the request, they are only checked for debt before it
+    amount = 1
+
+    def __init__(self) -> None:
+        self._wait = 0.0
+
+    def get_buckets(self, request, view) -> list[tuple[str, str]]:
+        """The (bucket key, rate) pairs to take from"""
+        raise NotImplementedError
+
+    def allow_request(self, request, view) -> bool:
+        for key, rate in self.get_buckets(request, view):
+            capacity, refill = parse_rate(rate)
+            wait = STORE.take(key, capacity, refill, amount=self.amount)
+            if wait:
+                self._wait = wait
+                return False
+        return True
+
+    def wait(self) -> float | None:
+        return self._wait
+
+
+def _repository_id(view) -> str | None:
+    return getattr(view, "kwargs", {}).get("repository_id")
+
+
+class UserThrottle(BucketThrottle):
+    """Requests of a user, the rate depends on the role and can be overridden per user"""
+
+    def get_buckets(self, request, view):
+        return user_buckets(request)[:1]
+
+
+class TokenThrottle(BucketThrottle):
+    """Requests with an API token, limited like the requests of its user"""
+
+    def get_buckets(self, request, view):
+        return user_buckets(request)[1:]
+
+
+class RepositoryThrottle(BucketThrottle):
+    """Requests to a repository from all users"""
+
+    def get_buckets(self, request, view):
+        return repository_buckets(_repository_id(view))
+
+
+class ByteThrottle(BucketThrottle):
+    """Bytes exchanged with RDF4J by a user, an API token and for a repository"""
+
+    amount = 0
+
+    def get_buckets(self, request, view):
+        return user_buckets(request, byte_rate=True) + repository_buckets(
+            _repository_id(view), byte_rate=True
+        )
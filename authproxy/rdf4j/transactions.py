@@ -0,0 +1,138 @@
+"""Bookkeeping of the RDF4J transactions that are proxied through the authproxy.
+
+A transaction is started with POST /repositories/<id>/transactions. RDF4J answers with the url of
+the new transaction, which is rewritten to point to the authproxy. The transaction is recorded with
+the user who started it, and only that user can use it afterwards.
+
+Every request to a transaction updates its last use. Transactions that are idle for longer than
+TRANSACTION_IDLE_TIMEOUT are rolled back on RDF4J by the rollback_idle_transactions command,
+so an abandoned transaction does not keep its locks.
+"""
+
+import functools
+from datetime import datetime, timedelta
+
+from django.db.models import Count
+from django.http import HttpResponseNotFound
+from django.utils import timezone
+from urllib3.exceptions import HTTPError
+
+from authproxy.settings import TRANSACTION_IDLE_TIMEOUT
+
+from . import backend
+from .models import Transaction
+
+
+def transaction_id_from(location: str) -> str:
+    """Get the id of a transaction from the url RDF4J answered with"""
+    return location.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+
+
+def register(repository_id: str, transaction_id: str, user) -> Transaction:
+    """Record a transaction that was started by a user"""
+    return Transaction.objects.create(
+        transaction_id=transaction_id, repository_slug=repository_id, owner=user
+    )
+
+
+def idle_since() -> datetime:
+    """Transactions that were not used since then are rolled back"""
+    return timezone.now() - timedelta(seconds=TRANSACTION_IDLE_TIMEOUT)
+
+
+def touch(repository_id: str, transaction_id: str, user) -> bool:
+    """Update the last use of a transaction with a single query
+
+    Returns:
+        bool: Whether the transaction is open and owned by the user
+    """
+    if not user.is_authenticated:
+        return False
+    return bool(
+        Transaction.objects.filter(
+            transaction_id=transaction_id,
+            repository_slug=repository_id,
+            owner=user,
+            last_used__gte=idle_since(),
+        ).update(last_used=timezone.now())
+    )
+
+
+def forget(transaction_id: str) -> None:
+    """Remove a committed or rolled back transaction"""
+    Transaction.objects.filter(transaction_id=transaction_id).delete()
+
+
+def pinned(func):
+    """Decorate a view of a transaction, so only the user who started it can use it.
+
+    Use it below RepoPermission.write. Unknown, foreign and idle transactions are answered with 404.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # The request is always the last arg, like in RepoPermission.wrap_view
+        request = args[-1]
+        if not touch(kwargs["repository_id"], kwargs["transaction_id"], request.user):
+            return HttpResponseNotFound()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def rollback(transaction: Transaction) -> None:
+    """Roll back a transaction on RDF4J
+
+    Raises:
+        urllib3.exceptions.HTTPError: When RDF4J cannot be reached
+    """
+    response = backend.request(
+        "DELETE",
+        backend.repository_url(
+            transaction.repository_slug, "transactions", transaction.transaction_id
+        ),
+    )
+    # RDF4J forgets transactions on its own as well, 404 means it is already gone
+    if response.status not in (204, 404):
+        raise HTTPError(
+            f"Rolling back {transaction} failed with status {response.status}"
+        )
+
+
+def rollback_idle() -> tuple[int, list[str]]:
+    """Roll back the idle transactions
+
+    Returns:
+        tuple[int, list[str]]: The number of rolled back transactions and the errors
+    """
+    count = 0
+    errors = []
+    cutoff = idle_since()
+    for transaction in Transaction.objects.filter(last_used__lt=cutoff):
+        # Claim the transaction, unless it was used or claimed in the meantime
+        claimed, _ = Transaction.objects.filter(
+            pk=transaction.pk, last_used__lt=cutoff
+        ).delete()
+        if not claimed:
+            continue
+        try:
+            rollback(transaction)
+        except HTTPError as e:
+            errors.append(f"{transaction}: {e}")
+        else:
+            count += 1
+    return count, errors
+
+
+def stats() -> dict:
+    """Number of open transactions, in total and per repository"""
+    per_repository = dict(
+        Transaction.objects.values_list("repository_slug")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    return {
+        "open": sum(per_repository.values()),
+        "idle": Transaction.objects.filter(last_used__lt=idle_since()).count(),
+        "per_repository": per_repository,
+    }
@@ -43,6 +43,31 @@ urlpatterns = [
         rdf4j.repositories.NamespacesPrefixView.as_view(),
         name="namespaces_prefix",
     ),
+    path(
+        "repositories/<str:repository_id>/rdf-graphs",
+        rdf4j.repositories.graphs,
+        name="graphs",
+    ),
+    path(
+        "repositories/<str:repository_id>/rdf-graphs/service",
+        rdf4j.repositories.GraphStoreView.as_view(),
+        name="graph_store",
+    ),
+    path(
+        "repositories/<str:repository_id>/rdf-graphs/<str:graph_name>",
+        rdf4j.repositories.GraphStoreView.as_view(),
+        name="named_graph",
+    ),
+    path(
+        "repositories/<str:repository_id>/transactions",
+        rdf4j.repositories.TransactionsView.as_view(),
+        name="transactions",
+    ),
+    path(
+        "repositories/<str:repository_id>/transactions/<str:transaction_id>",
+        rdf4j.repositories.TransactionView.as_view(),
+        name="transaction",
+    ),
     # -------------------
     # -- GraphDB Paths --
     # -------------------
@@ -53,6 +78,11 @@ urlpatterns = [
         graphdb.security.UsersView.as_view(),
         name="statements",
     ),
+    path(
+        "rest/security/bulk/users",
+        graphdb.security.BulkUsersView.as_view(),
+        name="bulk_users",
+    ),
     # /rest/repositories
     path(
         "rest/repositories",
@@ -74,8 +104,23 @@ urlpatterns = [
         graphdb.repositories.size,
         name="rest_repository_size",
     ),
-    # TODO: Graph Store
-    # TODO: Transactions
+    path(
+        "rest/repositories/<str:repository_id>/jobs",
+        graphdb.repositories.jobs,
+        name="rest_repository_jobs",
+    ),
+    path(
+        "rest/repositories/<str:repository_id>/bulk-load",
+        graphdb.repositories.BulkLoadsView.as_view(),
+        name="rest_repository_bulk_loads",
+    ),
+    path(
+        "rest/repositories/<str:repository_id>/bulk-load/<str:load_id>",
+        graphdb.repositories.BulkLoadView.as_view(),
+        name="rest_repository_bulk_load",
+    ),
+    # /rest/monitor
+    path("rest/monitor/authproxy", graphdb.monitor.authproxy, name="monitor_authproxy"),
     # TODO: Protocol
     # Query view
     path("query/<repository_id>", sparql.query, name="query"),
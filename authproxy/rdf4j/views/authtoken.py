@@ -0,0 +1,39 @@
+"""Views for obtaining API tokens"""
+
+from rest_framework.authtoken import views
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+
+from ..authentication import token_expired, token_expires
+
+
+class ObtainAuthToken(views.ObtainAuthToken):
+    """Obtain an API token with username and password.
+
+    Expired tokens are replaced with a new one. Post `rotate=true` along with the credentials
+    to replace a token that is still valid.
+    """
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data["user"]
+        rotate = str(request.data.get("rotate", "")).lower() in ["1", "true", "yes"]
+
+        token = Token.objects.filter(user=user).first()
+        if token is not None and (rotate or token_expired(token)):
+            token.delete()
+            token = None
+        if token is None:
+            token = Token.objects.create(user=user)
+
+        expires = token_expires(token)
+        return Response(
+            {
+                "token": token.key,
+                "expires": expires.isoformat() if expires is not None else None,
+            }
+        )
+
+
+obtain_auth_token = ObtainAuthToken.as_view()
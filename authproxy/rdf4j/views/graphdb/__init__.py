@@ -1 +1 @@
-from . import repositories, security
+from . import monitor, repositories, security
@@ -0,0 +1,27 @@
+"""Views for monitoring the authproxy itself"""
+
+from django.http import JsonResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+from ... import backend, compression, jobs, query_cache, scheduler, transactions
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def authproxy(request):
+    """
+    Statistics of the worker process that handles this request
+
+    Route: /rest/monitor/authproxy
+    """
+    return JsonResponse(
+        {
+            "backend": backend.stats(),
+            "query_cache": query_cache.stats(),
+            "scheduler": scheduler.stats(),
+            "remote_jobs": jobs.stats(),
+            "compressed_uploads": compression.stats(),
+            "transactions": transactions.stats(),
+        }
+    )
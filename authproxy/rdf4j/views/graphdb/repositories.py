@@ -4,13 +4,26 @@ import json
 
 from django.db.utils import IntegrityError
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse, JsonResponse, HttpResponseNotFound
+from django.urls import reverse
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    JsonResponse,
+    HttpResponseNotFound,
+)
 
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import BasePermission
 
-from ...models import Repository
+from ... import bulk_load, compression, provisioning, throttling
+from ...models import RemoteJob, Repository, RepoPermission
 from .. import ErrorResponse
+from ..rdf4j.repositories import (
+    iter_request_body,
+    request_stream,
+    unsupported_encoding,
+)
 
 
 def dummy_redirect(request):
@@ -18,6 +31,13 @@ def dummy_redirect(request):
     return HttpResponse(f"Method: {request.method} on {request.path}, ")
 
 
+def jobs_accepted(repository_id: str) -> HttpResponse:
+    """202 response that points to the status of the RDF4J jobs of the repository"""
+    response = HttpResponse(status=202)
+    response["Location"] = reverse("rest_repository_jobs", args=[repository_id])
+    return response
+
+
 class RepositoriesView(APIView):
     """Views for /rest/repositories"""
 
@@ -57,11 +77,31 @@ class RepositoriesView(APIView):
         except json.decoder.JSONDecodeError as e:
             return ErrorResponse(status=500, error=e)
 
+        if isinstance(settings, list):
+            return self.post_many(request, settings)
         try:
-            Repository.from_dict(settings)
+            repository = Repository.from_dict(settings)
         except IntegrityError as e:
             return ErrorResponse(error=e, status=400)
-        return HttpResponse()
+        # The repository is created on RDF4J in the background
+        return jobs_accepted(repository.slug)
+
+    def post_many(self, request, settings: list):
+        """Create a list of repositories at once, the remotes are created concurrently.
+
+        Reports for every repository if it was created, failing repositories don't affect the others.
+        """
+        if not request.user.has_perm("rdf4j.add_repository"):
+            return HttpResponseForbidden()
+        results = provisioning.create_repositories(settings)
+        created = sum(result["created"] for result in results)
+        return JsonResponse(
+            {
+                "created": created,
+                "failed": len(results) - created,
+                "repositories": results,
+            }
+        )
 
 
 class RepositoryView(APIView):
@@ -73,7 +113,8 @@ class RepositoryView(APIView):
         repository = get_object_or_404(Repository, slug=repository_id)
         try:
             repository.delete()
-            return HttpResponse()
+            # The repository is deleted from RDF4J in the background
+            return jobs_accepted(repository_id)
         except IntegrityError as e:
             return ErrorResponse(status=400, error=e)
 
@@ -123,7 +164,114 @@ def restart(request, repository_id: str):
 
 @api_view(["GET"])
 def size(request, repository_id: str):
-    """Get repository size"""
+    """Get repository size
+
+    The size may be stale if the repository was written to recently, pass exact=true to get the exact size.
+    """
 
     repository = get_object_or_404(Repository, slug=repository_id)
-    return HttpResponse(content=repository.size())
+    exact = request.GET.get("exact", "false").lower() == "true"
+    return HttpResponse(content=repository.size(stale_ok=not exact))
+
+
+class CanViewRepositories(BasePermission):
+    """The view_repository permission, answers API clients with 401 or 403 instead of a redirect"""
+
+    def has_permission(self, request, view):
+        return request.user.has_perm("rdf4j.view_repository")
+
+
+@api_view(["GET"])
+@permission_classes([CanViewRepositories])
+def jobs(request, repository_id: str):
+    """Get the status of the creation and deletion of a repository on RDF4J, newest first
+
+    Route: /rest/repositories/<repository_id>/jobs
+    """
+    return JsonResponse(
+        [
+            job.to_dict()
+            for job in RemoteJob.objects.filter(repository_slug=repository_id).order_by(
+                "-pk"
+            )
+        ],
+        safe=False,
+    )
+
+
+def bulk_load_status(checkpoint: bulk_load.Checkpoint) -> dict:
+    """Status of a load for the API, without the paths on the server"""
+    status = checkpoint.to_dict()
+    del status["dataPath"], status["done"]
+    if checkpoint.state == bulk_load.RUNNING and not checkpoint.running:
+        status["state"] = "interrupted"
+    return status
+
+
+class BulkLoadsView(APIView):
+    """View for /rest/repositories/{repositoryID}/bulk-load"""
+
+    @RepoPermission.write
+    def post(self, request, repository_id: str):
+        """Upload an N-Triples or N-Quads file and queue it to be loaded in parallel batches
+
+        The body may be gzip or zstd compressed (Content-Encoding). The response points to the
+        status of the load.
+        """
+        content_type = request.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in bulk_load.CONTENT_TYPES.values():
+            return HttpResponse(
+                f"Expected {' or '.join(bulk_load.CONTENT_TYPES.values())}", status=415
+            )
+        try:
+            encoding = compression.request_encoding(request)
+        except compression.UnsupportedEncoding as e:
+            return unsupported_encoding(e)
+        meter = throttling.Meter(request)
+        if encoding is not None:
+            body = compression.decompress_chunks(request_stream(request), encoding)
+        else:
+            body = iter_request_body(request)
+        try:
+            load_id = bulk_load.spool(repository_id, meter.count(body), content_type)
+        except compression.DecompressionError as e:
+            return ErrorResponse(status=e.status, error=e)
+        finally:
+            meter.debit()
+        # The load is run by the run_bulk_loads command
+        response = HttpResponse(status=202)
+        response["Location"] = reverse(
+            "rest_repository_bulk_load", args=[repository_id, load_id]
+        )
+        return response
+
+
+class BulkLoadView(APIView):
+    """View for /rest/repositories/{repositoryID}/bulk-load/{loadID}"""
+
+    @staticmethod
+    def checkpoint(repository_id: str, load_id: str) -> bulk_load.Checkpoint | None:
+        path = bulk_load.checkpoint_path_for(load_id)
+        checkpoint = bulk_load.Checkpoint.read(path) if path else None
+        if checkpoint is None or checkpoint.repository_id != repository_id:
+            return None
+        return checkpoint
+
+    @RepoPermission.read
+    def get(self, request, repository_id: str, load_id: str):
+        """Get the progress of a load"""
+        checkpoint = self.checkpoint(repository_id, load_id)
+        if checkpoint is None:
+            return HttpResponseNotFound()
+        return JsonResponse(bulk_load_status(checkpoint))
+
+    @RepoPermission.write
+    def post(self, request, repository_id: str, load_id: str):
+        """Resume an interrupted or failed load from its checkpoint"""
+        checkpoint = self.checkpoint(repository_id, load_id)
+        if checkpoint is None:
+            return HttpResponseNotFound()
+        bulk_load.queue(checkpoint)
+        response = JsonResponse(bulk_load_status(checkpoint), status=202)
+        response["Location"] = request.path
+        return response
@@ -4,12 +4,18 @@ import json
 
 from django.contrib.auth.decorators import permission_required
 from django.db.utils import IntegrityError
-from django.http import HttpResponse, HttpResponseNotFound, JsonResponse
+from django.http import (
+    HttpResponse,
+    HttpResponseNotFound,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from rest_framework.decorators import api_view
 from rest_framework.views import APIView
 
+from ... import provisioning
 from ...models import User
 
 
@@ -20,13 +26,95 @@ def users(request):
     List all users
 
     Route: /rest/security/users
+
+    The listing is built from two queries (three when paginated) regardless of the number
+    of users and streamed as it is serialized.
+
+    Query parameters:
+        offset, limit: Paginate the listing
+        username: Only list users whose username contains the value
+        role: Only list users with the role, e.g. ROLE_USER
     """
-    response_data = {}
-    # JsonResponse does not like lists, so we build the indices ourselves
-    for i, user in enumerate(User.objects.all()):
-        response_data[i] = user.normalize()
+    try:
+        offset = int(request.GET.get("offset", 0))
+        limit = int(request.GET["limit"]) if "limit" in request.GET else None
+    except ValueError:
+        return JsonResponse(
+            status=400, data={"message": "offset and limit must be integers"}
+        )
+    if offset < 0 or (limit is not None and limit < 0):
+        return JsonResponse(
+            status=400, data={"message": "offset and limit must not be negative"}
+        )
+
+    user_lookups = {}
+    if "username" in request.GET:
+        user_lookups["username__icontains"] = request.GET["username"]
+    if "role" in request.GET:
+        user_lookups["role"] = request.GET["role"]
+
+    user_queryset = User.objects.filter(**user_lookups).order_by("pk")
+    permission_queryset = provisioning.repository_grants(**user_lookups)
+    if offset or limit is not None:
+        end = offset + limit if limit is not None else None
+        page = list(user_queryset.values_list("pk", flat=True)[offset:end])
+        if page:
+            user_queryset = user_queryset.filter(pk__gte=page[0], pk__lte=page[-1])
+            permission_queryset = permission_queryset.filter(
+                user_id__gte=page[0], user_id__lte=page[-1]
+            )
+        else:
+            user_queryset = user_queryset.none()
+            permission_queryset = permission_queryset.none()
+
+    def stream():
+        # JsonResponse does not like lists, so we build the indices ourselves
+        yield "{"
+        for i, (user, codenames) in enumerate(
+            provisioning.iter_users(
+                user_queryset.iterator(), permission_queryset.iterator()
+            )
+        ):
+            separator = ", " if i else ""
+            yield f"{separator}{json.dumps(str(offset + i))}: {json.dumps(user.normalize(codenames))}"
+        yield "}"
+
+    return StreamingHttpResponse(stream(), content_type="application/json")
+
 
-    return JsonResponse(response_data)
+class BulkUsersView(APIView):
+    """Views for the /rest/security/bulk/users route"""
+
+    @method_decorator(permission_required("admin.view_user"))
+    def get(self, request):
+        """Export all users as NDJSON
+
+        Query parameters:
+            passwordHashes: true includes the password hashes, so the users can be imported elsewhere
+        """
+        password_hashes = request.GET.get("passwordHashes", "false").lower() == "true"
+        return StreamingHttpResponse(
+            provisioning.export_users(password_hashes=password_hashes),
+            content_type="application/x-ndjson",
+        )
+
+    @method_decorator(permission_required("admin.add_user"))
+    @method_decorator(permission_required("admin.change_user"))
+    def post(self, request):
+        """Create or update the users of an NDJSON body in one transaction
+
+        Query parameters:
+            dryRun: true only validates the users
+        """
+        # Read the body line by line from the underlying request, it can be large
+        http_request = getattr(request, "_request", request)
+        try:
+            records = provisioning.validate(http_request)
+        except provisioning.InvalidUsers as e:
+            return JsonResponse(status=400, data=e.as_dict())
+        if request.GET.get("dryRun", "false").lower() == "true":
+            return JsonResponse({"created": 0, "updated": 0, "valid": len(records)})
+        return JsonResponse(provisioning.import_users(records))
 
 
 class UsersView(APIView):
@@ -0,0 +1,339 @@
+"""Async versions of the data-plane views for talking directly to the Rdf4J API.
+
+These are only routed when the authproxy is served through authproxy/asgi.py, see authproxy/asgi_urls.py.
+A long running query or export then only occupies a coroutine instead of one of the few uwsgi threads.
+The permission checks are the same as in repositories.py.
+"""
+
+import functools
+import math
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from ... import backend, compression, etags, query_cache, scheduler, throttling
+from ...models import RepoPermission
+from .repositories import (
+    copy_response_headers,
+    forward_headers,
+    rdf4j_url,
+    unsupported_encoding,
+)
+
+
+def authenticate(request: HttpRequest) -> HttpResponse | None:
+    """Authenticate the request with the configured rest_framework authentication classes.
+
+    Sets request.user and request.auth, returns an error response when authentication fails.
+    """
+    authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    drf_request = Request(request, authenticators=authenticators)
+    try:
+        request.user = drf_request.user
+        request.auth = drf_request.auth
+    except exceptions.AuthenticationFailed as e:
+        response = HttpResponse(str(e.detail), status=e.status_code)
+        if authenticators:
+            header = authenticators[0].authenticate_header(drf_request)
+            if header:
+                response["WWW-Authenticate"] = header
+        return response
+    return None
+
+
+def throttle(request: HttpRequest, view) -> HttpResponse | None:
+    """Check the configured rest_framework throttles, returns an error response when throttled"""
+    waits = []
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle_instance = throttle_class()
+        if not throttle_instance.allow_request(request, view):
+            waits.append(throttle_instance.wait())
+    if not waits:
+        return None
+    wait = max((wait for wait in waits if wait is not None), default=None)
+    error = exceptions.Throttled(wait)
+    response = HttpResponse(str(error.detail), status=error.status_code)
+    if wait is not None:
+        response["Retry-After"] = str(math.ceil(wait))
+    return response
+
+
+def async_api_view(http_method_names: list[str]):
+    """Async counterpart of rest_framework's api_view for function views"""
+    allowed = [method.upper() for method in http_method_names]
+
+    def decorator(func):
+        @csrf_exempt
+        @functools.wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method not in allowed:
+                return HttpResponse(status=405, headers={"Allow": ", ".join(allowed)})
+            error = await sync_to_async(authenticate)(request)
+            if error is None:
+                error = await sync_to_async(throttle)(
+                    request, SimpleNamespace(args=args, kwargs=kwargs)
+                )
+            if error is not None:
+                return error
+            return await func(request, *args, **kwargs)
+
+        return view
+
+    return decorator
+
+
+class AsyncAPIView(View):
+    """Async counterpart of rest_framework's APIView, only handles authentication"""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Like APIView, authentication is not session based, so CSRF checks are not needed
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        error = await sync_to_async(authenticate)(request)
+        if error is None:
+            # The buckets are locked with fcntl, which blocks
+            error = await sync_to_async(throttle)(request, self)
+        if error is not None:
+            return error
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def iter_request_body(request: HttpRequest, chunk_size: int = backend.CHUNK_SIZE):
+    """Read the (spooled) request body in fixed-size chunks without blocking the event loop"""
+    read = sync_to_async(request.read)
+    while chunk := await read(chunk_size):
+        yield chunk
+
+
+async def rdf4j_redirect(
+    request: HttpRequest, stream_body: bool = False, compress: bool = True
+):
+    """Redirect to the RDF4J server endpoint without blocking the event loop
+
+    Args:
+        request (HttpRequest): The request to forward
+        stream_body (bool): Stream the request body to RDF4J using chunked transfer encoding.
+            A gzip or zstd compressed body is decompressed while it is streamed.
+        compress (bool): Compress the response if the client accepts it
+    """
+    client = backend.get_async_client()
+    meter = throttling.Meter(request)
+    if stream_body:
+        try:
+            encoding = compression.request_encoding(request)
+        except compression.UnsupportedEncoding as e:
+            return unsupported_encoding(e)
+        if encoding is not None:
+            content = compression.adecompress_chunks(request, encoding)
+        else:
+            content = iter_request_body(request)
+        # Uploads are counted uncompressed
+        content = meter.acount(content)
+    else:
+        content = request.body
+        meter.bytes += len(content)
+    rdf4j_request = client.build_request(
+        method=request.method,
+        url=rdf4j_url(request),
+        content=content,
+        headers=forward_headers(request, stream_body),
+    )
+    try:
+        rdf4j_response = await client.send(rdf4j_request, stream=True)
+    except compression.DecompressionError as e:
+        # The upload was aborted, RDF4J discards the incomplete chunked body
+        return HttpResponse(str(e), status=e.status)
+    finally:
+        await meter.adebit()
+
+    response = StreamingHttpResponse(
+        streaming_content=meter.acount_response(backend.aiter_response(rdf4j_response))
+    )
+    copy_response_headers(response, rdf4j_response.headers)
+    response.status_code = rdf4j_response.status_code
+
+    if compress:
+        return compression.compress(request, response)
+    return response
+
+
+async def cached_rdf4j_redirect(request: HttpRequest, repository_id: str):
+    """Answer a SPARQL query from the query cache, or redirect it to RDF4J and cache the result"""
+    key = query_cache.cache_key(request, repository_id)
+    if key is None:
+        return await rdf4j_redirect(request)
+    generation = await sync_to_async(query_cache.current_generation)(repository_id)
+    response = query_cache.cached_response(key, generation, asynchronous=True)
+    if response is not None:
+        return compression.compress(request, response)
+
+    # The cache stores the uncompressed result
+    response = await rdf4j_redirect(request, compress=False)
+    response.streaming_content = query_cache.atee(
+        key,
+        generation,
+        response.status_code,
+        response.headers,
+        response.streaming_content,
+    )
+    return compression.compress(request, response)
+
+
+class RepositoryView(AsyncAPIView):
+    """View for the /repositories/{repository_id}"""
+
+    @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
+    async def get(self, request, repository_id):
+        """Execute a SPARQL query on the repository."""
+        return await cached_rdf4j_redirect(request, repository_id)
+
+    @RepoPermission.read
+    @scheduler.admit
+    async def post(self, request, repository_id):
+        """Execute a SPARQL query on the repository."""
+        return await cached_rdf4j_redirect(request, repository_id)
+
+    async def put(self, request, repository_id):
+        """Create a new repository on the server."""
+        return await rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def delete(self, request, repository_id):
+        """Delete a specific repository by ID."""
+        return await rdf4j_redirect(request)
+
+
+@async_api_view(["GET"])
+@RepoPermission.read
+@etags.conditional
+@scheduler.admit
+async def repository_size(request, repository_id):
+    """View for the /repositories/{repository_id}/size route"""
+    return await rdf4j_redirect(request)
+
+
+@async_api_view(["GET"])
+@RepoPermission.read
+@etags.conditional
+@scheduler.admit
+async def repository_contexts(request, repository_id):
+    """View for the /repositories/{repository_id}/contexts route"""
+    return await rdf4j_redirect(request)
+
+
+class StatementsView(AsyncAPIView):
+    """View for the /repositories/{repository_id}/statements"""
+
+    @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
+    async def get(self, request, repository_id):
+        """Get RDF statements from the repository matching the filtering parameters"""
+        return await rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def post(self, request, repository_id):
+        """Update the data in the repository."""
+        return await rdf4j_redirect(request, stream_body=True)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def delete(self, request, repository_id):
+        """Deletes statements from the repository matching the filtering parameters"""
+        return await rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def put(self, request, repository_id):
+        """Update data in the repository, replacing any existing data with the supplied data"""
+        return await rdf4j_redirect(request, stream_body=True)
+
+
+class NamespacesView(AsyncAPIView):
+    """View for the /repositories/{repository_id}/namespaces"""
+
+    @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
+    async def get(self, request, repository_id):
+        """Fetch all namespace declaration info available in the repository"""
+        return await rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def delete(self, request, repository_id):
+        """Remove all namespace declarations from the repository"""
+        return await rdf4j_redirect(request)
+
+
+class NamespacesPrefixView(AsyncAPIView):
+    """View for the /repositories/{repository_id}/namespaces/{namespaces_prefix}"""
+
+    @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
+    async def get(self, request, repository_id, namespaces_prefix):
+        """Gets the namespace that has been defined for a particular prefix."""
+        return await rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def put(self, request, repository_id, namespaces_prefix):
+        """Sets a new namespace for a particular prefix."""
+        return await rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def delete(self, request, repository_id, namespaces_prefix):
+        """Removes the namespace that has been defined for a particular prefix."""
+        return await rdf4j_redirect(request)
+
+
+@async_api_view(["GET"])
+@RepoPermission.read
+@etags.conditional
+@scheduler.admit
+async def graphs(request, repository_id):
+    """View for the /repositories/{repository_id}/rdf-graphs route"""
+    return await rdf4j_redirect(request)
+
+
+class GraphStoreView(AsyncAPIView):
+    """View for the Graph Store Protocol routes"""
+
+    @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
+    async def get(self, request, repository_id, graph_name=None):
+        """Get the statements of the graph"""
+        return await rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def put(self, request, repository_id, graph_name=None):
+        """Replace the statements of the graph with the supplied data"""
+        return await rdf4j_redirect(request, stream_body=True)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def post(self, request, repository_id, graph_name=None):
+        """Add the supplied data to the graph"""
+        return await rdf4j_redirect(request, stream_body=True)
+
+    @RepoPermission.write
+    @scheduler.admit
+    async def delete(self, request, repository_id, graph_name=None):
+        """Delete the graph"""
+        return await rdf4j_redirect(request)
@@ -5,24 +5,54 @@ on method type to determine if a user needs to have write or read permissions to
 We have to create a view for every /repository route here and check for the necessary permissions.
 """
 
-import urllib3
-
+from django.urls import reverse
 from django.utils.http import urlencode
-from django.http import StreamingHttpResponse, HttpRequest
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+    HttpRequest,
+)
+from django.http.response import HttpResponseBase
 
 from rest_framework.decorators import api_view
 from rest_framework.views import APIView
 
-from authproxy.settings import RDF4J_URL, REQUEST_TIMEOUT
+from ... import (
+    backend,
+    compression,
+    etags,
+    query_cache,
+    scheduler,
+    throttling,
+    transactions,
+)
 from ...models import RepoPermission
 
 
-def rdf4j_redirect(request: HttpRequest):
-    """Redirect to th RDF4J server endpoint"""
+def request_stream(request: HttpRequest) -> HttpRequest:
+    """The request whose body can be read as a file from wsgi.input"""
+    # Unwrap the rest_framework request to get to the underlying stream
+    return getattr(request, "_request", request)
+
+
+def iter_request_body(request: HttpRequest, chunk_size: int = backend.CHUNK_SIZE):
+    """Read the request body from wsgi.input in fixed-size chunks as it arrives.
+
+    This never touches request.body, so the body is neither buffered in memory
+    nor subject to DATA_UPLOAD_MAX_MEMORY_SIZE.
+    """
+    http_request = request_stream(request)
+    while chunk := http_request.read(chunk_size):
+        yield chunk
+
+
+def rdf4j_url(request: HttpRequest) -> str:
+    """Build the RDF4J url that corresponds to the request"""
     # TODO: Fix this, this is a hack
     # Remove the prefixed slash from the path
     path = request.path[1:]
-    url = f"{RDF4J_URL}{path}"
+    url = backend.url(path)
 
     # Get the query parameters from the request
     query_params = {}
@@ -32,20 +62,34 @@ def rdf4j_redirect(request: HttpRequest):
     # urlencode the query params and attach them back to the url
     if query_params:
         url += "?" + urlencode(query_params)
-
-    # Forward the request to RDF4J
-    rdf4j_response = urllib3.request(
-        url=url,
-        body=request.body,
-        method=request.method,
-        headers=dict(request.headers),
-        timeout=REQUEST_TIMEOUT,
-        preload_content=False,  # stream the request
+    return url
+
+
+def forward_headers(request: HttpRequest, stream_body: bool = False) -> dict:
+    """Get the headers that are forwarded to RDF4J"""
+    headers = dict(request.headers)
+    # Responses are compressed by the authproxy (see compression.py), RDF4J sends them uncompressed
+    headers.pop("Accept-Encoding", None)
+    if stream_body:
+        # The body is re-framed with chunked transfer encoding and sent uncompressed
+        headers.pop("Content-Length", None)
+        headers.pop("Transfer-Encoding", None)
+        headers.pop("Content-Encoding", None)
+    return headers
+
+
+def unsupported_encoding(error: compression.UnsupportedEncoding) -> HttpResponse:
+    """Response for a request body that can't be decompressed"""
+    return HttpResponse(
+        str(error),
+        status=415,
+        headers={"Accept-Encoding": ", ".join(compression.DECODINGS)},
     )
 
-    response = StreamingHttpResponse(streaming_content=rdf4j_response)
-    # Set the headers in the response
-    for key in rdf4j_response.headers:
+
+def copy_response_headers(response: HttpResponseBase, headers) -> None:
+    """Set the headers from the RDF4J response in the response"""
+    for key in headers:
         # TODO: investigate the following
         # The Transfer- and Content-Encoding Header seem to cause problems:
         # Error Message:
@@ -55,14 +99,87 @@ def rdf4j_redirect(request: HttpRequest):
         # https://stackoverflow.com/questions/17504435/uwsgi-throws-io-error-caused-by-uwsgi-response-write-body-do-broken-pipe
         # this error stems from Django not responding to Nginx in time
         # For now skip these headers since they cause problems
-        if key not in ["Transfer-Encoding", "Content-Encoding"]:
-            response[key] = rdf4j_response.headers[key]
+        if key.title() not in ["Transfer-Encoding", "Content-Encoding"]:
+            response[key] = headers[key]
+
+
+def rdf4j_redirect(
+    request: HttpRequest, stream_body: bool = False, compress: bool = True
+):
+    """Redirect to th RDF4J server endpoint
+
+    Args:
+        request (HttpRequest): The request to forward
+        stream_body (bool): Stream the request body to RDF4J using chunked transfer encoding
+            instead of buffering it in memory first. Use this for (potentially) large uploads.
+            A gzip or zstd compressed body is decompressed while it is streamed.
+        compress (bool): Compress the response if the client accepts it
+    """
+    # Count the exchanged bytes for the byte rate limits
+    meter = throttling.Meter(request)
+    if stream_body:
+        try:
+            encoding = compression.request_encoding(request)
+        except compression.UnsupportedEncoding as e:
+            return unsupported_encoding(e)
+        if encoding is not None:
+            body = compression.decompress_chunks(request_stream(request), encoding)
+        else:
+            body = iter_request_body(request)
+        # Uploads are counted uncompressed
+        body = meter.count(body)
+    else:
+        body = request.body
+        meter.bytes += len(body)
 
+    # Forward the request to RDF4J
+    try:
+        rdf4j_response = backend.request(
+            method=request.method,
+            url=rdf4j_url(request),
+            body=body,
+            headers=forward_headers(request, stream_body),
+            stream=True,
+        )
+    except compression.DecompressionError as e:
+        # The upload was aborted, RDF4J discards the incomplete chunked body
+        return HttpResponse(str(e), status=e.status)
+    finally:
+        meter.debit()
+
+    response = StreamingHttpResponse(
+        streaming_content=meter.count_response(backend.iter_response(rdf4j_response))
+    )
+    copy_response_headers(response, rdf4j_response.headers)
     response.status_code = rdf4j_response.status
 
+    if compress:
+        return compression.compress(request, response)
     return response
 
 
+def cached_rdf4j_redirect(request: HttpRequest, repository_id: str):
+    """Answer a SPARQL query from the query cache, or redirect it to RDF4J and cache the result"""
+    key = query_cache.cache_key(request, repository_id)
+    if key is None:
+        return rdf4j_redirect(request)
+    generation = query_cache.current_generation(repository_id)
+    response = query_cache.cached_response(key, generation)
+    if response is not None:
+        return compression.compress(request, response)
+
+    # The cache stores the uncompressed result
+    response = rdf4j_redirect(request, compress=False)
+    response.streaming_content = query_cache.tee(
+        key,
+        generation,
+        response.status_code,
+        response.headers,
+        response.streaming_content,
+    )
+    return compression.compress(request, response)
+
+
 @api_view(["GET"])
 def index(request):
     """Render the SwaggerUI api reference"""
@@ -80,6 +197,8 @@ class RepositoryView(APIView):
     """View for the /repositories/{repository_id}"""
 
     @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
     def get(self, request, repository_id):
         """Execute a SPARQL query on the repository.
 
@@ -87,9 +206,10 @@ class RepositoryView(APIView):
         acceptable content-type. Note that RDF4J supports executing SPARQL queries with either a GET or a POST request.
         POST is supported for queries that are too large to be encoded as a query parameter.
         """
-        return rdf4j_redirect(request)
+        return cached_rdf4j_redirect(request, repository_id)
 
     @RepoPermission.read
+    @scheduler.admit
     def post(self, request, repository_id):
         """Execute a SPARQL query on the repository.
 
@@ -97,7 +217,7 @@ class RepositoryView(APIView):
         acceptable content-type. Note that RDF4J supports executing SPARQL queries with either a GET or a POST request.
         POST is supported for queries that are too large to be encoded as a query parameter.
         """
-        return rdf4j_redirect(request)
+        return cached_rdf4j_redirect(request, repository_id)
 
     def put(self, request, repository_id):
         """A new repository with can be created on the server by sending a PUT request to this endpoint.
@@ -109,6 +229,7 @@ class RepositoryView(APIView):
         return rdf4j_redirect(request)
 
     @RepoPermission.write
+    @scheduler.admit
     def delete(self, request, repository_id):
         """Delete a specific repository by ID.
 
@@ -120,6 +241,8 @@ class RepositoryView(APIView):
 
 @api_view(["GET"])
 @RepoPermission.read
+@etags.conditional
+@scheduler.admit
 def repository_size(request, repository_id):
     """View for the /repositories/{repository_id}/size route"""
     return rdf4j_redirect(request)
@@ -127,6 +250,8 @@ def repository_size(request, repository_id):
 
 @api_view(["GET"])
 @RepoPermission.read
+@etags.conditional
+@scheduler.admit
 def repository_contexts(request, repository_id):
     """View for the /repositories/{repository_id}/contexts route"""
     return rdf4j_redirect(request)
@@ -136,11 +261,14 @@ class StatementsView(APIView):
     """View for the /repositories/{repository_id}/statements"""
 
     @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
     def get(self, request, repository_id):
         """Get RDF statements from the repository matching the filtering parameters"""
         return rdf4j_redirect(request)
 
     @RepoPermission.write
+    @scheduler.admit
     def post(self, request, repository_id):
         """Update the data in the repository.
 
@@ -150,28 +278,33 @@ class StatementsView(APIView):
         If an RDF document is supplied, the statements found in the RDF document will be added to the repository.
         If a transaction document is supplied, the updates specified in the transaction document will be executed.
         """
-        return rdf4j_redirect(request)
+        return rdf4j_redirect(request, stream_body=True)
 
     @RepoPermission.write
+    @scheduler.admit
     def delete(self, request, repository_id):
         """Deletes statements from the repository matching the filtering parameters"""
         return rdf4j_redirect(request)
 
     @RepoPermission.write
+    @scheduler.admit
     def put(self, request, repository_id):
         """Update data in the repository, replacing any existing data with the supplied data"""
-        return rdf4j_redirect(request)
+        return rdf4j_redirect(request, stream_body=True)
 
 
 class NamespacesView(APIView):
     """View for the /repositories/{repository_id}/namespaces"""
 
     @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
     def get(self, request, repository_id):
         """Fetch all namespace declaration info available in the repository"""
         return rdf4j_redirect(request)
 
     @RepoPermission.write
+    @scheduler.admit
     def delete(self, request, repository_id):
         """Remove all namespace declarations from the repository"""
         return rdf4j_redirect(request)
@@ -181,11 +314,14 @@ class NamespacesPrefixView(APIView):
     """View for the /repositories/{repository_id}/namespaces/{namespaces_prefix}"""
 
     @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
     def get(self, request, repository_id, namespaces_prefix):
         """Gets the namespace that has been defined for a particular prefix."""
         return rdf4j_redirect(request)
 
     @RepoPermission.write
+    @scheduler.admit
     def put(self, request, repository_id, namespaces_prefix):
         """Sets a new namespace for a particular prefix.
 
@@ -194,6 +330,116 @@ class NamespacesPrefixView(APIView):
         return rdf4j_redirect(request)
 
     @RepoPermission.write
+    @scheduler.admit
     def delete(self, request, repository_id, namespaces_prefix):
         """Removes the namespace that has been defined for a particular prefix."""
         return rdf4j_redirect(request)
+
+
+@api_view(["GET"])
+@RepoPermission.read
+@etags.conditional
+@scheduler.admit
+def graphs(request, repository_id):
+    """View for the /repositories/{repository_id}/rdf-graphs route, lists the named graphs"""
+    return rdf4j_redirect(request)
+
+
+class GraphStoreView(APIView):
+    """View for the Graph Store Protocol routes
+
+    /repositories/{repository_id}/rdf-graphs/service addresses a graph with the graph or default
+    parameter, /repositories/{repository_id}/rdf-graphs/{graph_name} addresses a named graph directly.
+    """
+
+    @RepoPermission.read
+    @etags.conditional
+    @scheduler.admit
+    def get(self, request, repository_id, graph_name=None):
+        """Get the statements of the graph"""
+        return rdf4j_redirect(request)
+
+    @RepoPermission.write
+    @scheduler.admit
+    def put(self, request, repository_id, graph_name=None):
+        """Replace the statements of the graph with the supplied data, other graphs are not touched"""
+        return rdf4j_redirect(request, stream_body=True)
+
+    @RepoPermission.write
+    @scheduler.admit
+    def post(self, request, repository_id, graph_name=None):
+        """Add the supplied data to the graph"""
+        return rdf4j_redirect(request, stream_body=True)
+
+    @RepoPermission.write
+    @scheduler.admit
+    def delete(self, request, repository_id, graph_name=None):
+        """Delete the graph"""
+        return rdf4j_redirect(request)
+
+
+class TransactionsView(APIView):
+    """View for the /repositories/{repository_id}/transactions"""
+
+    @RepoPermission.write
+    @scheduler.admit
+    def post(self, request, repository_id):
+        """Start a new transaction on the repository.
+
+        RDF4J answers with the url of the transaction in the Location header, which is rewritten to
+        point to the authproxy. Only the user who started the transaction can use it.
+        """
+        if not request.user.is_authenticated:
+            return HttpResponseForbidden("Transactions need an authenticated user")
+        response = rdf4j_redirect(request)
+        location = response.get("Location")
+        if response.status_code == 201 and location:
+            transaction_id = transactions.transaction_id_from(location)
+            transactions.register(repository_id, transaction_id, request.user)
+            response["Location"] = request.build_absolute_uri(
+                reverse("transaction", args=[repository_id, transaction_id])
+            )
+        return response
+
+
+def transaction_action(request: HttpRequest, transaction_id: str):
+    """Redirect an action of a transaction to RDF4J and forget the transaction once it is committed"""
+    response = rdf4j_redirect(request, stream_body=True)
+    committed = request.GET.get("action", "").upper() == "COMMIT" and (
+        response.status_code in (200, 204)
+    )
+    if committed or response.status_code == 404:
+        transactions.forget(transaction_id)
+    return response
+
+
+class TransactionView(APIView):
+    """View for the /repositories/{repository_id}/transactions/{transaction_id}"""
+
+    @RepoPermission.write
+    @transactions.pinned
+    @scheduler.admit
+    def put(self, request, repository_id, transaction_id):
+        """Execute an action in the transaction.
+
+        The action parameter is one of ADD, DELETE, UPDATE, GET, SIZE, QUERY, PING, PREPARE
+        or COMMIT. The body of ADD, DELETE and UPDATE is streamed to RDF4J.
+        """
+        return transaction_action(request, transaction_id)
+
+    @RepoPermission.write
+    @transactions.pinned
+    @scheduler.admit
+    def post(self, request, repository_id, transaction_id):
+        """Execute an action in the transaction, older RDF4J clients use POST instead of PUT"""
+        return transaction_action(request, transaction_id)
+
+    @RepoPermission.write
+    @transactions.pinned
+    @scheduler.admit
+    def delete(self, request, repository_id, transaction_id):
+        """Roll back the transaction"""
+        response = rdf4j_redirect(request)
+        if response.status_code in (204, 404):
+            transactions.forget(transaction_id)
+        return response
@@ -1,5 +1,5 @@
-from django.http import HttpResponse, HttpRequest
-from django.shortcuts import render
+from django.http import HttpResponse, HttpRequest, Http404, JsonResponse
+from django.shortcuts import redirect, render
 
 from ..forms import QueryForm
 
@@ -7,38 +7,96 @@ from ..models import Repository, RepoPermission, Query
 
 from django.contrib.auth.decorators import login_required
 
+from .. import cursors, scheduler
+from ..results import QueryResult
+
 
 @RepoPermission.read
 @login_required
+@scheduler.admit
 def query(request: HttpRequest, repository_id: str) -> HttpResponse:
     return sparql(request, Query.Type.QUERY, repository_id)
 
 
 @RepoPermission.write
 @login_required
+@scheduler.admit
 def update(request: HttpRequest, repository_id: str) -> HttpResponse:
     return sparql(request, Query.Type.UPDATE, repository_id)
 
 
 def sparql(request: HttpRequest, query_type: str, repository_id: str) -> HttpResponse:
-    """Send a sparql query to the RDF4J endpoint"""
+    """Send a sparql query to the RDF4J endpoint
+
+    The rows of a query are kept in a cursor, further pages are requested with ?cursor=<id>&page=<n>.
+    Add format=json to the query string to get the result as JSON.
+    """
+    as_json = request.GET.get("format") == "json"
     result = "No result"
+    cursor = None
+    page = 0
     if request.method == "POST":
         form = QueryForm(request.POST)
         if form.is_valid():
             query = form.cleaned_data["sparql"]
             repository = Repository.objects.get(slug=repository_id)
             try:
-                result = repository.sparql(query, Query.Type(query_type))
+                result = repository.sparql(
+                    query,
+                    Query.Type(query_type),
+                    count=request.user.execute_count,
+                )
+                if isinstance(result, QueryResult) and result.vars:
+                    cursor = cursors.create(
+                        request.user.pk, repository_id, query, result
+                    )
             except ValueError as e:
                 return HttpResponse(str(e).encode(encoding="utf-8"))
+            if cursor is not None and not as_json:
+                # Reloading the page then shows the result instead of running the query again
+                return redirect(f"{request.path}?cursor={cursor.id}")
+    elif "cursor" in request.GET:
+        try:
+            cursor = cursors.get(request.GET["cursor"], request.user.pk, repository_id)
+            page = int(request.GET.get("page", 0))
+        except cursors.CursorNotFound as e:
+            raise Http404(
+                "The query result has expired, please run the query again"
+            ) from e
+        except ValueError:
+            page = 0
+        page = min(max(page, 0), cursor.pages - 1)
+        form = QueryForm(initial={"sparql": cursor.query})
     else:
         form = QueryForm()
 
+    if as_json:
+        if cursor is None:
+            message = (
+                result["message"]
+                if isinstance(result, dict)
+                else getattr(result, "message", result)
+            )
+            return JsonResponse({"message": message})
+        return JsonResponse(
+            {
+                "cursor": cursor.id,
+                "page": page,
+                "pages": cursor.pages,
+                "row_count": cursor.row_count,
+                "truncated": cursor.truncated,
+                "vars": cursor.vars,
+                "rows": list(cursor.page(page)),
+            }
+        )
+
     form_data = {
         "form": form,
         "repository_id": repository_id,
         "action": query_type,
         "result": result,
+        "cursor": cursor,
+        "page": page,
+        "rows": cursor.page(page) if cursor is not None else (),
     }
     return render(request, "rdf4j/sparql_template.html", form_data)